@@ -0,0 +1,23 @@
+# "conditional" module, e.g. import app.conditional
+#Conditional GET with strong ETags
+##Handlers compute the ETag from a version or a pre-serialized body and answer a matching
+##If-None-Match with an empty 304 before building the response.
+from fastapi import Response
+from fastapi.responses import JSONResponse
+
+from http_cache.etag import etag_for_body, etag_matches
+
+def not_modified(etag: str) -> Response:
+	return Response(status_code=304, headers={"ETag": etag})
+
+class StaticJSON:
+	"""A constant JSON body, serialized once with its ETag"""
+
+	def __init__(self, content):
+		self.body = JSONResponse(content).body
+		self.etag = etag_for_body(self.body)
+
+	def response(self, if_none_match: str | None) -> Response:
+		if etag_matches(if_none_match, self.etag):
+			return not_modified(self.etag)
+		return Response(self.body, media_type="application/json", headers={"ETag": self.etag})
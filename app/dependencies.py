@@ -1,6 +1,30 @@
 # "dependencies" module, e.g. import app.dependencies
 #Dependencies
-from fastapi import Header, HTTPException
+import os
+from datetime import datetime, timedelta
+
+from fastapi import Depends, Header, HTTPException, status
+from fastapi.security import OAuth2PasswordBearer
+from pydantic import BaseModel
+
+try:
+	from jose import JWTError, jwt
+except ImportError:
+	#python-jose is only needed once the JWT flow is in use
+	JWTError = Exception
+	jwt = None
+
+from .item_store import ItemStore, item_store
+from .response_cache import ResponseCache
+from .token_cache import MISSING, TokenCache
+
+#Bearer tokens that passed verification in get_current_user, keyed ("bearer", token)
+##APP_TOKEN_CACHE=0 turns it off, APP_TOKEN_CACHE_SIZE and APP_TOKEN_CACHE_TTL size it
+token_cache = TokenCache(
+	maxsize=int(os.environ.get("APP_TOKEN_CACHE_SIZE", 4096)),
+	ttl=float(os.environ.get("APP_TOKEN_CACHE_TTL", 300.0)),
+	enabled=os.environ.get("APP_TOKEN_CACHE", "1") != "0",
+)
 
 async def get_token_header(x_token: str = Header()):
 	if x_token != "fake-super-secret-token":
@@ -9,3 +33,90 @@ async def get_token_header(x_token: str = Header()):
 async def get_query_token(token: str):
 	if token != "jessica":
 		raise HTTPException(status_code=400, detail="No Jessica token provided")
+
+#Encoded GET responses, served by the ResponseCacheMiddleware in app.main
+##APP_RESPONSE_CACHE=0 turns it off, APP_RESPONSE_CACHE_SIZE and APP_RESPONSE_CACHE_BYTES bound it
+response_cache = ResponseCache(
+	maxsize=int(os.environ.get("APP_RESPONSE_CACHE_SIZE", 1024)),
+	max_bytes=int(os.environ.get("APP_RESPONSE_CACHE_BYTES", 16 * 1024 * 1024)),
+	enabled=os.environ.get("APP_RESPONSE_CACHE", "1") != "0",
+)
+
+#Item storage, swap it with app.dependency_overrides[get_item_store]
+async def get_item_store() -> ItemStore:
+	return item_store
+
+#OAuth2 with Password (and hashing), Bearer with JWT tokens
+#to get a string like this run:
+#openssl rand -hex 32
+SECRET_KEY = "77752496302ba870b1f22b0e0f5a56f6bfa83e8b5eafb298b819c74058d0db39"
+ALGORITHM = "HS256"
+ACCESS_TOKEN_EXPIRE_MINUTES = 30
+
+fake_users_db = {
+	"johndoe": {
+		"username": "johndoe",
+		"full_name": "John Doe",
+		"email": "johndoe@example.com",
+		"hashed_password": "fakehashedsecret",
+		"disabled": False,
+	},
+}
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+
+class User(BaseModel):
+	"""docstring for User"""
+	username: str
+	email: str | None = None
+	full_name: str | None = None
+	disabled: bool | None = None
+
+class UserInDB(User):
+	"""docstring for UserInDB"""
+	hashed_password: str
+
+def get_user(db, username: str):
+	if username in db:
+		return UserInDB(**db[username])
+
+def _require_jose():
+	if jwt is None:
+		raise RuntimeError("JWT authentication needs python-jose: pip install python-jose[cryptography]")
+
+def create_access_token(data: dict, expires_delta: timedelta | None = None) -> str:
+	_require_jose()
+	to_encode = data.copy()
+	expire = datetime.utcnow() + (expires_delta or timedelta(minutes=15))
+	to_encode.update({"exp": expire})
+	return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
+#Decoding checks the signature and exp, and the user lookup follows; a cached token skips both
+async def get_current_user(token: str = Depends(oauth2_scheme)):
+	key = ("bearer", token)
+	cached = token_cache.get(key)
+	if cached is not MISSING:
+		return cached[1]
+	credentials_exception = HTTPException(
+		status_code=status.HTTP_401_UNAUTHORIZED,
+		detail="Could not validate credentials",
+		headers={"WWW-Authenticate": "Bearer"},
+	)
+	if token_cache.is_revoked(key):
+		raise credentials_exception
+	_require_jose()
+	try:
+		payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+	except JWTError:
+		raise credentials_exception
+	username = payload.get("sub")
+	user = get_user(fake_users_db, username=username) if username is not None else None
+	if user is None:
+		raise credentials_exception
+	token_cache.set(key, payload, user)
+	return user
+
+async def get_current_active_user(current_user: User = Depends(get_current_user)):
+	if current_user.disabled:
+		raise HTTPException(status_code=400, detail="Inactive user")
+	return current_user
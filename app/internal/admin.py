@@ -1 +1,21 @@
-# "admin" submodule, e.g. import app.internal.admin
\ No newline at end of file
+# "admin" submodule, e.g. import app.internal.admin
+#Admin APIRouter, included by app.main under /admin with its own dependencies
+from fastapi import APIRouter
+
+from ..dependencies import response_cache, token_cache
+
+router = APIRouter()
+
+@router.post("/")
+async def update_admin():
+	return {"message": "admin getting schwify"}
+
+#Hit/miss counters of the verified-token cache
+@router.get("/token-cache")
+async def read_token_cache_stats():
+	return token_cache.stats()
+
+#Hit/miss counters of the response cache
+@router.get("/response-cache")
+async def read_response_cache_stats():
+	return response_cache.stats()
@@ -0,0 +1,133 @@
+# "item_store" module, e.g. import app.item_store
+#Item storage behind an async interface
+##Handlers get the store from the get_item_store dependency, so a shared backend for
+##multi-worker deployments can replace the in-process one through dependency_overrides.
+import itertools
+import os
+import threading
+from abc import ABC, abstractmethod
+
+#Every item is kept as one (sequence, version, *FIELDS) tuple, never as a dict or a pydantic model
+FIELDS = ("title", "description")
+
+class ItemStore(ABC):
+	"""Interface: item_id -> {"id", "title", "description"}"""
+
+	@abstractmethod
+	async def get(self, item_id: str) -> dict | None:
+		...
+
+	@abstractmethod
+	async def insert_if_absent(self, item_id: str, item: dict) -> bool:
+		#Atomic: True if stored, False if item_id was already taken
+		...
+
+	@abstractmethod
+	async def put(self, item_id: str, item: dict):
+		...
+
+	@abstractmethod
+	async def delete(self, item_id: str) -> bool:
+		...
+
+	@abstractmethod
+	async def list(self) -> list[dict]:
+		...
+
+	@abstractmethod
+	async def version(self, item_id: str | None = None) -> str | None:
+		#Opaque, changes whenever the item (or with no item_id, any item) does; None if the item is missing
+		...
+
+class ShardedItemStore(ItemStore):
+	"""In-process store, striped over shards that each have their own lock
+
+	Writers to different shards never wait for each other, and a threading.Lock also
+	covers sync handlers running in the threadpool. No lock is held across an await.
+	"""
+
+	def __init__(self, shards: int = 16, initial: dict | None = None):
+		self._shards = [{} for _ in range(shards)]
+		self._locks = [threading.Lock() for _ in range(shards)]
+		#Writes per shard, bumped under the shard lock; an item's version is the count at its last write
+		self._writes = [0] * shards
+		#Versions restart with the process, so they are prefixed with a per-process epoch
+		self._epoch = os.urandom(4).hex()
+		#Insertion order across shards, so list() keeps the order items were added in
+		self._sequence = itertools.count()
+		for item_id, item in (initial or {}).items():
+			index = self._index(item_id)
+			self._writes[index] += 1
+			self._shards[index][item_id] = self._pack(item, self._writes[index])
+
+	def _index(self, item_id: str) -> int:
+		return hash(item_id) % len(self._shards)
+
+	def _shard(self, item_id: str) -> dict:
+		return self._shards[self._index(item_id)]
+
+	def _pack(self, item: dict, version: int = 0, sequence: int | None = None) -> tuple:
+		if sequence is None:
+			sequence = next(self._sequence)
+		return (sequence, version, *(item.get(field) for field in FIELDS))
+
+	@staticmethod
+	def _unpack(item_id: str, record: tuple) -> dict:
+		return {"id": item_id, **dict(zip(FIELDS, record[2:]))}
+
+	async def get(self, item_id: str) -> dict | None:
+		#A single dict read is atomic, no lock needed
+		record = self._shard(item_id).get(item_id)
+		return self._unpack(item_id, record) if record is not None else None
+
+	async def insert_if_absent(self, item_id: str, item: dict) -> bool:
+		index = self._index(item_id)
+		with self._locks[index]:
+			if item_id in self._shards[index]:
+				return False
+			self._writes[index] += 1
+			self._shards[index][item_id] = self._pack(item, self._writes[index])
+			return True
+
+	async def put(self, item_id: str, item: dict):
+		index = self._index(item_id)
+		with self._locks[index]:
+			#Keep the original position in list() order
+			previous = self._shards[index].get(item_id)
+			self._writes[index] += 1
+			self._shards[index][item_id] = self._pack(
+				item, self._writes[index], previous[0] if previous is not None else None
+			)
+
+	async def delete(self, item_id: str) -> bool:
+		index = self._index(item_id)
+		with self._locks[index]:
+			if self._shards[index].pop(item_id, None) is None:
+				return False
+			self._writes[index] += 1
+			return True
+
+	async def list(self) -> list[dict]:
+		records = []
+		for shard, lock in zip(self._shards, self._locks):
+			with lock:
+				records.extend(shard.items())
+		records.sort(key=lambda entry: entry[1][0])
+		return [self._unpack(item_id, record) for item_id, record in records]
+
+	async def version(self, item_id: str | None = None) -> str | None:
+		if item_id is None:
+			#Every shard's count only grows, so the sum changes on any write
+			return f"{self._epoch}-{sum(self._writes)}"
+		record = self._shard(item_id).get(item_id)
+		return f"{self._epoch}-{record[1]}" if record is not None else None
+
+	def __len__(self) -> int:
+		return sum(len(shard) for shard in self._shards)
+
+item_store = ShardedItemStore(initial={
+	"foo": {"title": "Foo", "description": "There goes my hero"},
+	"bar": {"title": "Bar", "description": "The bartenders"},
+	"plumbus": {"title": "Plumbus"},
+	"gun": {"title": "Portal Gun"},
+})
@@ -1,11 +1,20 @@
 # "main" module, e.g. import app.main
 #The main FastAPI
 #Import FastAPI
-from fastapi import Depends, FastAPI, APIRouter, Header, HTTPException
+from fastapi import Depends, FastAPI, Header, HTTPException, Response
+from fastapi.responses import PlainTextResponse
 
 from pydantic import BaseModel
 
-from .dependencies import get_query_token, get_token_header
+#The Prometheus helpers and request metrics are shared with sql_app
+from http_cache.etag import etag_for_version, etag_matches
+from metrics.prometheus import CONTENT_TYPE, Registry, SharedDirectory
+from metrics.request_metrics import RequestMetrics, RequestMetricsMiddleware, load_request_metrics_settings
+
+from .conditional import not_modified
+from .dependencies import get_item_store, get_query_token, get_token_header, response_cache, token_cache
+from .item_store import ItemStore
+from .response_cache import ResponseCacheMiddleware, cache_response
 #Avoid name collisions
 from .internal import admin
 #Import the APIRouter
@@ -13,40 +22,41 @@ from .routers import items, users
 
 fake_secret_token = "coneofsilence"
 
-fake_db = {
-    "foo": {"id": "foo", "title": "Foo", "description": "There goes my hero"},
-    "bar": {"id": "bar", "title": "Bar", "description": "The bartenders"},
-}
-
-app = FastAPI(dependencies=[Depends(get_query_token)])
-
-#Include the APIRouters for users and items
-app.include_router(users.routers)
-app.include_router(items.routers)
-#Include an APIRouter with a custom prefix, tags, responses, and dependencies
-app.include_router(
-	admin.router,
-	prefix="/admin",
-	tags=["admin"],
-	dependencies=[Depends(get_token_header)],
-	response={418: {"description": "I'm a teapot"}},
+#Latency, in-flight requests and status codes per route, configured by APP_REQUEST_METRICS,
+##APP_SERVER_TIMING, APP_METRICS_DIR and APP_METRICS_INTERVAL, see metrics.request_metrics
+REQUEST_METRICS = load_request_metrics_settings("APP")
+registry = Registry()
+request_metrics = (
+	RequestMetrics(registry, server_timing=REQUEST_METRICS.server_timing) if REQUEST_METRICS.enabled else None
+)
+shared_metrics = (
+	SharedDirectory(registry, REQUEST_METRICS.metrics_dir, REQUEST_METRICS.interval)
+	if REQUEST_METRICS.metrics_dir else None
 )
 
-#Include a path operation
-@app.get("/")
-async def root():
-    return {"message": "Hello Bigger Applications!"}
-
-router = APIRouter()
+app = FastAPI(dependencies=[
+	Depends(get_query_token),
+	*([Depends(request_metrics.track_in_flight)] if request_metrics is not None else []),
+])
 
-@router.post("/")
-async def update_admin():
-	return {"message": "admin getting schwify"}
+#Serves cached GET responses before routing, see response_cache
+app.add_middleware(ResponseCacheMiddleware, cache=response_cache, token_cache=token_cache)
+#Outermost, so cache hits are timed too
+if request_metrics is not None:
+	app.add_middleware(RequestMetricsMiddleware, metrics=request_metrics)
 
+#Include a path operation
 @app.get("/")
+@cache_response(ttl=60)
 async def read_main():
     return {"msg": "Hello World"}
 
+#Prometheus scrape endpoint; like every route here it needs the token query param
+@app.get("/metrics", response_class=PlainTextResponse)
+async def read_metrics():
+    body = shared_metrics.render() if shared_metrics is not None else registry.render()
+    return PlainTextResponse(body, media_type=CONTENT_TYPE)
+
 class Item(BaseModel):
     id: str
     title: str
@@ -54,19 +64,49 @@ class Item(BaseModel):
 
 
 @app.get("/items/{item_id}", response_model=Item)
-async def read_main(item_id: str, x_token: str = Header()):
+@cache_response(ttl=30, tags=("items", "item:{item_id}"))
+async def read_item(
+    item_id: str,
+    response: Response,
+    x_token: str = Header(),
+    if_none_match: str | None = Header(None),
+    store: ItemStore = Depends(get_item_store),
+):
     if x_token != fake_secret_token:
         raise HTTPException(status_code=400, detail="Invalid X-Token header")
-    if item_id not in fake_db:
+    #An unchanged item is answered from its version alone
+    version = await store.version(item_id)
+    if version is None:
         raise HTTPException(status_code=404, detail="Item not found")
-    return fake_db[item_id]
+    etag = etag_for_version(version)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    item = await store.get(item_id)
+    if item is None:
+        raise HTTPException(status_code=404, detail="Item not found")
+    response.headers["ETag"] = etag
+    return item
 
 
 @app.post("/items/", response_model=Item)
-async def create_item(item: Item, x_token: str = Header()):
+async def create_item(item: Item, x_token: str = Header(), store: ItemStore = Depends(get_item_store)):
     if x_token != fake_secret_token:
         raise HTTPException(status_code=400, detail="Invalid X-Token header")
-    if item.id in fake_db:
+    #One atomic step, so two concurrent creates of the same id cannot both succeed
+    if not await store.insert_if_absent(item.id, item.dict()):
         raise HTTPException(status_code=400, detail="Item already exists")
-    fake_db[item.id] = item
+    response_cache.invalidate("items", f"item:{item.id}")
     return item
+
+#Include the APIRouters for users and items
+##After the app's own path operations, so GET /items/{item_id} above takes precedence
+app.include_router(users.router)
+app.include_router(items.router)
+#Include an APIRouter with a custom prefix, tags, responses, and dependencies
+app.include_router(
+	admin.router,
+	prefix="/admin",
+	tags=["admin"],
+	dependencies=[Depends(get_token_header)],
+	responses={418: {"description": "I'm a teapot"}},
+)
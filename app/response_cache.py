@@ -0,0 +1,196 @@
+# "response_cache" module, e.g. import app.response_cache
+#Response cache for GET routes
+##Routes opt in with the cache_response decorator. A miss is routed as usual and its response
+##stored under the route's policy; a hit is served before routing, so dependencies and the
+##endpoint only run on a miss. Like a shared HTTP cache, an entry keeps the values of its
+##route's vary headers and only matches requests that send the same ones.
+##Only 200 responses of requests that carried the same credentials are ever served: X-Token,
+##Authorization and the whole query string (the token param included) are always in the key.
+##As hits skip the auth dependencies, a hit for a bearer token revoked in the TokenCache is
+##routed as a miss instead, and the dependencies turn it away.
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from http_cache.etag import etag_matches
+
+ALWAYS_VARY = (b"x-token", b"authorization")
+
+@dataclass(frozen=True)
+class CachePolicy:
+	"""How long a route's responses are kept, what else they vary by and how they are invalidated"""
+	ttl: float
+	#Lowercased header names as bytes, as they appear in the ASGI scope
+	vary: tuple[bytes, ...] = ()
+	#Formatted with the path params, e.g. "item:{item_id}"
+	tags: tuple[str, ...] = ()
+
+def cache_response(ttl: float, vary=(), tags=()):
+	#Goes below the route decorator, the endpoint itself is returned unchanged
+	def decorator(endpoint):
+		endpoint.cache_policy = CachePolicy(ttl, tuple(name.lower().encode() for name in vary), tuple(tags))
+		return endpoint
+	return decorator
+
+class ResponseCache:
+	"""Bounded LRU of encoded responses, by entry count and total body bytes, with tag invalidation"""
+
+	def __init__(self, maxsize: int = 1024, max_bytes: int = 16 * 1024 * 1024, enabled: bool = True):
+		self.maxsize = maxsize
+		self.max_bytes = max_bytes
+		self.enabled = enabled
+		#key -> (expires, status, headers, body, tags, vary, route)
+		self._entries = OrderedDict()
+		self._tags = {}
+		self._bytes = 0
+		#Bumped by every invalidation; a response started before one is not stored, it may be stale
+		self.generation = 0
+		self._lock = threading.Lock()
+		self.hits = self.misses = self.evictions = self.expirations = self.invalidations = 0
+
+	def get(self, key, request_headers: dict):
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is None or any(request_headers.get(name) != value for name, value in entry[5]):
+				self.misses += 1
+				return None
+			if entry[0] <= time.monotonic():
+				self._remove(key)
+				self.expirations += 1
+				self.misses += 1
+				return None
+			self._entries.move_to_end(key)
+			self.hits += 1
+			return entry
+
+	def set(
+		self, key, ttl: float, status: int, headers: list, body: bytes, tags=(), vary=(),
+		generation: int | None = None, route: dict | None = None,
+	):
+		if len(body) > self.max_bytes:
+			return
+		with self._lock:
+			if generation is not None and generation != self.generation:
+				return
+			if key in self._entries:
+				self._remove(key)
+			self._entries[key] = (time.monotonic() + ttl, status, headers, body, tags, vary, route or {})
+			self._bytes += len(body)
+			for tag in tags:
+				self._tags.setdefault(tag, set()).add(key)
+			while len(self._entries) > self.maxsize or self._bytes > self.max_bytes:
+				self._remove(next(iter(self._entries)))
+				self.evictions += 1
+
+	def _remove(self, key):
+		_, _, _, body, tags, _, _ = self._entries.pop(key)
+		self._bytes -= len(body)
+		for tag in tags:
+			keys = self._tags.get(tag)
+			if keys is not None:
+				keys.discard(key)
+				if not keys:
+					del self._tags[tag]
+
+	def invalidate(self, *tags: str) -> int:
+		with self._lock:
+			self.generation += 1
+			keys = set().union(*(self._tags.get(tag, ()) for tag in tags))
+			for key in keys:
+				self._remove(key)
+			self.invalidations += len(keys)
+			return len(keys)
+
+	def clear(self):
+		with self._lock:
+			self.generation += 1
+			self._entries.clear()
+			self._tags.clear()
+			self._bytes = 0
+
+	def stats(self) -> dict:
+		with self._lock:
+			lookups = self.hits + self.misses
+			return {
+				"size": len(self._entries),
+				"maxsize": self.maxsize,
+				"bytes": self._bytes,
+				"max_bytes": self.max_bytes,
+				"hits": self.hits,
+				"misses": self.misses,
+				"hit_rate": self.hits / lookups if lookups else 0.0,
+				"evictions": self.evictions,
+				"expirations": self.expirations,
+				"invalidations": self.invalidations,
+			}
+
+class ResponseCacheMiddleware:
+	"""ASGI middleware serving and filling a ResponseCache for routes with a cache_policy"""
+
+	def __init__(self, app, cache: ResponseCache, token_cache=None):
+		self.app = app
+		self.cache = cache
+		#Consulted for revocations before a hit is served
+		self.token_cache = token_cache
+
+	async def __call__(self, scope, receive, send):
+		if scope["type"] != "http" or scope["method"] != "GET" or not self.cache.enabled:
+			return await self.app(scope, receive, send)
+		headers = dict(scope["headers"])
+		key = (
+			scope["path"],
+			b"&".join(sorted(scope["query_string"].split(b"&"))),
+			*(headers.get(name) for name in ALWAYS_VARY),
+		)
+		entry = self.cache.get(key, headers)
+		if entry is not None and not self._revoked(headers):
+			#The route the entry was filled from, so outer middleware such as metrics can label the hit
+			scope.update(entry[6])
+			return await self._send_hit(entry, headers.get(b"if-none-match"), send)
+		generation = self.cache.generation
+		policy = None
+		response_headers = []
+		chunks = []
+
+		async def send_and_capture(message):
+			nonlocal policy, response_headers
+			if message["type"] == "http.response.start":
+				#Routing has run by now and left the route in the scope
+				endpoint = getattr(scope.get("route"), "endpoint", None)
+				policy = getattr(endpoint, "cache_policy", None) if message["status"] == 200 else None
+				response_headers = message["headers"]
+				if policy is not None:
+					message = {**message, "headers": [*response_headers, (b"x-cache", b"MISS")]}
+			elif message["type"] == "http.response.body" and policy is not None:
+				chunks.append(message.get("body", b""))
+				if not message.get("more_body", False):
+					self._store(key, policy, scope, headers, response_headers, b"".join(chunks), generation)
+			await send(message)
+
+		await self.app(scope, receive, send_and_capture)
+
+	def _revoked(self, headers: dict) -> bool:
+		#Bearer tokens are the ones get_current_user keys in the TokenCache
+		if self.token_cache is None:
+			return False
+		scheme, _, token = headers.get(b"authorization", b"").decode("latin-1").partition(" ")
+		return scheme.lower() == "bearer" and self.token_cache.is_revoked(("bearer", token))
+
+	def _store(self, key, policy: CachePolicy, scope, request_headers: dict, headers: list, body: bytes, generation: int):
+		if any(name == b"set-cookie" for name, _ in headers):
+			return
+		tags = tuple(tag.format(**scope.get("path_params", {})) for tag in policy.tags)
+		vary = tuple((name, request_headers.get(name)) for name in policy.vary)
+		route = {"route": scope.get("route"), "path_params": scope.get("path_params", {})}
+		self.cache.set(key, policy.ttl, 200, headers, body, tags, vary, generation, route)
+
+	async def _send_hit(self, entry, if_none_match: bytes | None, send):
+		status, headers, body = entry[1:4]
+		etag = next((value for name, value in headers if name == b"etag"), None)
+		if if_none_match is not None and etag is not None and etag_matches(if_none_match.decode(), etag.decode()):
+			await send({"type": "http.response.start", "status": 304, "headers": [(b"etag", etag), (b"x-cache", b"HIT")]})
+			await send({"type": "http.response.body", "body": b""})
+			return
+		await send({"type": "http.response.start", "status": status, "headers": [*headers, (b"x-cache", b"HIT")]})
+		await send({"type": "http.response.body", "body": body})
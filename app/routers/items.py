@@ -1,27 +1,42 @@
 # "items" submodule, e.g. import app.routers.users 
 #Another module with APIRouter
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
 
-from ..dependencies import get_token_header
+from http_cache.etag import etag_for_version, etag_matches
+
+from ..conditional import not_modified
+from ..dependencies import get_item_store, get_token_header
+from ..item_store import ItemStore
+from ..response_cache import cache_response
 
 router = APIRouter(
 	prefix="/items",
 	tags=["items"],
 	dependencies=[Depends(get_token_header)],
-	response={404: {"description": "Not found"}},
+	responses={404: {"description": "Not found"}},
 )
 
-fake_items_db = {"plumbus": {"name": "Plumbus"}, "gun": {"name": "Portal Gun"}}
-
+#The version is read before the items, so a write in between can only make the ETag older than the body
 @router.get("/")
-async def read_items():
-    return fake_items_db
+@cache_response(ttl=30, tags=("items",))
+async def read_items(
+    response: Response,
+    if_none_match: str | None = Header(None),
+    store: ItemStore = Depends(get_item_store),
+):
+    etag = etag_for_version(await store.version())
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+    return {item["id"]: {"name": item["title"]} for item in await store.list()}
 
+#Shadowed: app.main registers its own /items/{item_id} before including this router
 @router.get("/{item_id}")
-async def read_item(item_id: str):
-    if item_id not in fake_items_db:
+async def read_item(item_id: str, store: ItemStore = Depends(get_item_store)):
+    item = await store.get(item_id)
+    if item is None:
         raise HTTPException(status_code=404, detail="Item not found")
-    return {"name": fake_items_db[item_id]["name"], "item_id": item_id}
+    return {"name": item["title"], "item_id": item_id}
 
 @router.put(
     "/{item_id}",
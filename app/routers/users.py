@@ -1,13 +1,19 @@
 # "users" submodule, e.g. import app.routers.users
 #Import APIRouter
-from fastapi import APIRouter
+from fastapi import APIRouter, Header
+
+from ..conditional import StaticJSON
+from ..response_cache import cache_response
 
 router = APIRouter()
 
+users = StaticJSON([{"username": "Rick"}, {"username": "Morty"}])
+
 #Path operations with APIRouter
 @router.get("/users/", tags=["users"])
-async def read_users():
-	return [{"username": "Rick"}, {"username": "Morty"}]
+@cache_response(ttl=60, tags=("users",))
+async def read_users(if_none_match: str | None = Header(None)):
+	return users.response(if_none_match)
 
 @router.get("/users/me", tags=["users"])
 async def read_user_me():
@@ -1,18 +1,31 @@
 #Testing file
+import asyncio
+import threading
+import time
+
+import pytest
 from fastapi.testclient import TestClient
 
-from .main import app
+from . import dependencies
+from .dependencies import get_item_store, response_cache, token_cache
+from .item_store import ItemStore, ShardedItemStore
+from .response_cache import ResponseCache
+from .main import app, request_metrics
+from .token_cache import MISSING, TokenCache
 
 client = TestClient(app)
 
+#Every route depends on get_query_token
+token = {"token": "jessica"}
+
 def test_read_main():
-    response = client.get("/")
+    response = client.get("/", params=token)
     assert response.status_code == 200
     assert response.json() == {"msg": "Hello World"}
 
 #Extended FastAPI app file
 def test_read_item():
-    response = client.get("/items/foo", headers={"X-Token": "coneofsilence"})
+    response = client.get("/items/foo", params=token, headers={"X-Token": "coneofsilence"})
     assert response.status_code == 200
     assert response.json() == {
         "id": "foo",
@@ -22,13 +35,13 @@ def test_read_item():
 
 
 def test_read_item_bad_token():
-    response = client.get("/items/foo", headers={"X-Token": "hailhydra"})
+    response = client.get("/items/foo", params=token, headers={"X-Token": "hailhydra"})
     assert response.status_code == 400
     assert response.json() == {"detail": "Invalid X-Token header"}
 
 
 def test_read_inexistent_item():
-    response = client.get("/items/baz", headers={"X-Token": "coneofsilence"})
+    response = client.get("/items/baz", params=token, headers={"X-Token": "coneofsilence"})
     assert response.status_code == 404
     assert response.json() == {"detail": "Item not found"}
 
@@ -36,6 +49,7 @@ def test_read_inexistent_item():
 def test_create_item():
     response = client.post(
         "/items/",
+        params=token,
         headers={"X-Token": "coneofsilence"},
         json={"id": "foobar", "title": "Foo Bar", "description": "The Foo Barters"},
     )
@@ -50,6 +64,7 @@ def test_create_item():
 def test_create_item_bad_token():
     response = client.post(
         "/items/",
+        params=token,
         headers={"X-Token": "hailhydra"},
         json={"id": "bazz", "title": "Bazz", "description": "Drop the bazz"},
     )
@@ -60,6 +75,7 @@ def test_create_item_bad_token():
 def test_create_existing_item():
     response = client.post(
         "/items/",
+        params=token,
         headers={"X-Token": "coneofsilence"},
         json={
             "id": "foo",
@@ -69,3 +85,207 @@ def test_create_existing_item():
     )
     assert response.status_code == 400
     assert response.json() == {"detail": "Item already exists"}
+
+
+def test_token_cache_expiry_bounds_and_revocation():
+    cache = TokenCache(maxsize=2, ttl=60)
+    cache.set("expired", {"sub": "a", "exp": time.time() - 1})
+    assert cache.get("expired") is MISSING
+    cache.set("a", {"sub": "alice"}, "user a")
+    cache.set("b", {"sub": "bob"})
+    assert cache.get("a") == ({"sub": "alice"}, "user a")
+    cache.set("c", {"sub": "alice"})
+    #b was least recently used
+    assert cache.get("b") is MISSING and cache.stats()["evictions"] == 1
+    assert cache.revoke_subject("alice") == 2
+    assert cache.get("a") is MISSING and cache.get("c") is MISSING
+    cache.revoke("d", expires=time.time() + 60)
+    cache.set("d", {"sub": "dave"})
+    assert cache.is_revoked("d") and cache.get("d") is MISSING
+    assert TokenCache(enabled=False).get("a") is MISSING
+
+
+def test_jwt_verified_once():
+    pytest.importorskip("jose")
+    token_cache.clear()
+    access_token = dependencies.create_access_token({"sub": "johndoe"})
+    user = asyncio.run(dependencies.get_current_user(access_token))
+    assert user.username == "johndoe"
+    assert asyncio.run(dependencies.get_current_user(access_token)) is user
+    assert token_cache.stats()["hits"] == 1
+    token_cache.revoke(("bearer", access_token))
+    with pytest.raises(dependencies.HTTPException):
+        asyncio.run(dependencies.get_current_user(access_token))
+    token_cache.clear()
+
+
+def test_item_store_insert_if_absent_is_atomic():
+    store = ShardedItemStore(shards=4)
+    winners = []
+    barrier = threading.Barrier(8)
+
+    def create(n):
+        barrier.wait()
+        if asyncio.run(store.insert_if_absent("race", {"title": f"Racer {n}"})):
+            winners.append(n)
+
+    threads = [threading.Thread(target=create, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(winners) == 1
+    assert asyncio.run(store.get("race")) == {"id": "race", "title": f"Racer {winners[0]}", "description": None}
+
+
+def test_item_store_keeps_insertion_order():
+    store = ShardedItemStore(shards=4, initial={"b": {"title": "B"}, "a": {"title": "A"}})
+    asyncio.run(store.insert_if_absent("c", {"title": "C", "description": "See"}))
+    asyncio.run(store.put("b", {"title": "Bee"}))
+    assert [item["id"] for item in asyncio.run(store.list())] == ["b", "a", "c"]
+    assert asyncio.run(store.get("b"))["title"] == "Bee"
+    assert asyncio.run(store.delete("a")) and not asyncio.run(store.delete("a"))
+    assert len(store) == 2
+
+    class ReadOnlyStore(ItemStore):
+        async def get(self, item_id):
+            return None
+
+    #An incomplete store fails when it is made, not on its first write
+    with pytest.raises(TypeError):
+        ReadOnlyStore()
+
+
+def test_routes_share_the_item_store():
+    store = ShardedItemStore(initial={"plumbus": {"title": "Plumbus"}})
+    app.dependency_overrides[get_item_store] = lambda: store
+    response_cache.clear()
+    try:
+        response = client.post(
+            "/items/",
+            params=token,
+            headers={"X-Token": "coneofsilence"},
+            json={"id": "gun", "title": "Portal Gun"},
+        )
+        assert response.status_code == 200
+        response = client.get("/items/", params=token, headers={"X-Token": "fake-super-secret-token"})
+        assert response.json() == {"plumbus": {"name": "Plumbus"}, "gun": {"name": "Portal Gun"}}
+        response = client.get("/items/gun", params=token, headers={"X-Token": "coneofsilence"})
+        assert response.json() == {"id": "gun", "title": "Portal Gun", "description": None}
+    finally:
+        app.dependency_overrides.clear()
+
+
+def test_conditional_gets_return_304():
+    headers = {"X-Token": "fake-super-secret-token"}
+    response = client.get("/users/", params=token)
+    assert response.json() == [{"username": "Rick"}, {"username": "Morty"}]
+    cached = client.get("/users/", params=token, headers={"If-None-Match": response.headers["ETag"]})
+    assert cached.status_code == 304 and cached.content == b""
+    store = ShardedItemStore(initial={"plumbus": {"title": "Plumbus"}})
+    app.dependency_overrides[get_item_store] = lambda: store
+    #Writes straight to the store bypass the routes' invalidation, so the cache is off here
+    response_cache.enabled = False
+    try:
+        etag = client.get("/items/", params=token, headers=headers).headers["ETag"]
+        assert client.get("/items/", params=token, headers={**headers, "If-None-Match": etag}).status_code == 304
+        #app.main's /items/{item_id} answers, not the items router's, and it wants its own token
+        assert client.get("/items/plumbus", params=token, headers=headers).status_code == 400
+        item_headers = {"X-Token": "coneofsilence"}
+        item_etag = client.get("/items/plumbus", params=token, headers=item_headers).headers["ETag"]
+        response = client.get("/items/plumbus", params=token, headers={**item_headers, "If-None-Match": item_etag})
+        assert response.status_code == 304
+        #Another item's write changes the list but not this item
+        asyncio.run(store.insert_if_absent("gun", {"title": "Portal Gun"}))
+        assert client.get("/items/", params=token, headers={**headers, "If-None-Match": etag}).status_code == 200
+        response = client.get("/items/plumbus", params=token, headers={**item_headers, "If-None-Match": item_etag})
+        assert response.status_code == 304
+        asyncio.run(store.put("plumbus", {"title": "The great Plumbus"}))
+        response = client.get("/items/plumbus", params=token, headers={**item_headers, "If-None-Match": item_etag})
+        assert response.status_code == 200 and response.json()["title"] == "The great Plumbus"
+    finally:
+        app.dependency_overrides.clear()
+        response_cache.enabled = True
+
+
+def test_response_cache_serves_hits_before_dependencies():
+    store = ShardedItemStore(initial={"plumbus": {"title": "Plumbus"}})
+    resolved = []
+    app.dependency_overrides[get_item_store] = lambda: resolved.append(store) or store
+    response_cache.clear()
+    headers = {"X-Token": "fake-super-secret-token"}
+    try:
+        first = client.get("/items/", params=token, headers=headers)
+        assert first.headers["X-Cache"] == "MISS" and len(resolved) == 1
+        second = client.get("/items/", params=token, headers=headers)
+        assert second.headers["X-Cache"] == "HIT" and second.content == first.content
+        assert second.headers["ETag"] == first.headers["ETag"]
+        #No dependency ran for the hit
+        assert len(resolved) == 1
+        assert client.get("/items/", params=token, headers={**headers, "If-None-Match": first.headers["ETag"]}).status_code == 304
+        #Credentials are part of the key, so a bad token is still turned away
+        assert client.get("/items/", params=token, headers={"X-Token": "hailhydra"}).status_code == 400
+        assert client.get("/items/", params={"token": "nope"}, headers=headers).status_code == 400
+        #Creating an item invalidates the lists and that item
+        item_headers = {"X-Token": "coneofsilence"}
+        assert client.get("/items/gun", params=token, headers=item_headers).status_code == 404
+        client.post("/items/", params=token, headers=item_headers, json={"id": "gun", "title": "Portal Gun"})
+        response = client.get("/items/", params=token, headers=headers)
+        assert response.headers["X-Cache"] == "MISS" and "gun" in response.json()
+        assert client.get("/items/gun", params=token, headers=item_headers).status_code == 200
+        assert client.get("/items/gun", params=token, headers=item_headers).headers["X-Cache"] == "HIT"
+        assert response_cache.invalidate("item:gun") == 1
+    finally:
+        app.dependency_overrides.clear()
+        response_cache.clear()
+
+
+def test_response_cache_skips_hits_for_revoked_tokens():
+    response_cache.clear()
+    headers = {"Authorization": "Bearer portal-fluid"}
+    try:
+        client.get("/", params=token, headers=headers)
+        assert client.get("/", params=token, headers=headers).headers["X-Cache"] == "HIT"
+        token_cache.revoke(("bearer", "portal-fluid"))
+        #Routed as a miss again, where the auth dependencies get their say
+        assert client.get("/", params=token, headers=headers).headers["X-Cache"] == "MISS"
+    finally:
+        token_cache.clear()
+        response_cache.clear()
+
+
+def test_response_cache_bounds_and_stale_fills():
+    cache = ResponseCache(maxsize=3, max_bytes=10)
+    cache.set("a", 60, 200, [], b"aaaa", ("x",))
+    cache.set("b", 60, 200, [], b"bbbb")
+    assert cache.get("a", {}) is not None
+    #Over max_bytes, b was least recently used
+    cache.set("c", 60, 200, [], b"cccc")
+    assert cache.get("b", {}) is None and cache.stats()["evictions"] == 1
+    cache.set("d", -1, 200, [], b"")
+    assert cache.get("d", {}) is None and cache.stats()["expirations"] == 1
+    #An entry only matches requests with the same values of its vary headers
+    cache.set("e", 60, 200, [], b"", vary=((b"accept-language", b"en"),))
+    assert cache.get("e", {b"accept-language": b"de"}) is None
+    assert cache.get("e", {b"accept-language": b"en"}) is not None
+    #A response computed before an invalidation is not stored
+    generation = cache.generation
+    assert cache.invalidate("x") == 1 and cache.get("a", {}) is None
+    cache.set("a", 60, 200, [], b"stale", ("x",), generation=generation)
+    assert cache.get("a", {}) is None
+
+
+
+def test_request_metrics_label_prefixed_routes_and_cache_hits():
+    response_cache.clear()
+    responses = request_metrics.responses
+    before = responses.value("GET", "/items/{item_id}", "200")
+    for _ in range(2):
+        client.get("/items/foo", params=token, headers={"X-Token": "coneofsilence"})
+    #The second one was a response cache hit, labelled with the route it was cached from
+    assert responses.value("GET", "/items/{item_id}", "200") == before + 2
+    client.get("/admin/token-cache", params=token, headers={"X-Token": "fake-super-secret-token"})
+    assert responses.value("GET", "/admin/token-cache", "200") >= 1
+    response = client.get("/metrics", params=token)
+    assert 'http_request_duration_seconds_count{method="GET",route="/items/{item_id}"}' in response.text
+    response_cache.clear()
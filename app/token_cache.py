@@ -0,0 +1,100 @@
+# "token_cache" module, e.g. import app.token_cache
+#Cache of verified tokens
+##Maps a token that passed verification to its claims and user, so later requests skip
+##signature checks and user lookups. An entry expires at the token's exp claim or after
+##ttl seconds, whichever comes first. Only tokens that verified are ever stored.
+import threading
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+class TokenCache:
+	"""Bounded LRU of verified tokens with hit/miss/eviction counters and revocation"""
+
+	def __init__(self, maxsize: int = 4096, ttl: float = 300.0, enabled: bool = True):
+		self.maxsize = maxsize
+		self.ttl = ttl
+		self.enabled = enabled
+		#token -> (expires, claims, user)
+		self._entries = OrderedDict()
+		#Revoked tokens stay rejected until they would have expired
+		self._revoked = {}
+		self._lock = threading.Lock()
+		self.hits = self.misses = self.evictions = self.expirations = 0
+
+	def get(self, token: str):
+		#Returns (claims, user) or MISSING
+		if not self.enabled:
+			return MISSING
+		with self._lock:
+			entry = self._entries.get(token)
+			if entry is None:
+				self.misses += 1
+				return MISSING
+			expires, claims, user = entry
+			if expires <= time.time():
+				del self._entries[token]
+				self.expirations += 1
+				self.misses += 1
+				return MISSING
+			self._entries.move_to_end(token)
+			self.hits += 1
+			return claims, user
+
+	def set(self, token: str, claims: dict, user=None):
+		if not self.enabled:
+			return
+		expires = min(time.time() + self.ttl, claims.get("exp", float("inf")))
+		with self._lock:
+			if token in self._revoked:
+				return
+			self._entries[token] = (expires, claims, user)
+			self._entries.move_to_end(token)
+			while len(self._entries) > self.maxsize:
+				self._entries.popitem(last=False)
+				self.evictions += 1
+
+	def is_revoked(self, token: str) -> bool:
+		with self._lock:
+			until = self._revoked.get(token)
+			if until is not None and until <= time.time():
+				del self._revoked[token]
+				return False
+			return until is not None
+
+	def revoke(self, token: str, expires: float | None = None):
+		#Purges the entry. The revocation is forgotten at the token's exp, which is taken
+		##from the cached claims when not given; a token without exp stays revoked
+		with self._lock:
+			entry = self._entries.pop(token, None)
+			if expires is None:
+				expires = entry[1].get("exp", float("inf")) if entry is not None else float("inf")
+			self._revoked[token] = expires
+
+	def revoke_subject(self, subject: str) -> int:
+		#Purges every cached token of one user, e.g. after a password change or disable
+		with self._lock:
+			tokens = [token for token, (_, claims, _) in self._entries.items() if claims.get("sub") == subject]
+			for token in tokens:
+				del self._entries[token]
+			return len(tokens)
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+			self._revoked.clear()
+
+	def stats(self) -> dict:
+		with self._lock:
+			lookups = self.hits + self.misses
+			return {
+				"size": len(self._entries),
+				"maxsize": self.maxsize,
+				"revoked": len(self._revoked),
+				"hits": self.hits,
+				"misses": self.misses,
+				"hit_rate": self.hits / lookups if lookups else 0.0,
+				"evictions": self.evictions,
+				"expirations": self.expirations,
+			}
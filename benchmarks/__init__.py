@@ -0,0 +1 @@
+# makes "benchmarks" a "Python package", e.g. python -m benchmarks.bench_pagination
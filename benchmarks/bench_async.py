@@ -0,0 +1,73 @@
+#Benchmark: sync (threadpool) vs async (event loop) sql_app throughput
+##Run with: python -m benchmarks.bench_async [requests per level]
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import httpx
+from sqlalchemy import create_engine, insert
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from sql_app import main, main_async, models
+from sql_app.database import Base
+
+CONCURRENCY = (50, 200, 1000)
+
+def setup(path: str, users: int = 1000):
+	engine = create_engine(
+		f"sqlite:///{path}", connect_args={"check_same_thread": False}, pool_timeout=300
+	)
+	Base.metadata.create_all(bind=engine)
+	with engine.begin() as conn:
+		conn.execute(insert(models.User), [
+			{"email": f"user{i}@example.com", "hashed_password": "x"} for i in range(users)
+		])
+		conn.execute(insert(models.Item), [
+			{"title": f"item {i}", "owner_id": i % users + 1} for i in range(users * 5)
+		])
+	SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+	def get_db():
+		db = SessionLocal()
+		try:
+			yield db
+		finally:
+			db.close()
+
+	async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}", pool_timeout=300)
+	AsyncSessionLocal = async_sessionmaker(bind=async_engine, expire_on_commit=False)
+
+	async def get_async_db():
+		async with AsyncSessionLocal() as db:
+			yield db
+
+	main.app.dependency_overrides[main.get_db] = get_db
+	main_async.app.dependency_overrides[main_async.get_db] = get_async_db
+
+async def drive(app, requests: int, concurrency: int, users: int = 1000) -> float:
+	transport = httpx.ASGITransport(app=app)
+	async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+		queue = iter(range(requests))
+
+		async def worker():
+			for i in queue:
+				response = await client.get(f"/users/{i % users + 1}")
+				assert response.status_code == 200
+
+		start = time.perf_counter()
+		await asyncio.gather(*(worker() for _ in range(concurrency)))
+		return requests / (time.perf_counter() - start)
+
+async def run(requests: int):
+	print(f"{'clients':>8} {'sync req/s':>12} {'async req/s':>12}")
+	for concurrency in CONCURRENCY:
+		sync_rps = await drive(main.app, requests, concurrency)
+		async_rps = await drive(main_async.app, requests, concurrency)
+		print(f"{concurrency:>8} {sync_rps:>12.0f} {async_rps:>12.0f}")
+
+if __name__ == "__main__":
+	setup(os.path.join(tempfile.mkdtemp(), "bench.db"))
+	asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else 2000))
@@ -0,0 +1,72 @@
+#Benchmark: mixed read/write concurrency under each SQLite engine profile
+##Run with: python -m benchmarks.bench_engine_profiles [seconds] [readers] [writers]
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from sql_app import crud, schemas
+from sql_app.config import PROFILES
+from sql_app.database import Base, create_profiled_engine
+
+def run_profile(profile, seconds: float, readers: int, writers: int) -> dict:
+	path = os.path.join(tempfile.mkdtemp(), "bench.db")
+	engine = create_profiled_engine(
+		f"sqlite:///{path}", profile, **({"pool_timeout": 60} if profile.poolclass == "queue" else {})
+	)
+	Base.metadata.create_all(bind=engine)
+	SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+	with SessionLocal() as db:
+		user = crud.create_user(db, schemas.UserCreate(email="bench@example.com", password="x"))
+		user_id = user.id
+
+	counts = {"reads": 0, "writes": 0, "locked": 0}
+	lock = threading.Lock()
+	deadline = time.perf_counter() + seconds
+
+	def reader():
+		done = 0
+		with SessionLocal() as db:
+			while time.perf_counter() < deadline:
+				crud.get_items(db, limit=20)
+				db.rollback()
+				done += 1
+		with lock:
+			counts["reads"] += done
+
+	def writer():
+		done = locked = 0
+		with SessionLocal() as db:
+			while time.perf_counter() < deadline:
+				try:
+					crud.create_user_item(db, schemas.ItemCreate(title="bench"), user_id=user_id)
+					done += 1
+				except OperationalError:
+					db.rollback()
+					locked += 1
+		with lock:
+			counts["writes"] += done
+			counts["locked"] += locked
+
+	threads = [threading.Thread(target=reader) for _ in range(readers)]
+	threads += [threading.Thread(target=writer) for _ in range(writers)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	engine.dispose()
+	return {key: value / seconds if key != "locked" else value for key, value in counts.items()}
+
+def main(seconds: float = 5.0, readers: int = 8, writers: int = 2):
+	print(f"{'profile':>10} {'reads/s':>10} {'writes/s':>10} {'locked':>8}")
+	for name, profile in PROFILES.items():
+		result = run_profile(profile, seconds, readers, writers)
+		print(f"{name:>10} {result['reads']:>10.0f} {result['writes']:>10.0f} {result['locked']:>8}")
+
+if __name__ == "__main__":
+	args = [float(arg) for arg in sys.argv[1:]]
+	main(*(args[:1] + [int(arg) for arg in args[1:]]))
@@ -0,0 +1,67 @@
+#Benchmark: item creation throughput, one commit per request vs group commit
+##Run with: python -m benchmarks.bench_group_commit [seconds] [writers]
+import dataclasses
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy.orm import sessionmaker
+
+from sql_app import crud, schemas
+from sql_app.config import PROFILES
+from sql_app.database import Base, create_profiled_engine
+from sql_app.group_commit import GroupCommitter
+
+def run(profile, grouped: bool, seconds: float, writers: int) -> dict:
+	path = os.path.join(tempfile.mkdtemp(), "bench.db")
+	engine = create_profiled_engine(
+		f"sqlite:///{path}", dataclasses.replace(profile, pool_size=writers + 1), pool_timeout=60
+	)
+	Base.metadata.create_all(bind=engine)
+	SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+	with SessionLocal() as db:
+		user_id = crud.create_user(db, schemas.UserCreate(email="bench@example.com", password="x")).id
+	committer = GroupCommitter(SessionLocal) if grouped else None
+
+	counts = []
+	lock = threading.Lock()
+	deadline = time.perf_counter() + seconds
+
+	def writer():
+		done = 0
+		item = schemas.ItemCreate(title="bench")
+		with SessionLocal() as db:
+			while time.perf_counter() < deadline:
+				if committer is not None:
+					committer.submit(item, user_id)
+				else:
+					crud.create_user_item(db, item, user_id=user_id)
+				done += 1
+		with lock:
+			counts.append(done)
+
+	threads = [threading.Thread(target=writer) for _ in range(writers)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	result = {"writes": sum(counts) / seconds}
+	if committer is not None:
+		committer.close()
+		result["rows_per_batch"] = committer.stats()["rows_per_batch"]
+	engine.dispose()
+	return result
+
+def main(seconds: float = 5.0, writers: int = 32):
+	print(f"{'profile':>10} {'mode':>8} {'writes/s':>10} {'rows/batch':>11}")
+	for name in ("wal", "durable"):
+		for grouped in (False, True):
+			result = run(PROFILES[name], grouped, seconds, writers)
+			mode = "group" if grouped else "single"
+			print(f"{name:>10} {mode:>8} {result['writes']:>10.0f} {result.get('rows_per_batch', 1.0):>11.1f}")
+
+if __name__ == "__main__":
+	args = sys.argv[1:]
+	main(*([float(args[0])] if args else []), *[int(arg) for arg in args[1:]])
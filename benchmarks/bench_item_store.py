@@ -0,0 +1,40 @@
+#Benchmark: item store throughput from concurrent threads, one lock against striped locks
+##Run with: python -m benchmarks.bench_item_store [threads] [operations per thread]
+import asyncio
+import sys
+import threading
+import time
+
+from app.item_store import ShardedItemStore
+
+def worker(store, barrier, thread: int, operations: int):
+	async def run():
+		for n in range(operations):
+			item_id = f"{thread}-{n}"
+			await store.insert_if_absent(item_id, {"title": item_id})
+			await store.get(item_id)
+			await store.insert_if_absent(item_id, {"title": item_id})
+	barrier.wait()
+	asyncio.run(run())
+
+def operations_per_second(shards: int, threads: int, operations: int) -> float:
+	store = ShardedItemStore(shards=shards)
+	barrier = threading.Barrier(threads + 1)
+	pool = [threading.Thread(target=worker, args=(store, barrier, n, operations)) for n in range(threads)]
+	for thread in pool:
+		thread.start()
+	barrier.wait()
+	start = time.perf_counter()
+	for thread in pool:
+		thread.join()
+	elapsed = time.perf_counter() - start
+	assert len(store) == threads * operations
+	return 3 * threads * operations / elapsed
+
+def main(threads: int = 8, operations: int = 20000):
+	print(f"{'shards':>6} {'ops/s':>10}")
+	for shards in (1, 16, 64):
+		print(f"{shards:>6} {operations_per_second(shards, threads, operations):>10.0f}")
+
+if __name__ == "__main__":
+	main(*(int(arg) for arg in sys.argv[1:3]))
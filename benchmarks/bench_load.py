@@ -0,0 +1,287 @@
+#Load test: throughput and latency percentiles of app or sql_app under a weighted request mix
+##Drives the ASGI app in-process through httpx.ASGITransport, or a real uvicorn on localhost
+##with --server uvicorn. Latencies are client side, so in-process they include httpx itself.
+##Run with: python -m benchmarks.bench_load app|sql_app [options], see --help
+##Save a run with --output, then fail a later one that regresses with --baseline:
+##python -m benchmarks.bench_load sql_app --output base.json
+##python -m benchmarks.bench_load sql_app --baseline base.json --tolerance 0.15
+import argparse
+import asyncio
+import contextlib
+import importlib
+import importlib.util
+import itertools
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+#The apps are imported after changing into a scratch directory
+if REPO not in sys.path:
+	sys.path.insert(0, REPO)
+
+APPS = {"app": "app.main:app", "sql_app": "sql_app.main:app"}
+
+WORDS = ("alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel")
+
+#Request mixes: name is the label results are grouped by, weight the relative frequency.
+##Strings may use {user} (a seeded user id), {n} (unique per request) and {word}.
+TOKEN = {"token": "jessica"}
+MIXES = {
+	"app": [
+		{"name": "GET /", "path": "/", "weight": 2, "params": TOKEN},
+		{"name": "GET /users/", "path": "/users/", "weight": 2, "params": TOKEN},
+		{
+			"name": "GET /items/", "path": "/items/", "weight": 3, "params": TOKEN,
+			"headers": {"X-Token": "fake-super-secret-token"},
+		},
+		{
+			"name": "GET /items/{item_id}", "path": "/items/foo", "weight": 3, "params": TOKEN,
+			"headers": {"X-Token": "coneofsilence"},
+		},
+		{
+			"name": "POST /items/", "method": "POST", "path": "/items/", "weight": 1, "params": TOKEN,
+			"headers": {"X-Token": "coneofsilence"}, "json": {"id": "load-{n}", "title": "Load {n}"},
+		},
+	],
+	"sql_app": [
+		{"name": "GET /users/", "path": "/users/", "weight": 2, "params": {"limit": "20"}},
+		{"name": "GET /users/{user_id}", "path": "/users/{user}", "weight": 4},
+		{"name": "GET /items/", "path": "/items/", "weight": 3, "params": {"limit": "50"}},
+		{"name": "GET /items/search", "path": "/items/search", "weight": 1, "params": {"q": "{word}"}},
+		{
+			"name": "POST /users/{user_id}/items/", "method": "POST", "path": "/users/{user}/items/", "weight": 1,
+			"json": {"title": "load {n}", "description": "{word} item"},
+		},
+	],
+}
+
+def fill(value, **values):
+	if isinstance(value, str):
+		return value.format(**values)
+	if isinstance(value, dict):
+		return {key: fill(item, **values) for key, item in value.items()}
+	return value
+
+def plan(mix: list[dict], requests: int, users: list[int], rng: random.Random, counter) -> list[tuple]:
+	#Drawn up front, so the same seed gives the same requests whatever the scheduling
+	entries = rng.choices(mix, weights=[entry.get("weight", 1) for entry in mix], k=requests)
+	planned = []
+	for entry in entries:
+		values = {"user": rng.choice(users) if users else 0, "n": next(counter), "word": rng.choice(WORDS)}
+		planned.append((
+			entry["name"], entry.get("method", "GET"), fill(entry["path"], **values),
+			{key: fill(entry[key], **values) for key in ("params", "headers", "json") if key in entry},
+			tuple(entry.get("expect", (200,))),
+		))
+	return planned
+
+async def seed(client: httpx.AsyncClient, target: str, users: int, items_per_user: int) -> list[int]:
+	#sql_app starts from an empty database; app keeps its data in memory
+	if target != "sql_app":
+		return []
+	prefix = f"load{time.time_ns()}"
+	response = await client.post(
+		"/users/bulk", json=[{"email": f"{prefix}-{i}@example.com", "password": "x"} for i in range(users)]
+	)
+	response.raise_for_status()
+	user_ids = [user_id for user_id in response.json()["ids"] if user_id is not None]
+	for user_id in user_ids:
+		response = await client.post(f"/users/{user_id}/items/bulk", json=[
+			{"title": f"{WORDS[i % len(WORDS)]} {user_id}-{i}", "description": "seeded"} for i in range(items_per_user)
+		])
+		response.raise_for_status()
+	return user_ids
+
+async def drive(client: httpx.AsyncClient, planned: list[tuple], concurrency: int) -> tuple[list[tuple], float]:
+	queue = iter(planned)
+	samples = []
+
+	async def worker():
+		for name, method, path, kwargs, expect in queue:
+			start = time.perf_counter()
+			try:
+				response = await client.request(method, path, **kwargs)
+				ok = response.status_code in expect
+			except httpx.HTTPError:
+				ok = False
+			samples.append((name, time.perf_counter() - start, ok))
+
+	start = time.perf_counter()
+	await asyncio.gather(*(worker() for _ in range(concurrency)))
+	return samples, time.perf_counter() - start
+
+def percentile(ordered: list[float], share: float) -> float:
+	#Nearest rank
+	return ordered[min(len(ordered) - 1, max(0, round(share * len(ordered)) - 1))]
+
+def summarize(samples: list[tuple], elapsed: float) -> dict:
+	latencies = sorted(seconds * 1000 for _, seconds, _ in samples)
+	return {
+		"requests": len(samples),
+		"errors": sum(not ok for _, _, ok in samples),
+		"rps": len(samples) / elapsed,
+		"mean_ms": sum(latencies) / len(latencies),
+		"p50_ms": percentile(latencies, 0.50),
+		"p95_ms": percentile(latencies, 0.95),
+		"p99_ms": percentile(latencies, 0.99),
+		"max_ms": latencies[-1],
+	}
+
+def report(samples: list[tuple], elapsed: float) -> dict:
+	groups = {}
+	for sample in samples:
+		groups.setdefault(sample[0], []).append(sample)
+	return {
+		"overall": summarize(samples, elapsed),
+		"endpoints": {name: summarize(group, elapsed) for name, group in sorted(groups.items())},
+	}
+
+#A percentile is only compared when enough requests fall beyond it to be more than one outlier
+MIN_SAMPLES = {"p95_ms": 100, "p99_ms": 500}
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list[str]:
+	#Lower rps, higher p95/p99 or more errors than the baseline, beyond tolerance, is a regression
+	regressions = []
+	pairs = [("overall", result["overall"], baseline["overall"])]
+	pairs += [
+		(name, stats, baseline["endpoints"][name])
+		for name, stats in result["endpoints"].items() if name in baseline.get("endpoints", {})
+	]
+	for name, current, previous in pairs:
+		if current["rps"] < previous["rps"] * (1 - tolerance):
+			regressions.append(f"{name}: rps {current['rps']:.0f} < {previous['rps']:.0f}")
+		for key, needed in MIN_SAMPLES.items():
+			if min(current["requests"], previous["requests"]) < needed:
+				continue
+			if current[key] > previous[key] * (1 + tolerance):
+				regressions.append(f"{name}: {key} {current[key]:.2f} > {previous[key]:.2f}")
+		if current["errors"] > previous["errors"]:
+			regressions.append(f"{name}: errors {current['errors']} > {previous['errors']}")
+	return regressions
+
+def print_report(result: dict):
+	print(f"{'endpoint':>30} {'requests':>9} {'errors':>7} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+	for name, stats in [*result["endpoints"].items(), ("overall", result["overall"])]:
+		print(
+			f"{name:>30} {stats['requests']:>9} {stats['errors']:>7} {stats['rps']:>8.0f} "
+			f"{stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f}"
+		)
+
+@contextlib.contextmanager
+def uvicorn_server(target: str, port: int, workers: int, cwd: str):
+	if importlib.util.find_spec("uvicorn") is None:
+		sys.exit("--server uvicorn needs uvicorn: pip install uvicorn")
+	process = subprocess.Popen(
+		[
+			sys.executable, "-m", "uvicorn", APPS[target], "--port", str(port),
+			"--workers", str(workers), "--log-level", "warning",
+		],
+		cwd=cwd, env={**os.environ, "PYTHONPATH": REPO},
+	)
+	try:
+		deadline = time.monotonic() + 30
+		while True:
+			with contextlib.suppress(OSError), socket.create_connection(("127.0.0.1", port), timeout=1):
+				break
+			if process.poll() is not None or time.monotonic() > deadline:
+				sys.exit("uvicorn did not start")
+			time.sleep(0.1)
+		yield f"http://127.0.0.1:{port}"
+	finally:
+		process.terminate()
+		process.wait()
+
+@contextlib.asynccontextmanager
+async def client_for(args, workdir: str):
+	limits = httpx.Limits(max_connections=args.concurrency)
+	if args.server == "uvicorn":
+		with uvicorn_server(args.target, args.port, args.workers, workdir) as base_url:
+			async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+				yield client
+		return
+	#sql_app opens ./sql_app.db on import, so it lands in the scratch directory
+	cwd = os.getcwd()
+	os.chdir(workdir)
+	try:
+		module, name = APPS[args.target].split(":")
+		app = getattr(importlib.import_module(module), name)
+		transport = httpx.ASGITransport(app=app)
+		async with httpx.AsyncClient(transport=transport, base_url="http://load", limits=limits, timeout=60) as client:
+			yield client
+	finally:
+		os.chdir(cwd)
+
+async def run(args) -> dict:
+	if args.mix_file:
+		with open(args.mix_file) as file:
+			mix = json.load(file)
+	else:
+		mix = MIXES[args.target]
+	rng = random.Random(args.seed)
+	counter = itertools.count()
+	with tempfile.TemporaryDirectory() as workdir:
+		async with client_for(args, workdir) as client:
+			users = await seed(client, args.target, args.users, args.items_per_user)
+			if args.warmup:
+				await drive(client, plan(mix, args.warmup, users, rng, counter), args.concurrency)
+			samples, elapsed = await drive(client, plan(mix, args.requests, users, rng, counter), args.concurrency)
+	return {
+		"target": args.target,
+		"server": args.server,
+		"workers": args.workers if args.server == "uvicorn" else 1,
+		"concurrency": args.concurrency,
+		"requests": args.requests,
+		"seed": args.seed,
+		"mix": mix,
+		"python": platform.python_version(),
+		"time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+		**report(samples, elapsed),
+	}
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog="python -m benchmarks.bench_load")
+	parser.add_argument("target", choices=sorted(APPS))
+	parser.add_argument("--requests", type=int, default=2000)
+	parser.add_argument("--concurrency", type=int, default=32)
+	parser.add_argument("--warmup", type=int, default=200)
+	parser.add_argument("--seed", type=int, default=1)
+	parser.add_argument("--mix-file", help="JSON list of entries shaped like MIXES")
+	parser.add_argument("--users", type=int, default=200, help="sql_app users to seed")
+	parser.add_argument("--items-per-user", type=int, default=5)
+	parser.add_argument("--server", choices=("asgi", "uvicorn"), default="asgi")
+	parser.add_argument("--port", type=int, default=8765)
+	parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+	parser.add_argument("--output", help="save the results as JSON")
+	parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+	parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative change")
+	args = parser.parse_args(argv)
+
+	result = asyncio.run(run(args))
+	print_report(result)
+	if args.output:
+		with open(args.output, "w") as file:
+			json.dump(result, file, indent=2)
+	if args.baseline:
+		with open(args.baseline) as file:
+			baseline = json.load(file)
+		for key in ("target", "server", "workers", "concurrency", "mix"):
+			if baseline.get(key) != result[key]:
+				print(f"warning: {key} differs from the baseline")
+		regressions = compare(result, baseline, args.tolerance)
+		for regression in regressions:
+			print(f"REGRESSION {regression}")
+		if regressions:
+			sys.exit(1)
+		print(f"no regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,52 @@
+#Benchmark: deep-page latency, offset vs keyset pagination
+##Run with: python -m benchmarks.bench_pagination [rows]
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from sql_app import crud, models
+from sql_app.database import Base
+
+def populate(engine, rows: int):
+	with engine.begin() as conn:
+		conn.execute(insert(models.User), [{"email": "bench@example.com", "hashed_password": "x"}])
+		batch = []
+		for i in range(rows):
+			batch.append({"title": f"title {i % 997:04d}", "description": "bench", "owner_id": 1})
+			if len(batch) == 10000:
+				conn.execute(insert(models.Item), batch)
+				batch = []
+		if batch:
+			conn.execute(insert(models.Item), batch)
+
+def timed(fn, repeat: int = 5) -> float:
+	best = float("inf")
+	for _ in range(repeat):
+		start = time.perf_counter()
+		fn()
+		best = min(best, time.perf_counter() - start)
+	return best * 1000
+
+def main(rows: int = 500000, limit: int = 100):
+	path = os.path.join(tempfile.mkdtemp(), "bench.db")
+	engine = create_engine(f"sqlite:///{path}")
+	Base.metadata.create_all(bind=engine)
+	populate(engine, rows)
+	db = sessionmaker(bind=engine)()
+
+	print(f"{'depth':>10} {'offset ms':>10} {'keyset ms':>10}")
+	for depth in (0, rows // 10, rows // 2, rows - limit):
+		#Keyset seeks from the last id of the previous page
+		after = crud.get_items(db, skip=depth - 1, limit=1) if depth else []
+		after_key = [after[0].id] if after else None
+		offset_ms = timed(lambda: crud.get_items(db, skip=depth, limit=limit))
+		keyset_ms = timed(lambda: crud.get_items_after(db, after=after_key, limit=limit))
+		print(f"{depth:>10} {offset_ms:>10.2f} {keyset_ms:>10.2f}")
+	db.close()
+
+if __name__ == "__main__":
+	main(int(sys.argv[1]) if len(sys.argv) > 1 else 500000)
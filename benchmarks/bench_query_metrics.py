@@ -0,0 +1,77 @@
+#Benchmark: overhead of the query metrics event hooks, on a bare crud lookup and on a request
+##Run with: python -m benchmarks.bench_query_metrics [calls] [rounds]
+import sys
+import time
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from metrics.prometheus import Registry
+from sql_app import crud, models
+from sql_app.database import Base
+from sql_app.main import app, get_db
+from sql_app.query_metrics import QueryMetrics
+
+SAMPLE_RATES = (0.01, 0.1, 1.0)
+
+def per_call_us(call, calls: int) -> float:
+	start = time.perf_counter()
+	for _ in range(calls):
+		call()
+	return (time.perf_counter() - start) / calls * 1e6
+
+def make_engine():
+	engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+	Base.metadata.create_all(bind=engine)
+	with engine.begin() as conn:
+		conn.execute(insert(models.User), [
+			{"email": f"user{i}@example.com", "hashed_password": "x"} for i in range(1, 101)
+		])
+		conn.execute(insert(models.Item), [{"title": f"item {i}", "owner_id": i % 100 + 1} for i in range(1000)])
+	return engine
+
+def main(calls: int = 1000, rounds: int = 5):
+	#One engine per setting: an engine that ever had a listener keeps the slower dispatch path
+	settings = (None, *SAMPLE_RATES)
+	sessions = {}
+	for rate in settings:
+		engine = make_engine()
+		if rate is not None:
+			QueryMetrics(Registry(), sample_rate=rate, slow_seconds=10.0).attach(engine)
+		sessions[rate] = sessionmaker(bind=engine)
+	current = {"rate": None}
+
+	def override_get_db():
+		with sessions[current["rate"]]() as db:
+			yield db
+
+	app.dependency_overrides[get_db] = override_get_db
+	client = TestClient(app)
+	dbs = {rate: Session() for rate, Session in sessions.items()}
+	workloads = {
+		"crud.get_user": lambda: crud.get_user(dbs[current["rate"]], user_id=7),
+		"GET /items/": lambda: client.get("/items/", params={"limit": 20}),
+	}
+
+	#Rounds alternate between the settings and keep the best of each: the hooks cost
+	##microseconds, less than the drift between runs on a busy machine
+	print(f"{'workload':>14} {'sample rate':>12} {'us/call':>8} {'overhead':>9}")
+	for name, call in workloads.items():
+		best = dict.fromkeys(settings, float("inf"))
+		for _ in range(rounds):
+			for rate in settings:
+				current["rate"] = rate
+				call()
+				best[rate] = min(best[rate], per_call_us(call, calls))
+		baseline = best.pop(None)
+		print(f"{name:>14} {'off':>12} {baseline:>8.1f} {'':>9}")
+		for rate, measured in best.items():
+			print(f"{name:>14} {rate:>12} {measured:>8.1f} {(measured / baseline - 1) * 100:>8.1f}%")
+	app.dependency_overrides.clear()
+	for db in dbs.values():
+		db.close()
+
+if __name__ == "__main__":
+	main(*[int(arg) for arg in sys.argv[1:]])
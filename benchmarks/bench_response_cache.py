@@ -0,0 +1,39 @@
+#Benchmark: cacheable GET throughput with the response cache on and off
+##Run with: python -m benchmarks.bench_response_cache [requests]
+import sys
+import time
+
+from fastapi.testclient import TestClient
+
+from app.dependencies import response_cache
+from app.main import app
+
+WORKLOADS = (
+	("/", {"params": {"token": "jessica"}}),
+	("/users/", {"params": {"token": "jessica"}}),
+	("/items/", {"params": {"token": "jessica"}, "headers": {"X-Token": "fake-super-secret-token"}}),
+	("/items/foo", {"params": {"token": "jessica"}, "headers": {"X-Token": "coneofsilence"}}),
+)
+
+def requests_per_second(client, path, requests: int, **kwargs) -> float:
+	client.get(path, **kwargs).raise_for_status()
+	start = time.perf_counter()
+	for _ in range(requests):
+		client.get(path, **kwargs).raise_for_status()
+	return requests / (time.perf_counter() - start)
+
+def main(requests: int = 2000):
+	client = TestClient(app)
+	print(f"{'path':>12} {'cache off rps':>14} {'cache on rps':>13}")
+	for path, kwargs in WORKLOADS:
+		results = {}
+		for enabled in (False, True):
+			response_cache.clear()
+			response_cache.enabled = enabled
+			results[enabled] = requests_per_second(client, path, requests, **kwargs)
+		print(f"{path:>12} {results[False]:>14.0f} {results[True]:>13.0f}")
+	response_cache.enabled = True
+	print(f"cache: {response_cache.stats()}")
+
+if __name__ == "__main__":
+	main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
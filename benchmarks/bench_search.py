@@ -0,0 +1,66 @@
+#Benchmark: FTS5 search vs LIKE '%word%' scans on a synthetic corpus
+##Run with: python -m benchmarks.bench_search [rows]
+import os
+import random
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, insert, text
+from sqlalchemy.orm import sessionmaker
+
+from sql_app import crud, models
+from sql_app.database import Base
+
+VOCABULARY = [f"word{i}" for i in range(20000)]
+QUERIES = ("word7", "word123 word456", "word19999")
+
+def populate(engine, rows: int):
+	rng = random.Random(42)
+	with engine.begin() as conn:
+		conn.execute(insert(models.User), [{"email": "bench@example.com", "hashed_password": "x"}])
+		for start in range(0, rows, 50000):
+			conn.execute(insert(models.Item), [
+				{
+					"title": " ".join(rng.choices(VOCABULARY, k=3)),
+					"description": " ".join(rng.choices(VOCABULARY, k=12)),
+					"owner_id": 1,
+				}
+				for _ in range(start, min(start + 50000, rows))
+			])
+
+def like_search(db, q: str, limit: int = 100):
+	clauses = " AND ".join(
+		f"(title LIKE :w{i} OR description LIKE :w{i})" for i in range(len(q.split()))
+	)
+	params = {f"w{i}": f"%{word}%" for i, word in enumerate(q.split())}
+	return db.execute(
+		text(f"SELECT id FROM items WHERE {clauses} ORDER BY id LIMIT :limit"), {**params, "limit": limit}
+	).all()
+
+def timed(fn, repeat: int = 3) -> float:
+	best = float("inf")
+	for _ in range(repeat):
+		start = time.perf_counter()
+		fn()
+		best = min(best, time.perf_counter() - start)
+	return best * 1000
+
+def main(rows: int = 2000000):
+	path = os.path.join(tempfile.mkdtemp(), "bench.db")
+	engine = create_engine(f"sqlite:///{path}")
+	Base.metadata.create_all(bind=engine)
+	start = time.perf_counter()
+	populate(engine, rows)
+	print(f"indexed {rows} items in {time.perf_counter() - start:.1f}s")
+	db = sessionmaker(bind=engine)()
+
+	print(f"{'query':>18} {'like ms':>10} {'fts ms':>10}")
+	for q in QUERIES:
+		like_ms = timed(lambda: like_search(db, q))
+		fts_ms = timed(lambda: crud.search_items(db, q=q))
+		print(f"{q:>18} {like_ms:>10.1f} {fts_ms:>10.1f}")
+	db.close()
+
+if __name__ == "__main__":
+	main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000000)
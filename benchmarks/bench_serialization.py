@@ -0,0 +1,77 @@
+#Benchmark: response_model serialization vs the fast_json path for the list endpoints
+##Run with: python -m benchmarks.bench_serialization [requests]
+import sys
+import time
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from pydantic import TypeAdapter
+
+from sql_app import crud, fast_json, models, schemas
+from sql_app.database import Base
+from sql_app.main import app, get_db
+
+ENDPOINTS = {
+	"/users/": {"limit": 100},
+	"/items/": {"limit": 100},
+}
+
+def per_request_ms(client, path, params, requests: int) -> float:
+	client.get(path, params=params)
+	start = time.perf_counter()
+	for _ in range(requests):
+		client.get(path, params=params).raise_for_status()
+	return (time.perf_counter() - start) / requests * 1000
+
+#Serialization alone, on rows already loaded: validate + dump vs copy fields + orjson
+def serialize_us(rows, model, calls: int) -> tuple[float, float]:
+	adapter = TypeAdapter(list[model])
+	start = time.perf_counter()
+	for _ in range(calls):
+		adapter.dump_json(adapter.validate_python(rows, from_attributes=True))
+	model_us = (time.perf_counter() - start) / calls * 1e6
+	start = time.perf_counter()
+	for _ in range(calls):
+		fast_json.dumps([fast_json.encoder_for(model)(row) for row in rows])
+	return model_us, (time.perf_counter() - start) / calls * 1e6
+
+def main(requests: int = 500):
+	engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+	Base.metadata.create_all(bind=engine)
+	with engine.begin() as conn:
+		conn.execute(insert(models.User), [
+			{"email": f"user{i}@example.com", "hashed_password": "x"} for i in range(1, 101)
+		])
+		conn.execute(insert(models.Item), [
+			{"title": f"item {i}", "description": "d" * 40, "owner_id": i % 100 + 1} for i in range(1000)
+		])
+	Session = sessionmaker(bind=engine)
+
+	def override_get_db():
+		with Session() as db:
+			yield db
+
+	app.dependency_overrides[get_db] = override_get_db
+	client = TestClient(app)
+	print(f"{'endpoint':>10} {'model ms':>10} {'fast ms':>10} {'speedup':>8}")
+	for path, params in ENDPOINTS.items():
+		model_ms = per_request_ms(client, path, params, requests)
+		fast_ms = per_request_ms(client, path, {**params, "fast": True}, requests)
+		print(f"{path:>10} {model_ms:>10.2f} {fast_ms:>10.2f} {model_ms / fast_ms:>7.1f}x")
+	app.dependency_overrides.clear()
+
+	with Session() as db:
+		loaded = {
+			"/users/": (crud.get_users(db, limit=100, load="selectin"), schemas.User),
+			"/items/": (crud.get_items(db, limit=100), schemas.Item),
+		}
+		print(f"{'serialize':>10} {'model us':>10} {'fast us':>10} {'speedup':>8}")
+		for path, (rows, model) in loaded.items():
+			model_us, fast_us = serialize_us(rows, model, requests)
+			print(f"{path:>10} {model_us:>10.0f} {fast_us:>10.0f} {model_us / fast_us:>7.1f}x")
+
+if __name__ == "__main__":
+	main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
@@ -0,0 +1,67 @@
+#Benchmark: item write throughput against the number of owner shards
+##Run with: python -m benchmarks.bench_sharding [seconds] [writers]
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import insert
+from sqlalchemy.exc import OperationalError
+
+from sql_app import crud, models, schemas
+from sql_app.config import PROFILES
+from sql_app.database import Base, create_profiled_engine
+from sql_app.sharding import ShardSessions, ShardSet
+
+SHARD_COUNTS = (1, 2, 4, 8)
+
+def run(shard_count: int, seconds: float, writers: int, profile) -> dict:
+	directory = tempfile.mkdtemp()
+	primary = create_profiled_engine(f"sqlite:///{directory}/primary.db", profile)
+	Base.metadata.create_all(bind=primary)
+	with primary.begin() as conn:
+		conn.execute(insert(models.User), [
+			{"email": f"user{i}@example.com", "hashed_password": "x"} for i in range(1, writers + 1)
+		])
+	urls = [f"sqlite:///{directory}/items{i}.db" for i in range(shard_count)]
+	shard_set = ShardSet({url: create_profiled_engine(url, profile) for url in urls}, primary)
+
+	counts = {"writes": 0, "locked": 0}
+	lock = threading.Lock()
+	deadline = time.perf_counter() + seconds
+
+	def writer(owner_id: int):
+		done = locked = 0
+		item = schemas.ItemCreate(title="bench")
+		shards = ShardSessions(shard_set)
+		db = shards.for_owner(owner_id)
+		while time.perf_counter() < deadline:
+			try:
+				crud.create_user_item(db, item, user_id=owner_id)
+				done += 1
+			except OperationalError:
+				db.rollback()
+				locked += 1
+		shards.close()
+		with lock:
+			counts["writes"] += done
+			counts["locked"] += locked
+
+	threads = [threading.Thread(target=writer, args=(owner_id,)) for owner_id in range(1, writers + 1)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	shard_set.dispose()
+	primary.dispose()
+	return {"writes": counts["writes"] / seconds, "locked": counts["locked"]}
+
+def main(seconds: float = 5.0, writers: int = 16, profile: str = "durable"):
+	print(f"{'shards':>7} {'writes/s':>10} {'locked':>8}")
+	for shard_count in SHARD_COUNTS:
+		result = run(shard_count, seconds, writers, PROFILES[profile])
+		print(f"{shard_count:>7} {result['writes']:>10.0f} {result['locked']:>8}")
+
+if __name__ == "__main__":
+	args = sys.argv[1:]
+	main(*([float(args[0])] if args else []), *[int(arg) for arg in args[1:2]], *args[2:3])
@@ -0,0 +1,55 @@
+#Microbenchmark: per-call overhead of Query construction vs the pre-built crud statements
+##Run with: python -m benchmarks.bench_statement_cache [calls]
+import sys
+import time
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from sql_app import crud, models
+from sql_app.database import Base
+from sql_app.query_count import CompiledCacheStats
+
+#The crud lookups as they were written before the statements were pre-built
+LEGACY = {
+	"get_user": lambda db: db.query(models.User).filter(models.User.id == 7).first(),
+	"get_user_by_email": lambda db: db.query(models.User).filter(models.User.email == "user7@example.com").first(),
+	"get_users": lambda db: db.query(models.User).order_by(models.User.id).offset(0).limit(10).all(),
+	"get_items": lambda db: db.query(models.Item).order_by(models.Item.id).offset(0).limit(10).all(),
+}
+PREBUILT = {
+	"get_user": lambda db: crud.get_user(db, user_id=7),
+	"get_user_by_email": lambda db: crud.get_user_by_email(db, email="user7@example.com"),
+	"get_users": lambda db: crud.get_users(db, skip=0, limit=10),
+	"get_items": lambda db: crud.get_items(db, skip=0, limit=10),
+}
+
+def per_call_us(db, call, calls: int) -> float:
+	call(db)
+	start = time.perf_counter()
+	for _ in range(calls):
+		call(db)
+	return (time.perf_counter() - start) / calls * 1e6
+
+def main(calls: int = 20000):
+	engine = create_engine("sqlite://", poolclass=StaticPool)
+	Base.metadata.create_all(bind=engine)
+	with engine.begin() as conn:
+		conn.execute(insert(models.User), [
+			{"email": f"user{i}@example.com", "hashed_password": "x"} for i in range(1, 101)
+		])
+		conn.execute(insert(models.Item), [{"title": f"item {i}", "owner_id": 1} for i in range(100)])
+	cache_stats = CompiledCacheStats(engine)
+	db = sessionmaker(bind=engine)()
+
+	print(f"{'lookup':>18} {'query us':>10} {'prebuilt us':>12}")
+	for name in PREBUILT:
+		legacy_us = per_call_us(db, LEGACY[name], calls)
+		prebuilt_us = per_call_us(db, PREBUILT[name], calls)
+		print(f"{name:>18} {legacy_us:>10.1f} {prebuilt_us:>12.1f}")
+	print(f"compiled cache: {cache_stats.stats()}")
+	db.close()
+
+if __name__ == "__main__":
+	main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
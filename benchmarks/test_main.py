@@ -0,0 +1,36 @@
+#Testing file
+from .bench_load import compare
+
+def stats(requests=1000, errors=0, rps=500.0, p95_ms=10.0, p99_ms=20.0):
+    return {"requests": requests, "errors": errors, "rps": rps, "p95_ms": p95_ms, "p99_ms": p99_ms}
+
+BASELINE = {
+    "overall": stats(),
+    "endpoints": {"GET /items/": stats(), "GET /users/": stats(requests=50)},
+}
+
+
+def test_compare_within_tolerance():
+    result = {
+        "overall": stats(rps=460.0, p95_ms=11.0, p99_ms=22.0),
+        "endpoints": {"GET /items/": stats(rps=520.0, p95_ms=9.0), "GET /new/": stats(rps=1.0)},
+    }
+    #Endpoints missing from the baseline are not compared
+    assert compare(result, BASELINE, tolerance=0.15) == []
+
+
+def test_compare_reports_regressions():
+    result = {
+        "overall": stats(rps=400.0),
+        "endpoints": {
+            "GET /items/": stats(p95_ms=12.0, p99_ms=30.0, errors=2),
+            #Too few requests for p95 to be more than a couple of outliers
+            "GET /users/": stats(requests=50, p95_ms=100.0),
+        },
+    }
+    assert compare(result, BASELINE, tolerance=0.15) == [
+        "overall: rps 400 < 500",
+        "GET /items/: p95_ms 12.00 > 10.00",
+        "GET /items/: p99_ms 30.00 > 20.00",
+        "GET /items/: errors 2 > 0",
+    ]
@@ -0,0 +1 @@
+# makes "http_cache" a "Python package" shared by app and sql_app, e.g. from http_cache.etag import etag_matches
@@ -0,0 +1,16 @@
+#Strong ETags and the If-None-Match comparison, for conditional GETs in both apps
+import hashlib
+
+def etag_for_version(version: str) -> str:
+	return f'"{version}"'
+
+def etag_for_body(body: bytes) -> str:
+	return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+	#If-None-Match uses the weak comparison, so a W/ prefix is ignored
+	if if_none_match is None:
+		return False
+	if if_none_match.strip() == "*":
+		return True
+	return etag in {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
@@ -0,0 +1,12 @@
+#Testing file
+from .etag import etag_for_version, etag_matches
+
+
+def test_etag_matches_uses_weak_comparison():
+    etag = etag_for_version("3")
+    assert etag == '"3"'
+    assert etag_matches('"3"', etag)
+    assert etag_matches(' "1", W/"3" ', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches('"4"', etag)
+    assert not etag_matches(None, etag)
@@ -1063,7 +1063,7 @@
 # # 	start_time = time.time()
 # # 	response = await call_next(request)
 # # 	process_time = time.time() - start_time
-# # 	response.headers["X-Process-Time"] - str(process_time)
+# # 	response.headers["X-Process-Time"] = str(process_time)
 # # 	return response
 
 # #CORS (Cross-Origin Resource Sharing)
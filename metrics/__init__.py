@@ -0,0 +1 @@
+# makes "metrics" a "Python package" shared by app and sql_app, e.g. from metrics.prometheus import Registry
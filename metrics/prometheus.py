@@ -0,0 +1,232 @@
+#Minimal Prometheus metrics rendered in the text exposition format
+##Just counters, gauges and histograms with fixed label names, enough for GET /metrics
+##With several worker processes, SharedDirectory merges every process's metrics into one scrape
+import atexit
+import bisect
+import glob
+import json
+import math
+import os
+import threading
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+#Seconds, from half a millisecond to ten seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value) -> str:
+	return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names, values, extra: str = "") -> str:
+	pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+	if extra:
+		pairs.append(extra)
+	return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+	if value == math.inf:
+		return "+Inf"
+	return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class Metric:
+	"""Base class: a named family of samples, one per tuple of label values"""
+	kind = "untyped"
+
+	def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+		self.name = name
+		self.documentation = documentation
+		self.labelnames = tuple(labelnames)
+		self._values = {}
+		self._lock = threading.Lock()
+
+	def _check(self, labels: tuple):
+		if len(labels) != len(self.labelnames):
+			raise ValueError(f"{self.name} takes labels {self.labelnames}, got {labels}")
+
+	def clear(self):
+		with self._lock:
+			self._values.clear()
+
+	def snapshot(self) -> list:
+		#JSON friendly [[label values], value] pairs
+		with self._lock:
+			return [[list(labels), self._copy(value)] for labels, value in self._values.items()]
+
+	def render(self, snapshots=()) -> list[str]:
+		#snapshots of the same metric from other processes are added to this one's values
+		lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+		with self._lock:
+			values = {labels: self._copy(value) for labels, value in self._values.items()}
+		for snapshot in snapshots:
+			for labels, value in snapshot:
+				labels = tuple(labels)
+				values[labels] = self._combine(values.get(labels), value)
+		for labels, value in sorted(values.items()):
+			lines.extend(self._samples(labels, value))
+		return lines
+
+	@staticmethod
+	def _copy(value):
+		return value
+
+	@staticmethod
+	def _combine(value, other):
+		return (value or 0.0) + other
+
+	def _samples(self, labels, value) -> list[str]:
+		return [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"]
+
+class Counter(Metric):
+	kind = "counter"
+
+	def inc(self, *labels, amount: float = 1.0):
+		self._check(labels)
+		with self._lock:
+			self._values[labels] = self._values.get(labels, 0.0) + amount
+
+	def value(self, *labels) -> float:
+		return self._values.get(labels, 0.0)
+
+class Gauge(Counter):
+	kind = "gauge"
+
+	def dec(self, *labels, amount: float = 1.0):
+		self.inc(*labels, amount=-amount)
+
+	def set(self, *labels, value: float):
+		self._check(labels)
+		with self._lock:
+			self._values[labels] = value
+
+class Histogram(Metric):
+	kind = "histogram"
+
+	def __init__(self, name, documentation, labelnames=(), buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+		super().__init__(name, documentation, labelnames)
+		self.buckets = tuple(sorted(buckets))
+
+	def observe(self, value: float, *labels):
+		self._check(labels)
+		index = bisect.bisect_left(self.buckets, value)
+		with self._lock:
+			counts, total = self._values.get(labels, ([0] * (len(self.buckets) + 1), 0.0))
+			counts[index] += 1
+			self._values[labels] = (counts, total + value)
+
+	def count(self, *labels) -> int:
+		counts, _ = self._values.get(labels, ((), 0.0))
+		return sum(counts)
+
+	@staticmethod
+	def _copy(value):
+		counts, total = value
+		return [list(counts), total]
+
+	@staticmethod
+	def _combine(value, other):
+		if value is None:
+			return [list(other[0]), other[1]]
+		return [[a + b for a, b in zip(value[0], other[0])], value[1] + other[1]]
+
+	def _samples(self, labels, value) -> list[str]:
+		counts, total = value
+		lines = []
+		cumulative = 0
+		for bound, count in zip((*self.buckets, math.inf), counts):
+			cumulative += count
+			bucket = _format_labels(self.labelnames, labels, f'le="{_format_value(bound)}"')
+			lines.append(f"{self.name}_bucket{bucket} {cumulative}")
+		plain = _format_labels(self.labelnames, labels)
+		lines.append(f"{self.name}_sum{plain} {_format_value(total)}")
+		lines.append(f"{self.name}_count{plain} {cumulative}")
+		return lines
+
+class Registry:
+	"""The metrics served together by one /metrics endpoint"""
+
+	def __init__(self):
+		self.metrics = {}
+
+	def register(self, metric: Metric) -> Metric:
+		if metric.name in self.metrics:
+			raise ValueError(f"{metric.name} is already registered")
+		self.metrics[metric.name] = metric
+		return metric
+
+	def snapshot(self) -> dict:
+		return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+	def render(self, snapshots=()) -> str:
+		lines = []
+		for name, metric in self.metrics.items():
+			lines.extend(metric.render([snapshot[name] for snapshot in snapshots if name in snapshot]))
+		return "\n".join(lines) + "\n"
+
+class SharedDirectory:
+	"""Multi-process mode: every process writes its registry to <path>/<pid>.json, any one renders them all
+
+	Files are rewritten every interval seconds and at exit, so a scrape lags the other processes
+	by up to interval. Counters and histograms of exited processes keep counting, their gauges
+	are dropped. Empty the directory before starting the server, as pids from an earlier run
+	would be added in too. Create it in each worker, after any fork.
+	"""
+
+	def __init__(self, registry: Registry, path: str, interval: float = 1.0):
+		self.registry = registry
+		self.path = path
+		self.interval = interval
+		os.makedirs(path, exist_ok=True)
+		self._stop = threading.Event()
+		self._thread = threading.Thread(target=self._run, name="metrics-writer", daemon=True)
+		self._thread.start()
+		atexit.register(self.close)
+
+	def _file(self, pid: int) -> str:
+		return os.path.join(self.path, f"{pid}.json")
+
+	def _run(self):
+		while not self._stop.wait(self.interval):
+			self.write()
+
+	def write(self):
+		#Written aside and renamed, so a reader never sees half a file
+		path = self._file(os.getpid())
+		with open(f"{path}.tmp", "w") as file:
+			json.dump(self.registry.snapshot(), file)
+		os.replace(f"{path}.tmp", path)
+
+	def close(self):
+		self._stop.set()
+		self.write()
+
+	def snapshots(self) -> list[dict]:
+		snapshots = []
+		for path in glob.glob(os.path.join(self.path, "*.json")):
+			pid = int(os.path.basename(path)[:-5])
+			if pid == os.getpid():
+				continue
+			try:
+				with open(path) as file:
+					snapshot = json.load(file)
+			except (OSError, ValueError):
+				continue
+			if not _alive(pid):
+				snapshot = {
+					name: values for name, values in snapshot.items()
+					if not isinstance(self.registry.metrics.get(name), Gauge)
+				}
+			snapshots.append(snapshot)
+		return snapshots
+
+	def render(self) -> str:
+		#This process's own values are read live, the others from their files
+		return self.registry.render(self.snapshots())
+
+def _alive(pid: int) -> bool:
+	try:
+		os.kill(pid, 0)
+	except ProcessLookupError:
+		return False
+	except PermissionError:
+		return True
+	return True
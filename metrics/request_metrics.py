@@ -0,0 +1,105 @@
+#Per-route HTTP metrics: latency histograms, in-flight gauges and response counters
+##Labelled by method and route template (/items/{item_id}), never by the raw path, so the number
+##of label sets stays bounded. Requests that match no route are counted as "unmatched".
+##The middleware takes the route from the scope once the app is done with it. The in-flight
+##gauge needs the route while the request is still running, so the track_in_flight dependency
+##raises it after routing and the middleware lowers it when the response is done.
+##Used by both sql_app.main and app.main, each with its own Registry and settings prefix.
+import os
+import time
+from dataclasses import dataclass
+
+from fastapi import Request
+
+from .prometheus import Counter, Gauge, Histogram, Registry
+
+@dataclass(frozen=True)
+class RequestMetricsSettings:
+	"""Per-route HTTP metrics, <prefix>_REQUEST_METRICS=0 turns them off"""
+	enabled: bool = True
+	server_timing: bool = False
+	#Shared directory for multi-process aggregation, None keeps metrics per process
+	metrics_dir: str | None = None
+	interval: float = 1.0
+
+def load_request_metrics_settings(prefix: str, environ=os.environ) -> RequestMetricsSettings:
+	#sql_app reads them with prefix="SQL_APP", app with prefix="APP"
+	return RequestMetricsSettings(
+		enabled=environ.get(f"{prefix}_REQUEST_METRICS", "1") != "0",
+		server_timing=environ.get(f"{prefix}_SERVER_TIMING", "0") == "1",
+		metrics_dir=environ.get(f"{prefix}_METRICS_DIR") or None,
+		interval=float(environ.get(f"{prefix}_METRICS_INTERVAL", RequestMetricsSettings.interval)),
+	)
+
+UNMATCHED = "unmatched"
+
+def route_template(scope) -> str:
+	route = scope.get("route")
+	template = getattr(route, "path_format", None)
+	if template is None:
+		return UNMATCHED
+	#A route of a router included with a prefix only knows its own part of the path, so the
+	##prefix is taken from the request path in front of that part
+	try:
+		own_part = template.format(**scope.get("path_params", {}))
+	except (KeyError, IndexError, ValueError):
+		return template
+	path = scope["path"]
+	if own_part != path and path.endswith(own_part):
+		return path[:len(path) - len(own_part)] + template
+	return template
+
+class RequestMetrics:
+	"""HTTP latency, requests in flight and responses by status, per method and route"""
+
+	def __init__(self, registry: Registry, server_timing: bool = False):
+		labels = ("method", "route")
+		self.duration = registry.register(Histogram(
+			"http_request_duration_seconds", "Time from receiving a request to sending its last byte", labels
+		))
+		self.in_flight = registry.register(Gauge(
+			"http_requests_in_flight", "Requests routed and not yet answered", labels
+		))
+		self.responses = registry.register(Counter(
+			"http_responses_total", "Responses sent, by status code", (*labels, "status")
+		))
+		#Adds Server-Timing: app;dur=<ms until the response started> for browser dev tools
+		self.server_timing = server_timing
+
+	async def track_in_flight(self, request: Request):
+		route = route_template(request.scope)
+		self.in_flight.inc(request.method, route)
+		request.state.in_flight_route = route
+
+class RequestMetricsMiddleware:
+	"""ASGI middleware recording RequestMetrics for every HTTP request"""
+
+	def __init__(self, app, metrics: RequestMetrics):
+		self.app = app
+		self.metrics = metrics
+
+	async def __call__(self, scope, receive, send):
+		if scope["type"] != "http":
+			return await self.app(scope, receive, send)
+		start = time.perf_counter()
+		status = 500
+
+		async def send_and_record(message):
+			nonlocal status
+			if message["type"] == "http.response.start":
+				status = message["status"]
+				if self.metrics.server_timing:
+					duration = f"app;dur={(time.perf_counter() - start) * 1000:.1f}".encode()
+					message = {**message, "headers": [*message["headers"], (b"server-timing", duration)]}
+			await send(message)
+
+		try:
+			await self.app(scope, receive, send_and_record)
+		finally:
+			method = scope["method"]
+			route = route_template(scope)
+			self.metrics.duration.observe(time.perf_counter() - start, method, route)
+			self.metrics.responses.inc(method, route, str(status))
+			in_flight_route = scope.get("state", {}).get("in_flight_route")
+			if in_flight_route is not None:
+				self.metrics.in_flight.dec(method, in_flight_route)
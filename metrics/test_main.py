@@ -0,0 +1,34 @@
+#Testing file
+import json
+import os
+import subprocess
+import sys
+
+from .prometheus import Counter, Gauge, Registry, SharedDirectory
+
+
+def test_shared_directory_sums_processes(tmp_path):
+    def registry():
+        registry = Registry()
+        registry.register(Counter("requests_total", "Requests", ("route",)))
+        registry.register(Gauge("in_flight", "In flight", ("route",)))
+        return registry
+
+    this = registry()
+    this.metrics["requests_total"].inc("/a", amount=2)
+    shared = SharedDirectory(this, str(tmp_path), interval=3600)
+    shared.close()
+    #Another live worker, and one that has exited
+    other = registry()
+    other.metrics["requests_total"].inc("/a", amount=3)
+    other.metrics["in_flight"].inc("/a")
+    (tmp_path / f"{os.getppid()}.json").write_text(json.dumps(other.snapshot()))
+    exited = subprocess.Popen([sys.executable, "-c", "pass"])
+    exited.wait()
+    (tmp_path / f"{exited.pid}.json").write_text(json.dumps(other.snapshot()))
+    text = shared.render()
+    assert 'requests_total{route="/a"} 8' in text
+    #Gauges of exited processes are dropped
+    assert 'in_flight{route="/a"} 1' in text
+    #This process's own file is skipped in favour of its live values
+    assert (tmp_path / f"{os.getpid()}.json").exists()
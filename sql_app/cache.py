@@ -0,0 +1,130 @@
+#Read-through cache for user lookups
+##Caches pydantic schemas.User snapshots, never ORM objects, so entries outlive their session
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from . import crud, models, schemas
+from .config import load_cache_settings
+
+MISSING = object()
+
+class LRUCache:
+	"""In-process backend: bounded LRU with a per-entry TTL and hit/miss/eviction counters
+
+	Any object with get/set/delete/clear/stats can stand in for it, e.g. a
+	shared-memory or socket backed cache for multi-worker deployments.
+	"""
+
+	def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+		self.maxsize = maxsize
+		self.ttl = ttl
+		self._entries = OrderedDict()
+		self._lock = threading.Lock()
+		self.hits = self.misses = self.evictions = self.expirations = 0
+
+	def get(self, key):
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is None:
+				self.misses += 1
+				return MISSING
+			value, expires = entry
+			if expires < time.monotonic():
+				del self._entries[key]
+				self.expirations += 1
+				self.misses += 1
+				return MISSING
+			self._entries.move_to_end(key)
+			self.hits += 1
+			return value
+
+	def set(self, key, value):
+		with self._lock:
+			self._entries[key] = (value, time.monotonic() + self.ttl)
+			self._entries.move_to_end(key)
+			while len(self._entries) > self.maxsize:
+				self._entries.popitem(last=False)
+				self.evictions += 1
+
+	def delete(self, key):
+		with self._lock:
+			self._entries.pop(key, None)
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+
+	def stats(self) -> dict:
+		with self._lock:
+			return {
+				"size": len(self._entries),
+				"maxsize": self.maxsize,
+				"hits": self.hits,
+				"misses": self.misses,
+				"evictions": self.evictions,
+				"expirations": self.expirations,
+			}
+
+_settings = load_cache_settings()
+user_cache = LRUCache(maxsize=_settings.maxsize, ttl=_settings.ttl)
+
+#Read data
+##Misses are cached too (as None) and cleared when a matching user is created, unless a
+##replica answered: a user created moments ago may not have reached it yet
+def _cacheable(db: Session, value) -> bool:
+	return value is not None or not getattr(db, "reads_from_replica", False)
+
+def _load_user(db: Session, user_id: int) -> schemas.User | None:
+	db_user = crud.get_user(db, user_id=user_id, load="joined")
+	return None if db_user is None else schemas.User.model_validate(db_user)
+
+def get_user(db: Session, user_id: int) -> schemas.User | None:
+	if not _settings.enabled:
+		return _load_user(db, user_id)
+	key = ("user", user_id)
+	user = user_cache.get(key)
+	if user is MISSING:
+		user = _load_user(db, user_id)
+		if _cacheable(db, user):
+			user_cache.set(key, user)
+	return user
+
+def get_user_by_email(db: Session, email: str) -> schemas.User | None:
+	key = ("email", email)
+	user_id = user_cache.get(key) if _settings.enabled else MISSING
+	if user_id is MISSING:
+		db_user = crud.get_user_by_email(db, email=email)
+		user_id = None if db_user is None else db_user.id
+		if _settings.enabled and _cacheable(db, user_id):
+			user_cache.set(key, user_id)
+	return None if user_id is None else get_user(db, user_id)
+
+#Invalidation
+def invalidate_user(user_id: int | None = None, email: str | None = None):
+	if user_id is not None:
+		user_cache.delete(("user", user_id))
+	if email is not None:
+		user_cache.delete(("email", email))
+
+##Every ORM flush records the users it touched, the commit then drops their entries
+@event.listens_for(Session, "after_flush")
+def _collect_changed_users(session, flush_context):
+	changed = session.info.setdefault("changed_users", set())
+	for instance in (*session.new, *session.dirty, *session.deleted):
+		if isinstance(instance, models.User):
+			changed.add((instance.id, instance.email))
+			for email in inspect(instance).attrs.email.history.deleted:
+				changed.add((None, email))
+		elif isinstance(instance, models.Item):
+			changed.add((instance.owner_id, None))
+			for owner_id in inspect(instance).attrs.owner_id.history.deleted:
+				changed.add((owner_id, None))
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changed_users(session):
+	for user_id, email in session.info.pop("changed_users", ()):
+		invalidate_user(user_id, email)
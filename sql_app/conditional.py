@@ -0,0 +1,37 @@
+#Conditional GET for the item lists
+##The ETag comes from the items version and Last-Modified from the time of the last write,
+##both read before the items, so a write in between can only make them older than the body.
+##If-None-Match takes precedence over If-Modified-Since, as in RFC 9110.
+import time
+from email.utils import formatdate, parsedate_to_datetime
+
+from fastapi import Request, Response
+
+from http_cache.etag import etag_matches
+
+def validators(version: int, modified_at: float, now: float | None = None) -> dict:
+	#modified_at also tells apart databases that were recreated and counted up to the same version
+	headers = {"ETag": f'"{version:x}-{int(modified_at * 1000):x}"'}
+	#Last-Modified has one second resolution, so it is only sent once the last write is in an
+	##earlier second than the response; a later write then always lands in a later second.
+	##Writes are timed when they run rather than at commit, so If-None-Match is the exact one.
+	now = time.time() if now is None else now
+	if modified_at and int(modified_at) < int(now):
+		headers["Last-Modified"] = formatdate(int(modified_at), usegmt=True)
+	return headers
+
+def is_not_modified(request: Request, headers: dict) -> bool:
+	if_none_match = request.headers.get("if-none-match")
+	if if_none_match is not None:
+		return etag_matches(if_none_match, headers["ETag"])
+	if_modified_since = request.headers.get("if-modified-since")
+	if if_modified_since is None or "Last-Modified" not in headers:
+		return False
+	try:
+		since = parsedate_to_datetime(if_modified_since).timestamp()
+	except (TypeError, ValueError):
+		return False
+	return parsedate_to_datetime(headers["Last-Modified"]).timestamp() <= since
+
+def not_modified(headers: dict) -> Response:
+	return Response(status_code=304, headers=headers)
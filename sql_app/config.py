@@ -0,0 +1,127 @@
+#Settings and environment variables
+##SQL_APP_DB_PROFILE picks a named engine profile, SQL_APP_DB_<FIELD> overrides one field of it
+##e.g. SQL_APP_DB_PROFILE=durable SQL_APP_DB_CACHE_SIZE=-200000 uvicorn sql_app.main:app
+import os
+from dataclasses import asdict, dataclass, fields, replace
+
+@dataclass(frozen=True)
+class EngineProfile:
+	"""SQLite pragmas set on every new connection, plus the pool configuration"""
+	#None leaves the SQLite default in place
+	journal_mode: str | None = None
+	synchronous: str | None = None
+	cache_size: int | None = None
+	mmap_size: int | None = None
+	busy_timeout: int | None = None
+	#queue, null, static or singleton
+	poolclass: str = "queue"
+	pool_size: int = 5
+	max_overflow: int = 10
+	#Compiled SQL statements kept per engine
+	query_cache_size: int = 500
+
+	def describe(self) -> str:
+		return ", ".join(f"{key}={value}" for key, value in asdict(self).items() if value is not None)
+
+PROFILES = {
+	#Rollback journal, what create_engine gives you out of the box
+	"default": EngineProfile(),
+	#Readers no longer block behind the writer, fsync only at checkpoints
+	"wal": EngineProfile(
+		journal_mode="WAL",
+		synchronous="NORMAL",
+		cache_size=-64000,
+		mmap_size=256 * 1024 * 1024,
+		busy_timeout=5000,
+	),
+	#WAL, but every commit is fsynced
+	"durable": EngineProfile(
+		journal_mode="WAL",
+		synchronous="FULL",
+		cache_size=-64000,
+		busy_timeout=5000,
+	),
+}
+
+DEFAULT_PROFILE = "wal"
+
+#Overrides are interpolated into PRAGMA statements, so only known values get through;
+##a typo fails at startup instead of on the first connection
+CHOICES = {
+	"journal_mode": ("DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"),
+	"synchronous": ("OFF", "NORMAL", "FULL", "EXTRA"),
+	"poolclass": ("queue", "null", "static", "singleton"),
+}
+
+def _parse(field, value: str):
+	variable = f"SQL_APP_DB_{field.name.upper()}"
+	if "int" in str(field.type):
+		try:
+			return int(value)
+		except ValueError:
+			raise ValueError(f"{variable} must be an integer, got {value!r}") from None
+	for choice in CHOICES.get(field.name, ()):
+		if choice.lower() == value.lower():
+			return choice
+	raise ValueError(f"Unknown {variable} {value!r}, expected one of {list(CHOICES.get(field.name, ()))}")
+
+def load_engine_profile(environ=os.environ) -> tuple[str, EngineProfile]:
+	name = environ.get("SQL_APP_DB_PROFILE", DEFAULT_PROFILE)
+	if name not in PROFILES:
+		raise ValueError(f"Unknown SQL_APP_DB_PROFILE {name!r}, expected one of {sorted(PROFILES)}")
+	overrides = {}
+	for field in fields(EngineProfile):
+		value = environ.get(f"SQL_APP_DB_{field.name.upper()}")
+		if value is not None:
+			overrides[field.name] = _parse(field, value)
+	return name, replace(PROFILES[name], **overrides)
+
+@dataclass(frozen=True)
+class CacheSettings:
+	"""User lookup cache, SQL_APP_USER_CACHE=0 turns it off"""
+	enabled: bool = True
+	maxsize: int = 1024
+	ttl: float = 60.0
+
+def load_cache_settings(environ=os.environ) -> CacheSettings:
+	return CacheSettings(
+		enabled=environ.get("SQL_APP_USER_CACHE", "1") != "0",
+		maxsize=int(environ.get("SQL_APP_USER_CACHE_SIZE", CacheSettings.maxsize)),
+		ttl=float(environ.get("SQL_APP_USER_CACHE_TTL", CacheSettings.ttl)),
+	)
+
+@dataclass(frozen=True)
+class GroupCommitSettings:
+	"""Group commit for item creation, off unless SQL_APP_GROUP_COMMIT=1"""
+	enabled: bool = False
+	window: float = 0.002
+	max_batch: int = 64
+
+def load_group_commit_settings(environ=os.environ) -> GroupCommitSettings:
+	return GroupCommitSettings(
+		enabled=environ.get("SQL_APP_GROUP_COMMIT", "0") == "1",
+		window=float(environ.get("SQL_APP_GROUP_COMMIT_WINDOW", GroupCommitSettings.window)),
+		max_batch=int(environ.get("SQL_APP_GROUP_COMMIT_MAX_BATCH", GroupCommitSettings.max_batch)),
+	)
+
+@dataclass(frozen=True)
+class QueryMetricsSettings:
+	"""Query latency metrics, SQL_APP_QUERY_METRICS=0 turns them off"""
+	enabled: bool = True
+	sample_rate: float = 0.01
+	slow_ms: float = 100.0
+
+def load_query_metrics_settings(environ=os.environ) -> QueryMetricsSettings:
+	return QueryMetricsSettings(
+		enabled=environ.get("SQL_APP_QUERY_METRICS", "1") != "0",
+		sample_rate=float(environ.get("SQL_APP_QUERY_METRICS_SAMPLE_RATE", QueryMetricsSettings.sample_rate)),
+		slow_ms=float(environ.get("SQL_APP_SLOW_QUERY_MS", QueryMetricsSettings.slow_ms)),
+	)
+
+def load_replica_urls(environ=os.environ) -> list[str]:
+	#Comma separated read replica URLs, none means everything goes to the primary
+	return [url.strip() for url in environ.get("SQL_APP_REPLICA_URLS", "").split(",") if url.strip()]
+
+def load_item_shard_urls(environ=os.environ) -> list[str]:
+	#Comma separated SQLite URLs holding items by owner, none keeps items in the primary
+	return [url.strip() for url in environ.get("SQL_APP_ITEM_SHARDS", "").split(",") if url.strip()]
@@ -1,34 +1,363 @@
-from sqlalchemy.orm import Session
+import heapq
+import itertools
 
-from . import models, schemes
+from sqlalchemy import bindparam, insert, select, text, tuple_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import Session, joinedload, load_only, selectinload
+
+from . import models, schemas, search
+
+#Relationship loading strategies for User.items
+##selectin: one extra IN query per page, best for lists
+##joined: a single LEFT OUTER JOIN, best for one row
+LOADERS = {"selectin": selectinload, "joined": joinedload}
+
+def _users(db: Session, load: str | None = None):
+	query = db.query(models.User)
+	if load is not None:
+		query = query.options(LOADERS[load](models.User.items))
+	return query
+
+#Hot lookups run pre-built statements with bound parameters, so each call skips
+##building and hashing a new Query and goes straight to the compiled cache
+def _with_loaders(statement) -> dict:
+	statements = {None: statement}
+	for name, loader in LOADERS.items():
+		statements[name] = statement.options(loader(models.User.items))
+	return statements
+
+USER_BY_ID = _with_loaders(select(models.User).where(models.User.id == bindparam("user_id")))
+USER_ID_BY_ID = select(models.User.id).where(models.User.id == bindparam("user_id"))
+USER_BY_EMAIL = select(models.User).where(models.User.email == bindparam("email")).limit(1)
+USERS_PAGE = _with_loaders(
+	select(models.User).order_by(models.User.id).offset(bindparam("skip")).limit(bindparam("limit"))
+)
+ITEMS_PAGE = (
+	select(models.Item).order_by(models.Item.id).offset(bindparam("skip")).limit(bindparam("limit"))
+)
+
+#Sparse fieldsets: select only the requested columns (the primary key always comes along)
+##raiseload turns a stray access to a column that was left out into an error instead of a lazy load per row
+def _project(statement, model, fields: tuple[str, ...] | None):
+	if fields is None:
+		return statement
+	columns = [getattr(model, name) for name in fields if name in model.__table__.columns]
+	return statement.options(load_only(model.id, *columns, raiseload=True))
 
 #CRUD utils
 #Read data
-def get_user(db: Session, user_id: int):
-	return db.query(models.User).filter(models.User.id == user_id).first()
+def get_user(db: Session, user_id: int, load: str | None = None):
+	#No LIMIT: a joined load returns one row per item, unique() folds them back
+	return db.scalars(USER_BY_ID[load], {"user_id": user_id}).unique().first()
+
+#Existence only: a primary key lookup, the user's items are never loaded
+def user_exists(db: Session, user_id: int) -> bool:
+	return db.scalar(USER_ID_BY_ID, {"user_id": user_id}) is not None
 
 def get_user_by_email(db: Session, email: str):
-	return db.query(models.User).filter(models.User.email == email).first()
+	return db.scalars(USER_BY_EMAIL, {"email": email}).first()
+
+def get_users(
+	db: Session, skip: int = 0, limit: int = 100, load: str | None = None, fields: tuple[str, ...] | None = None
+):
+	statement = _project(USERS_PAGE[load], models.User, fields)
+	return db.scalars(statement, {"skip": skip, "limit": limit}).unique().all()
+
+def get_items(db: Session, skip: int = 0, limit: int = 100, fields: tuple[str, ...] | None = None):
+	return db.scalars(_project(ITEMS_PAGE, models.Item, fields), {"skip": skip, "limit": limit}).all()
+
+#Keyset pagination: seek past the last key instead of scanning skipped rows
+def get_users_after(
+	db: Session, after_id: int | None = None, limit: int = 100, load: str | None = None,
+	fields: tuple[str, ...] | None = None,
+):
+	query = _project(_users(db, load), models.User, fields)
+	if after_id is not None:
+		query = query.filter(models.User.id > after_id)
+	return query.order_by(models.User.id).limit(limit).all()
+
+ITEM_ORDERINGS = ("id", "title")
+
+def get_items_after(
+	db: Session, after: list | None = None, limit: int = 100, order_by: str = "id",
+	fields: tuple[str, ...] | None = None,
+):
+	#The sort key is always loaded, the next cursor is built from it
+	query = _project(db.query(models.Item), models.Item, fields and (*fields, order_by))
+	if order_by == "title":
+		#(title, id) keeps the order total when titles repeat
+		if after is not None:
+			title, item_id = after
+			#A row value comparison lets SQLite seek the title index
+			query = query.filter(tuple_(models.Item.title, models.Item.id) > tuple_(title, item_id))
+		query = query.order_by(models.Item.title, models.Item.id)
+	else:
+		if after is not None:
+			query = query.filter(models.Item.id > after[0])
+		query = query.order_by(models.Item.id)
+	return query.limit(limit).all()
+
+def item_sort_key(item: models.Item, order_by: str = "id") -> list:
+	if order_by == "title":
+		return [item.title, item.id]
+	return [item.id]
+
+#Full-text search, best bm25 score first, keyset paged on (score, id)
+def search_items(db: Session, q: str, after: list | None = None, limit: int = 100):
+	statement = search.SEARCH_SQL
+	params = {"match": search.match_expression(q), "limit": limit}
+	if after is not None:
+		statement += "WHERE (score, id) > (:score, :id)\n"
+		params["score"], params["id"] = after
+	statement += "ORDER BY score, id LIMIT :limit"
+	return db.execute(text(statement), params).all()
+
+#Sharded reads: every shard runs the same ordered query and the sorted results are merged
+##Each shard returns its own first skip + limit rows, enough to hold the global first
+def merge_sorted(results, key, limit: int, skip: int = 0) -> list:
+	return list(itertools.islice(heapq.merge(*results, key=key), skip, skip + limit))
+
+def get_items_across(
+	dbs: list[Session], skip: int = 0, limit: int = 100, after: list | None = None, order_by: str = "id",
+	fields: tuple[str, ...] | None = None,
+):
+	if after is None and order_by == "id":
+		results = [get_items(db, skip=0, limit=skip + limit, fields=fields) for db in dbs]
+	else:
+		results = [
+			get_items_after(db, after=after, limit=skip + limit, order_by=order_by, fields=fields) for db in dbs
+		]
+	return merge_sorted(results, key=lambda item: item_sort_key(item, order_by), limit=limit, skip=skip)
 
-def get_users(db: Session, skip: int = 0, limit: int = 100):
-	return db.query(models.User).offset(skip).limit(limit).all()
+def get_items_for_owners(db: Session, owner_ids: list[int]):
+	return db.scalars(
+		select(models.Item).where(models.Item.owner_id.in_(owner_ids)).order_by(models.Item.owner_id, models.Item.id)
+	).all()
 
-def get_items(db: Session, skip: int = 0, limit: int = 100):
-	return db.query(models.Item).offset(skip).limit(limit).all()
+#bm25 statistics are per shard, so scores from different shards are close but not exact
+def search_items_across(dbs: list[Session], q: str, after: list | None = None, limit: int = 100):
+	results = [search_items(db, q=q, after=after, limit=limit) for db in dbs]
+	return merge_sorted(results, key=lambda row: (row.score, row.id), limit=limit)
+
+#Version and last write time of the items table, maintained by the versions.py triggers
+##Summed over shards: each shard's version only grows, so the sum changes whenever any shard does
+def get_items_version(dbs: list[Session]) -> tuple[int, float]:
+	version, modified_at = 0, 0.0
+	for db in dbs:
+		row = db.execute(
+			select(models.TableVersion.version, models.TableVersion.modified_at)
+			.where(models.TableVersion.name == "items")
+		).one_or_none()
+		if row is not None:
+			version += row.version
+			modified_at = max(modified_at, row.modified_at)
+	return version, modified_at
+
+#Per-owner counters, maintained incrementally by the stats.py triggers
+def get_user_stats(db: Session, user_id: int):
+	item_count = db.scalar(
+		select(models.UserStats.item_count).where(models.UserStats.user_id == user_id)
+	)
+	return schemas.UserStats(user_id=user_id, item_count=item_count or 0)
+
+def get_users_stats(db: Session, user_ids: list[int] | None = None, skip: int = 0, limit: int = 100):
+	query = select(models.UserStats)
+	if user_ids:
+		query = query.where(models.UserStats.user_id.in_(user_ids))
+	else:
+		query = query.order_by(models.UserStats.user_id).offset(skip).limit(limit)
+	counts = {row.user_id: row.item_count for row in db.scalars(query)}
+	#Owners without items have no counter row yet
+	return [
+		schemas.UserStats(user_id=user_id, item_count=counts.get(user_id, 0))
+		for user_id in (user_ids or counts)
+	]
+
+#Stream rows for exports
+##Plain column tuples in batches of yield_per, nothing is kept in the identity map
+EXPORT_BATCH_SIZE = 1000
+ITEM_EXPORT_COLUMNS = ("id", "title", "description", "owner_id")
+USER_EXPORT_COLUMNS = ("id", "email", "is_active")
+
+def _stream(db: Session, model, columns: tuple, batch_size: int):
+	statement = (
+		select(*(getattr(model, column) for column in columns))
+		.order_by(model.id)
+		.execution_options(yield_per=batch_size)
+	)
+	for partition in db.execute(statement).partitions():
+		yield from partition
+
+def stream_items(db: Session, batch_size: int = EXPORT_BATCH_SIZE):
+	return _stream(db, models.Item, ITEM_EXPORT_COLUMNS, batch_size)
+
+def stream_users(db: Session, batch_size: int = EXPORT_BATCH_SIZE):
+	return _stream(db, models.User, USER_EXPORT_COLUMNS, batch_size)
+
+def stream_items_across(dbs: list[Session], batch_size: int = EXPORT_BATCH_SIZE):
+	#heapq.merge is lazy, one batch per shard is held at a time
+	return heapq.merge(*(stream_items(db, batch_size) for db in dbs), key=lambda row: row.id)
 
 #Create data
-def create_user(db: Session, user: schemas.UserCreate):
+##Signup is one INSERT ... ON CONFLICT DO NOTHING RETURNING: no duplicate check
+##beforehand, no refresh after, and two racing signups cannot both get in
+def create_user(db: Session, user: schemas.UserCreate) -> schemas.User | None:
 	fake_hashed_password = user.password + "notreallyhashed"
-    db_user = models.User(email=user.email, hashed_password=fake_hashed_password)
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return db_user
+	row = db.execute(
+		sqlite_insert(models.User)
+		.values(email=user.email, hashed_password=fake_hashed_password)
+		.on_conflict_do_nothing(index_elements=[models.User.email])
+		.returning(models.User.id, models.User.email, models.User.is_active)
+	).first()
+	db.commit()
+	if row is None:
+		return None
+	#A brand new user owns no items yet
+	return schemas.User(id=row.id, email=row.email, is_active=row.is_active, items=[])
+
+#Sharded sessions carry an id allocator in session.info, ids then stay unique across shards;
+##otherwise the id is left to SQLite
+def _new_item_ids(db: Session, count: int) -> list:
+	allocator = db.info.get("item_ids")
+	return allocator.allocate(count) if allocator is not None else [None] * count
 
 def create_user_item(db: Session, item: schemas.ItemCreate, user_id: int):
-	db_item = models.Item(**item.dict(), owner_id=user_id)
-    db.add(db_item)
-    db.commit()
-    db.refresh(db_item)
-    return db_item
-    
\ No newline at end of file
+	(item_id,) = _new_item_ids(db, 1)
+	db_item = models.Item(**item.dict(), owner_id=user_id, id=item_id)
+	db.add(db_item)
+	db.commit()
+	db.refresh(db_item)
+	return db_item
+
+#Group commit: items from many callers flushed as one INSERT and made durable by one commit
+##Returns one schemas.Item or IntegrityError per row, in order
+def create_user_items_grouped(db: Session, rows: list[tuple[schemas.ItemCreate, int]]) -> list:
+	db_items = [
+		models.Item(**item.dict(), owner_id=user_id, id=item_id)
+		for (item, user_id), item_id in zip(rows, _new_item_ids(db, len(rows)))
+	]
+	try:
+		with db.begin_nested():
+			db.add_all(db_items)
+		results = list(db_items)
+	except IntegrityError:
+		#Retry row by row so one bad row does not fail every caller in the batch
+		results = []
+		for db_item in db_items:
+			try:
+				with db.begin_nested():
+					db.add(db_item)
+				results.append(db_item)
+			except IntegrityError as exc:
+				results.append(exc)
+	#Snapshot before commit expires the rows
+	results = [
+		schemas.Item.model_validate(row) if isinstance(row, models.Item) else row for row in results
+	]
+	db.commit()
+	return results
+
+#Create-or-get: a repeated key returns the item the first request created.
+##A replay is answered by the lookup and writes nothing, so it neither bumps the items
+##version nor takes an id from the allocator. DO NOTHING covers a request racing this one.
+ITEM_COLUMNS = (models.Item.id, models.Item.title, models.Item.description, models.Item.owner_id)
+ITEM_BY_IDEMPOTENCY_KEY = select(*ITEM_COLUMNS).where(
+	models.Item.owner_id == bindparam("user_id"), models.Item.idempotency_key == bindparam("idempotency_key")
+)
+
+def create_or_get_user_item(db: Session, item: schemas.ItemCreate, user_id: int, idempotency_key: str):
+	key = {"user_id": user_id, "idempotency_key": idempotency_key}
+	row = db.execute(ITEM_BY_IDEMPOTENCY_KEY, key).first()
+	if row is None:
+		(item_id,) = _new_item_ids(db, 1)
+		statement = sqlite_insert(models.Item).values(
+			**item.dict(), owner_id=user_id, idempotency_key=idempotency_key, id=item_id
+		)
+		row = db.execute(
+			statement.on_conflict_do_nothing(
+				index_elements=[models.Item.owner_id, models.Item.idempotency_key]
+			).returning(*ITEM_COLUMNS)
+		).first()
+		if row is None:
+			row = db.execute(ITEM_BY_IDEMPOTENCY_KEY, key).one()
+	db.commit()
+	return schemas.Item.model_validate(row)
+
+#Bulk create data
+##One transaction and one executemany INSERT ... RETURNING per batch, no refresh per row
+BULK_CHUNK_SIZE = 500
+
+def _chunks(rows: list, size: int = BULK_CHUNK_SIZE):
+	for start in range(0, len(rows), size):
+		yield start, rows[start:start + size]
+
+def create_users_bulk(db: Session, users: list[schemas.UserCreate]):
+	ids = [None] * len(users)
+	errors = []
+	#Duplicates inside the batch and already stored emails are reported, not inserted
+	seen = set()
+	for _, chunk in _chunks(users):
+		emails = [user.email for user in chunk]
+		seen.update(db.scalars(select(models.User.email).where(models.User.email.in_(emails))))
+	pending = {}
+	for index, user in enumerate(users):
+		if user.email in seen:
+			errors.append(schemas.BulkError(index=index, detail="Email already registered"))
+			continue
+		seen.add(user.email)
+		pending[user.email] = index
+	rows = [
+		{"email": users[index].email, "hashed_password": users[index].password + "notreallyhashed"}
+		for index in pending.values()
+	]
+	#ON CONFLICT DO NOTHING covers a concurrent signup racing this batch
+	statement = (
+		sqlite_insert(models.User)
+		.on_conflict_do_nothing(index_elements=[models.User.email])
+		.returning(models.User.id, models.User.email)
+	)
+	for _, chunk in _chunks(rows):
+		try:
+			with db.begin_nested():
+				inserted = db.execute(statement, chunk).all()
+		except (IntegrityError, OperationalError):
+			#Retry the failed chunk row by row so one bad row does not sink the batch
+			inserted = []
+			for row in chunk:
+				try:
+					with db.begin_nested():
+						inserted += db.execute(statement, [row]).all()
+				except (IntegrityError, OperationalError) as exc:
+					errors.append(schemas.BulkError(index=pending.pop(row["email"]), detail=str(exc.orig)))
+		for user_id, email in inserted:
+			ids[pending.pop(email)] = user_id
+	db.commit()
+	for index in pending.values():
+		errors.append(schemas.BulkError(index=index, detail="Email already registered"))
+	errors.sort(key=lambda error: error.index)
+	return schemas.BulkResult(ids=ids, errors=errors)
+
+def create_user_items_bulk(db: Session, items: list[schemas.ItemCreate], user_id: int):
+	ids = [None] * len(items)
+	errors = []
+	statement = insert(models.Item).returning(models.Item.id, sort_by_parameter_order=True)
+	for start, chunk in _chunks(items):
+		rows = [
+			dict(**item.dict(), owner_id=user_id, id=item_id)
+			for item, item_id in zip(chunk, _new_item_ids(db, len(chunk)))
+		]
+		try:
+			with db.begin_nested():
+				for offset, item_id in enumerate(db.scalars(statement, rows)):
+					ids[start + offset] = item_id
+		except IntegrityError:
+			#Retry the failed chunk row by row so one bad row does not sink the batch
+			for offset, row in enumerate(rows):
+				try:
+					with db.begin_nested():
+						ids[start + offset] = db.scalar(statement, [row])
+				except IntegrityError as exc:
+					errors.append(schemas.BulkError(index=start + offset, detail=str(exc.orig)))
+	db.commit()
+	return schemas.BulkResult(ids=ids, errors=errors)
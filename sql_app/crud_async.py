@@ -0,0 +1,84 @@
+#Async CRUD utils, the AsyncSession counterparts of crud.py
+##Relationships cannot lazy load under asyncio, so User.items is always selectin loaded
+from sqlalchemy import select, tuple_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from . import models, schemas
+
+def _users():
+	return select(models.User).options(selectinload(models.User.items))
+
+#Read data
+async def get_user(db: AsyncSession, user_id: int):
+	result = await db.execute(_users().where(models.User.id == user_id))
+	return result.scalars().first()
+
+async def get_user_by_email(db: AsyncSession, email: str):
+	result = await db.execute(_users().where(models.User.email == email))
+	return result.scalars().first()
+
+async def get_users(db: AsyncSession, skip: int = 0, limit: int = 100):
+	result = await db.execute(_users().order_by(models.User.id).offset(skip).limit(limit))
+	return result.scalars().all()
+
+async def get_items(db: AsyncSession, skip: int = 0, limit: int = 100):
+	result = await db.execute(
+		select(models.Item).order_by(models.Item.id).offset(skip).limit(limit)
+	)
+	return result.scalars().all()
+
+async def get_items_version(db: AsyncSession) -> tuple[int, float]:
+	#See crud.get_items_version
+	result = await db.execute(
+		select(models.TableVersion.version, models.TableVersion.modified_at)
+		.where(models.TableVersion.name == "items")
+	)
+	row = result.one_or_none()
+	return (row.version, row.modified_at) if row is not None else (0, 0.0)
+
+#Keyset pagination, see crud.get_users_after / crud.get_items_after
+async def get_users_after(db: AsyncSession, after_id: int | None = None, limit: int = 100):
+	query = _users()
+	if after_id is not None:
+		query = query.where(models.User.id > after_id)
+	result = await db.execute(query.order_by(models.User.id).limit(limit))
+	return result.scalars().all()
+
+async def get_items_after(db: AsyncSession, after: list | None = None, limit: int = 100, order_by: str = "id"):
+	query = select(models.Item)
+	if order_by == "title":
+		if after is not None:
+			title, item_id = after
+			#A row value comparison lets SQLite seek the title index
+			query = query.where(tuple_(models.Item.title, models.Item.id) > tuple_(title, item_id))
+		query = query.order_by(models.Item.title, models.Item.id)
+	else:
+		if after is not None:
+			query = query.where(models.Item.id > after[0])
+		query = query.order_by(models.Item.id)
+	result = await db.execute(query.limit(limit))
+	return result.scalars().all()
+
+#Create data
+async def create_user(db: AsyncSession, user: schemas.UserCreate) -> schemas.User | None:
+	#One INSERT ... ON CONFLICT DO NOTHING RETURNING, see crud.create_user
+	fake_hashed_password = user.password + "notreallyhashed"
+	result = await db.execute(
+		sqlite_insert(models.User)
+		.values(email=user.email, hashed_password=fake_hashed_password)
+		.on_conflict_do_nothing(index_elements=[models.User.email])
+		.returning(models.User.id, models.User.email, models.User.is_active)
+	)
+	row = result.first()
+	await db.commit()
+	if row is None:
+		return None
+	return schemas.User(id=row.id, email=row.email, is_active=row.is_active, items=[])
+
+async def create_user_item(db: AsyncSession, item: schemas.ItemCreate, user_id: int):
+	db_item = models.Item(**item.dict(), owner_id=user_id)
+	db.add(db_item)
+	await db.commit()
+	return db_item
@@ -0,0 +1,51 @@
+#Streaming NDJSON / CSV exports
+##Rows are encoded one at a time, so memory stays flat however big the table is
+import csv
+import io
+import json
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+def ndjson_lines(rows, columns: tuple):
+	for row in rows:
+		yield json.dumps(dict(zip(columns, row)), separators=(",", ":")) + "\n"
+
+def csv_lines(rows, columns: tuple):
+	buffer = io.StringIO()
+	writer = csv.writer(buffer)
+	writer.writerow(columns)
+	yield buffer.getvalue()
+	for row in rows:
+		buffer.seek(0)
+		buffer.truncate()
+		writer.writerow(row)
+		yield buffer.getvalue()
+
+#Send ~64KB chunks rather than one tiny chunk per row
+CHUNK_SIZE = 64 * 1024
+
+def chunked(lines, size: int = CHUNK_SIZE):
+	chunk = []
+	length = 0
+	for line in lines:
+		chunk.append(line)
+		length += len(line)
+		if length >= size:
+			yield "".join(chunk)
+			chunk = []
+			length = 0
+	if chunk:
+		yield "".join(chunk)
+
+def export_response(rows, columns: tuple, format: str, filename: str) -> StreamingResponse:
+	if format not in MEDIA_TYPES:
+		raise HTTPException(status_code=400, detail="format must be ndjson or csv")
+	lines = ndjson_lines(rows, columns) if format == "ndjson" else csv_lines(rows, columns)
+	return StreamingResponse(
+		chunked(lines),
+		media_type=MEDIA_TYPES[format],
+		headers={"Content-Disposition": f'attachment; filename="{filename}.{format}"'},
+	)
@@ -0,0 +1,16 @@
+#Sparse fieldsets: ?fields=id,title asks for just those fields of each row
+##The names are checked against the response schema, never against the database models
+from fastapi import HTTPException
+from pydantic import BaseModel
+
+def parse_fields(fields: str | None, model: type[BaseModel]) -> tuple[str, ...] | None:
+	if fields is None:
+		return None
+	requested = [name.strip() for name in fields.split(",") if name.strip()]
+	if not requested:
+		raise HTTPException(status_code=400, detail="Empty fields")
+	unknown = [name for name in requested if name not in model.model_fields]
+	if unknown:
+		raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+	#Response order follows the schema, not the query string
+	return tuple(name for name in model.model_fields if name in requested)
@@ -0,0 +1,92 @@
+#Group commit for concurrent item creation
+##Every commit waits for the SQLite write lock and an fsync, so one commit per request caps
+##write throughput. Here callers queue their rows and a single writer thread commits whatever
+##arrived within window seconds (or max_batch rows) as one transaction. Each caller blocks
+##until that commit returns and gets back its own row.
+##The commit is as durable as the engine profile's synchronous setting makes it.
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from . import crud, schemas
+
+#Put on the queue by close() to stop the writer
+_STOP = object()
+
+class GroupCommitter:
+	"""Coalesces concurrent create_user_item calls into shared transactions"""
+
+	def __init__(self, session_factory, window: float = 0.002, max_batch: int = 64):
+		self.session_factory = session_factory
+		self.window = window
+		self.max_batch = max_batch
+		self.batches = self.rows = 0
+		self._queue = queue.Queue()
+		self._lock = threading.Lock()
+		self._thread = None
+
+	def submit(self, item: schemas.ItemCreate, user_id: int) -> schemas.Item:
+		future = Future()
+		with self._lock:
+			if self._thread is None:
+				self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+				self._thread.start()
+			self._queue.put((item, user_id, future))
+		return future.result()
+
+	def close(self):
+		#Commits what is already queued, then stops the writer; a later submit starts a new one
+		with self._lock:
+			thread, self._thread = self._thread, None
+			if thread is not None:
+				self._queue.put(_STOP)
+		if thread is not None:
+			thread.join()
+
+	def stats(self) -> dict:
+		return {
+			"batches": self.batches,
+			"rows": self.rows,
+			"rows_per_batch": self.rows / self.batches if self.batches else 0.0,
+		}
+
+	def _run(self):
+		while True:
+			entry = self._queue.get()
+			if entry is _STOP:
+				return
+			batch = [entry]
+			deadline = time.monotonic() + self.window
+			stopping = False
+			while len(batch) < self.max_batch:
+				timeout = deadline - time.monotonic()
+				if timeout <= 0:
+					break
+				try:
+					entry = self._queue.get(timeout=timeout)
+				except queue.Empty:
+					break
+				if entry is _STOP:
+					stopping = True
+					break
+				batch.append(entry)
+			self._commit(batch)
+			if stopping:
+				return
+
+	def _commit(self, batch: list):
+		try:
+			with self.session_factory() as db:
+				results = crud.create_user_items_grouped(db, [(item, user_id) for item, user_id, _ in batch])
+		except Exception as exc:
+			for _, _, future in batch:
+				future.set_exception(exc)
+			return
+		self.batches += 1
+		self.rows += len(batch)
+		for (_, _, future), result in zip(batch, results):
+			if isinstance(result, Exception):
+				future.set_exception(result)
+			else:
+				future.set_result(result)
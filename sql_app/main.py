@@ -1,61 +1,369 @@
 #Main FastAPI app
 #Create the database tables
-from fastapi import Depends, FastAPI, HTTPException, Request, Response
+import logging
+
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.responses import PlainTextResponse
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+from starlette.concurrency import run_in_threadpool
+
+from metrics.prometheus import CONTENT_TYPE, Registry, SharedDirectory
+from metrics.request_metrics import RequestMetrics, RequestMetricsMiddleware, load_request_metrics_settings
 
-from . import crud, models, schemas
-from .database import SessionLocal, engine
+from . import cache, conditional, crud, export, fast_json, models, schemas, search
+from .config import load_group_commit_settings, load_query_metrics_settings
+from .database import (
+	ENGINE_PROFILE, ENGINE_PROFILE_NAME, LazySession, SessionLocal, compiled_cache_stats, engine,
+	pool_metrics, replica_engines, shard_engines, upgrade_schema,
+)
+from .fieldsets import parse_fields
+from .group_commit import GroupCommitter
+from .pagination import decode_cursor, encode_cursor
+from .query_metrics import QueryMetrics, track_route
+from .sharding import ShardSessions, ShardSet
 
 models.Base.metadata.create_all(bind=engine)
+upgrade_schema(engine)
+search.create_search_index(engine)
+
+#Served by GET /metrics
+REGISTRY = Registry()
+
+#Latency, in-flight requests and status codes per route, see metrics.request_metrics
+REQUEST_METRICS = load_request_metrics_settings("SQL_APP")
+request_metrics = (
+	RequestMetrics(REGISTRY, server_timing=REQUEST_METRICS.server_timing) if REQUEST_METRICS.enabled else None
+)
+#With several workers every process writes its metrics to the directory and /metrics sums them
+shared_metrics = (
+	SharedDirectory(REGISTRY, REQUEST_METRICS.metrics_dir, REQUEST_METRICS.interval)
+	if REQUEST_METRICS.metrics_dir else None
+)
+
+#track_route labels query metrics with the route template
+app = FastAPI(dependencies=[
+	Depends(track_route),
+	*([Depends(request_metrics.track_in_flight)] if request_metrics is not None else []),
+])
+
+logger = logging.getLogger(__name__)
+
+@app.on_event("startup")
+def report_engine_profile():
+	logger.info("SQLite engine profile %s: %s", ENGINE_PROFILE_NAME, ENGINE_PROFILE.describe())
+
+#Query latency per crud function and route, see query_metrics
+QUERY_METRICS = load_query_metrics_settings()
+query_metrics = (
+	QueryMetrics(REGISTRY, sample_rate=QUERY_METRICS.sample_rate, slow_seconds=QUERY_METRICS.slow_ms / 1000)
+	if QUERY_METRICS.enabled else None
+)
+
+def meter_engines(engines):
+	if query_metrics is not None:
+		for metered_engine in engines:
+			query_metrics.attach(metered_engine)
+
+#Item shards too: per-owner item queries and fan-out listings run there, not on the primary
+meter_engines((engine, *replica_engines, *shard_engines.values()))
+
+#Optional owner-sharded items, see sharding; None keeps items in the primary
+shard_set = ShardSet(shard_engines, engine) if shard_engines else None
 
-app = FastAPI()
+#Optional group commit for POST /users/{user_id}/items/, see group_commit
+GROUP_COMMIT = load_group_commit_settings()
+group_committer = (
+	GroupCommitter(SessionLocal, window=GROUP_COMMIT.window, max_batch=GROUP_COMMIT.max_batch)
+	if GROUP_COMMIT.enabled else None
+)
+
+@app.on_event("shutdown")
+def stop_group_committer():
+	if group_committer is not None:
+		group_committer.close()
 
 #Create a middleware
-@app.middleware("https")
-async def db_session_middleware(request: Request, call_next):
-	response = Response("Internal Server Error", status_code=500)
-	try:
-		request.state.db = SessionLocal()
-		response = await call_next(request)
-	finally:
-		request.state.db.close()
-	return response
+##The session is opened lazily by get_db and shared by everything in the request,
+##shard sessions likewise on first use of each shard. Plain ASGI, so the app returns only
+##once the body is sent and the handler's background tasks have run: streaming exports and
+##those tasks can keep using the session until then.
+class DBSessionMiddleware:
+	"""Per-request LazySession and ShardSessions in request.state, closed after the response"""
+
+	def __init__(self, app):
+		self.app = app
+
+	async def __call__(self, scope, receive, send):
+		if scope["type"] != "http":
+			return await self.app(scope, receive, send)
+		state = scope.setdefault("state", {})
+		state["db"] = LazySession()
+		state["shards"] = ShardSessions(shard_set) if shard_set is not None else None
+		try:
+			await self.app(scope, receive, send)
+		finally:
+			await run_in_threadpool(close_sessions, state)
+
+app.add_middleware(DBSessionMiddleware)
+#Added last so it is the outermost middleware and times the others too
+if request_metrics is not None:
+	app.add_middleware(RequestMetricsMiddleware, metrics=request_metrics)
+
+def close_sessions(state: dict):
+	state["db"].close()
+	if state["shards"] is not None:
+		state["shards"].close()
 
 # Dependency
-def get_db():
-	db = sessionLocal()
-	try:
-		yield db
-	finally:
-		db.close()
+def get_db(request: Request):
+	return request.state.db.session
+
+def get_shards(request: Request) -> ShardSessions | None:
+	return request.state.shards
+
+def attach_sharded_items(shards: ShardSessions, users: list):
+	#User.items is empty in the primary when items are sharded, fill it from the owners' shards
+	items = {user.id: [] for user in users}
+	for shard_db, owner_ids in shards.by_owner(items):
+		for item in crud.get_items_for_owners(shard_db, owner_ids):
+			items[item.owner_id].append(item)
+	for user in users:
+		set_committed_value(user, "items", items[user.id])
 
 #Create your FastAPI path operations
+##Prometheus scrape endpoint
+@app.get("/metrics", response_class=PlainTextResponse)
+def read_metrics():
+	body = shared_metrics.render() if shared_metrics is not None else REGISTRY.render()
+	return PlainTextResponse(body, media_type=CONTENT_TYPE)
+
+@app.get("/metrics/slow-queries")
+def read_slow_queries():
+	return list(query_metrics.slow_queries) if query_metrics is not None else []
+
+@app.get("/metrics/pool")
+def read_pool_metrics():
+	return pool_metrics.stats()
+
+@app.get("/metrics/statement-cache")
+def read_statement_cache_metrics():
+	return compiled_cache_stats.stats()
+
+@app.get("/metrics/group-commit")
+def read_group_commit_metrics():
+	if group_committer is None:
+		return {"enabled": False}
+	return {"enabled": True, **group_committer.stats()}
+
 @app.post("/users/", response_model=schemas.User)
 def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-	db_user = crud.get_user_by_email(db, email=user.email)
-	if db_user:
+	db_user = crud.create_user(db=db, user=user)
+	if db_user is None:
 		raise HTTPException(status_code=400, detail="Email already registered")
-	return crud.create_user(db=db, user=user)
+	#The INSERT skipped the ORM flush, so drop any cached "no such user" by hand
+	cache.invalidate_user(db_user.id, db_user.email)
+	return db_user
+
+@app.post("/users/bulk", response_model=schemas.BulkResult)
+def create_users_bulk(users: list[schemas.UserCreate], db: Session = Depends(get_db)):
+    result = crud.create_users_bulk(db=db, users=users)
+    #Bulk inserts skip the ORM flush, so drop cached misses by hand
+    for user, user_id in zip(users, result.ids):
+        if user_id is not None:
+            cache.invalidate_user(user_id, user.email)
+    return result
+
+#Stream the whole table as NDJSON or CSV without loading it into memory
+@app.get("/users/export")
+def export_users(format: str = "ndjson", db: Session = Depends(get_db)):
+    return export.export_response(
+        crud.stream_users(db), crud.USER_EXPORT_COLUMNS, format, "users"
+    )
+
+@app.get("/users/stats", response_model=list[schemas.UserStats])
+def read_users_stats(
+    user_id: list[int] = Query(default=[]),
+    skip: int = 0,
+    limit: int = 100,
+    db: Session = Depends(get_db),
+    shards: ShardSessions | None = Depends(get_shards),
+):
+    if shards is None:
+        return crud.get_users_stats(db, user_ids=user_id, skip=skip, limit=limit)
+    if user_id:
+        stats = {}
+        for shard_db, owner_ids in shards.by_owner(user_id):
+            stats.update((row.user_id, row) for row in crud.get_users_stats(shard_db, user_ids=owner_ids))
+        return [stats[owner_id] for owner_id in user_id]
+    results = [crud.get_users_stats(shard_db, skip=0, limit=skip + limit) for shard_db in shards.all()]
+    return crud.merge_sorted(results, key=lambda row: row.user_id, limit=limit, skip=skip)
 
+#Pass the X-Next-Cursor header back as ?cursor= to page by key instead of offset
+##?fast=true encodes the rows straight to JSON, see fast_json
+##?fields=id,email selects and sends only those fields
 @app.get("/users/", response_model=list[schemas.User])
-def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    users = crud.get_users(db, skip=skip, limit=limit)
+def read_users(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: str | None = None,
+    fast: bool = False,
+    fields: str | None = None,
+    db: Session = Depends(get_db),
+    shards: ShardSessions | None = Depends(get_shards),
+):
+    only = parse_fields(fields, schemas.User)
+    with_items = only is None or "items" in only
+    load = "selectin" if with_items and shards is None else None
+    if cursor is not None:
+        (after_id,) = decode_cursor(cursor, "id")
+        users = crud.get_users_after(db, after_id=after_id, limit=limit, load=load, fields=only)
+    else:
+        users = crud.get_users(db, skip=skip, limit=limit, load=load, fields=only)
+    if with_items and shards is not None:
+        attach_sharded_items(shards, users)
+    if users and len(users) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor("id", [users[-1].id])
+    #Partially loaded rows cannot pass response_model validation, they always take the fast path
+    if fast or only is not None:
+        return fast_json.response(users, schemas.User, headers=response.headers, only=only)
     return users
 
 @app.get("/users/{user_id}", response_model=schemas.User)
-def read_user(user_id: int, db: Session = Depends(get_db)):
-    db_user = crud.get_user(db, user_id=user_id)
+def read_user(
+    user_id: int,
+    db: Session = Depends(get_db),
+    shards: ShardSessions | None = Depends(get_shards),
+):
+    db_user = cache.get_user(db, user_id=user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
+    if shards is not None:
+        items = crud.get_items_for_owners(shards.for_owner(user_id), [user_id])
+        db_user = db_user.model_copy(update={"items": [schemas.Item.model_validate(item) for item in items]})
     return db_user
 
+@app.get("/users/{user_id}/stats", response_model=schemas.UserStats)
+def read_user_stats(
+    user_id: int,
+    db: Session = Depends(get_db),
+    shards: ShardSessions | None = Depends(get_shards),
+):
+    #A primary key lookup, so heavy owners stay as cheap as the counter row
+    if not crud.user_exists(db, user_id=user_id):
+        raise HTTPException(status_code=404, detail="User not found")
+    return crud.get_user_stats(shards.for_owner(user_id) if shards else db, user_id=user_id)
+
 @app.post("/users/{user_id}/items/", response_model=schemas.Item)
 def create_item_for_user(
-    user_id: int, item: schemas.ItemCreate, db: Session = Depends(get_db)
+    user_id: int,
+    item: schemas.ItemCreate,
+    idempotency_key: str | None = Header(default=None),
+    db: Session = Depends(get_db),
+    shards: ShardSessions | None = Depends(get_shards),
+):
+    item_db = shards.for_owner(user_id) if shards is not None else db
+    if idempotency_key is None:
+        if group_committer is not None and shards is None:
+            #Committed by the writer thread together with concurrent requests
+            return group_committer.submit(item, user_id)
+        return crud.create_user_item(db=item_db, item=item, user_id=user_id)
+    db_item = crud.create_or_get_user_item(
+        db=item_db, item=item, user_id=user_id, idempotency_key=idempotency_key
+    )
+    cache.invalidate_user(user_id)
+    return db_item
+
+@app.post("/users/{user_id}/items/bulk", response_model=schemas.BulkResult)
+def create_items_for_user_bulk(
+    user_id: int,
+    items: list[schemas.ItemCreate],
+    db: Session = Depends(get_db),
+    shards: ShardSessions | None = Depends(get_shards),
+):
+    #Not cache.get_user: the write below invalidates it, so each batch would reload every item
+    if not crud.user_exists(db, user_id=user_id):
+        raise HTTPException(status_code=404, detail="User not found")
+    item_db = shards.for_owner(user_id) if shards is not None else db
+    result = crud.create_user_items_bulk(db=item_db, items=items, user_id=user_id)
+    cache.invalidate_user(user_id)
+    return result
+
+@app.get("/items/export")
+def export_items(
+    format: str = "ndjson",
+    db: Session = Depends(get_db),
+    shards: ShardSessions | None = Depends(get_shards),
 ):
-    return crud.create_user_item(db=db, item=item, user_id=user_id)
+    rows = crud.stream_items(db) if shards is None else crud.stream_items_across(shards.all())
+    return export.export_response(rows, crud.ITEM_EXPORT_COLUMNS, format, "items")
+
+@app.get("/items/search", response_model=list[schemas.Item])
+def search_items(
+    request: Request,
+    response: Response,
+    q: str,
+    limit: int = 100,
+    cursor: str | None = None,
+    db: Session = Depends(get_db),
+    shards: ShardSessions | None = Depends(get_shards),
+):
+    if not q.split():
+        raise HTTPException(status_code=400, detail="Empty search query")
+    after = decode_cursor(cursor, "score", size=2) if cursor is not None else None
+    validators = conditional.validators(*crud.get_items_version(shards.all() if shards is not None else [db]))
+    if conditional.is_not_modified(request, validators):
+        return conditional.not_modified(validators)
+    response.headers.update(validators)
+    if shards is not None:
+        items = crud.search_items_across(shards.all(), q=q, after=after, limit=limit)
+    else:
+        items = crud.search_items(db, q=q, after=after, limit=limit)
+    if items and len(items) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor("score", [items[-1].score, items[-1].id])
+    return items
 
 @app.get("/items/", response_model=list[schemas.Item])
-def read_items(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    items = crud.get_items(db, skip=skip, limit=limit)
+def read_items(
+    request: Request,
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: str | None = None,
+    order_by: str = "id",
+    fast: bool = False,
+    fields: str | None = None,
+    db: Session = Depends(get_db),
+    shards: ShardSessions | None = Depends(get_shards),
+):
+    if order_by not in crud.ITEM_ORDERINGS:
+        raise HTTPException(status_code=400, detail="Invalid order_by")
+    only = parse_fields(fields, schemas.Item)
+    #Pollers of an unchanged list get a 304 from one version lookup per database
+    validators = conditional.validators(*crud.get_items_version(shards.all() if shards is not None else [db]))
+    if conditional.is_not_modified(request, validators):
+        return conditional.not_modified(validators)
+    response.headers.update(validators)
+    if shards is not None:
+        #Every shard is read and the results merged in order_by order
+        after = decode_cursor(cursor, order_by, size=2 if order_by == "title" else 1) if cursor else None
+        items = crud.get_items_across(
+            shards.all(), skip=skip if order_by == "id" and after is None else 0, limit=limit, after=after,
+            order_by=order_by, fields=only,
+        )
+    elif cursor is not None:
+        after = decode_cursor(cursor, order_by, size=2 if order_by == "title" else 1)
+        items = crud.get_items_after(db, after=after, limit=limit, order_by=order_by, fields=only)
+    elif order_by == "id":
+        items = crud.get_items(db, skip=skip, limit=limit, fields=only)
+    else:
+        #title ordering is keyset-only, skip does not apply
+        items = crud.get_items_after(db, limit=limit, order_by=order_by, fields=only)
+    if items and len(items) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(
+            order_by, crud.item_sort_key(items[-1], order_by)
+        )
+    if fast or only is not None:
+        return fast_json.response(items, schemas.Item, headers=response.headers, only=only)
     return items
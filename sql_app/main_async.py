@@ -0,0 +1,96 @@
+#Async FastAPI app, same path operations as main.py on the event loop
+##Run with: uvicorn sql_app.main_async:app
+import logging
+
+from fastapi import Depends, FastAPI, HTTPException, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import conditional, crud, crud_async, models, schemas, search
+from .database import ENGINE_PROFILE, ENGINE_PROFILE_NAME, AsyncSessionLocal, async_engine, upgrade_schema
+from .pagination import decode_cursor, encode_cursor
+
+app = FastAPI()
+
+logger = logging.getLogger(__name__)
+
+#Create the database tables, and bring an existing database up to date as main does
+@app.on_event("startup")
+async def create_tables():
+	logger.info("SQLite engine profile %s: %s", ENGINE_PROFILE_NAME, ENGINE_PROFILE.describe())
+	async with async_engine.begin() as conn:
+		await conn.run_sync(models.Base.metadata.create_all)
+		await conn.run_sync(upgrade_schema)
+		await conn.run_sync(search.create_search_index)
+
+# Dependency
+async def get_db():
+	async with AsyncSessionLocal() as db:
+		yield db
+
+#Create your FastAPI path operations
+@app.post("/users/", response_model=schemas.User)
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
+	db_user = await crud_async.create_user(db=db, user=user)
+	if db_user is None:
+		raise HTTPException(status_code=400, detail="Email already registered")
+	return db_user
+
+@app.get("/users/", response_model=list[schemas.User])
+async def read_users(
+	response: Response,
+	skip: int = 0,
+	limit: int = 100,
+	cursor: str | None = None,
+	db: AsyncSession = Depends(get_db),
+):
+	if cursor is not None:
+		(after_id,) = decode_cursor(cursor, "id")
+		users = await crud_async.get_users_after(db, after_id=after_id, limit=limit)
+	else:
+		users = await crud_async.get_users(db, skip=skip, limit=limit)
+	if users and len(users) == limit:
+		response.headers["X-Next-Cursor"] = encode_cursor("id", [users[-1].id])
+	return users
+
+@app.get("/users/{user_id}", response_model=schemas.User)
+async def read_user(user_id: int, db: AsyncSession = Depends(get_db)):
+	db_user = await crud_async.get_user(db, user_id=user_id)
+	if db_user is None:
+		raise HTTPException(status_code=404, detail="User not found")
+	return db_user
+
+@app.post("/users/{user_id}/items/", response_model=schemas.Item)
+async def create_item_for_user(
+	user_id: int, item: schemas.ItemCreate, db: AsyncSession = Depends(get_db)
+):
+	return await crud_async.create_user_item(db=db, item=item, user_id=user_id)
+
+@app.get("/items/", response_model=list[schemas.Item])
+async def read_items(
+	request: Request,
+	response: Response,
+	skip: int = 0,
+	limit: int = 100,
+	cursor: str | None = None,
+	order_by: str = "id",
+	db: AsyncSession = Depends(get_db),
+):
+	if order_by not in crud.ITEM_ORDERINGS:
+		raise HTTPException(status_code=400, detail="Invalid order_by")
+	validators = conditional.validators(*await crud_async.get_items_version(db))
+	if conditional.is_not_modified(request, validators):
+		return conditional.not_modified(validators)
+	response.headers.update(validators)
+	if cursor is not None:
+		after = decode_cursor(cursor, order_by, size=2 if order_by == "title" else 1)
+		items = await crud_async.get_items_after(db, after=after, limit=limit, order_by=order_by)
+	elif order_by == "id":
+		items = await crud_async.get_items(db, skip=skip, limit=limit)
+	else:
+		#title ordering is keyset-only, skip does not apply
+		items = await crud_async.get_items_after(db, limit=limit, order_by=order_by)
+	if items and len(items) == limit:
+		response.headers["X-Next-Cursor"] = encode_cursor(
+			order_by, crud.item_sort_key(items[-1], order_by)
+		)
+	return items
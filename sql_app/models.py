@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String
+from sqlalchemy import Boolean, Column, Float, ForeignKey, Index, Integer, String
 from sqlalchemy.orm import relationship
 
 from .database import Base
@@ -15,7 +15,7 @@ class User(Base):
 	is_active = Column(Boolean, default=True)
 
 	#Create the relationships
-	items = relationship("Item", back_populates="owners")
+	items = relationship("Item", back_populates="owner")
 
 class Item(Base):
 	"""docstring for Item"""
@@ -26,6 +26,45 @@ class Item(Base):
 	title = Column(String, index=True)
 	description = Column(String, index=True)
 	owner_id = Column(Integer, ForeignKey("users.id"))
+	#Client supplied key for create-or-get, NULL for ordinary inserts
+	idempotency_key = Column(String, nullable=True)
 
 	#Create the relationships
 	owner = relationship("User", back_populates="items")
+
+	#Per-owner lookups (User.items loading) and per-owner keyset paging seek on this
+	__table_args__ = (
+		Index("ix_items_owner_id_id", "owner_id", "id"),
+		#SQLite treats NULLs as distinct, so only keyed inserts can conflict
+		Index("ix_items_owner_id_idempotency_key", "owner_id", "idempotency_key", unique=True),
+	)
+
+class UserStats(Base):
+	"""docstring for UserStats"""
+	__tablename__ = "user_stats"
+
+	#Maintained by the triggers in stats.py, one row per owner
+	user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+	item_count = Column(Integer, nullable=False, default=0)
+
+class IdSequence(Base):
+	"""docstring for IdSequence"""
+	__tablename__ = "id_sequences"
+
+	#Next unreserved id per table, item ids come from here when items are sharded
+	name = Column(String, primary_key=True)
+	next_id = Column(Integer, nullable=False)
+
+class TableVersion(Base):
+	"""docstring for TableVersion"""
+	__tablename__ = "table_versions"
+
+	#Bumped by the triggers in versions.py on every write to the named table
+	name = Column(String, primary_key=True)
+	version = Column(Integer, nullable=False, default=0)
+	#Unix time of the last write
+	modified_at = Column(Float, nullable=False)
+
+#Imported for their side effects: they register the stats and versions triggers on
+##Base.metadata, so every create_all with these models also creates the triggers
+from . import stats, versions
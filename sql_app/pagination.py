@@ -0,0 +1,24 @@
+#Keyset (cursor) pagination helpers
+##A cursor is an opaque, url-safe token holding the sort key of the last row sent
+import base64
+import json
+
+from fastapi import HTTPException
+
+def encode_cursor(order_by: str, values: list) -> str:
+	payload = json.dumps({"o": order_by, "k": values}, separators=(",", ":"))
+	return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, order_by: str, size: int = 1) -> list:
+	try:
+		padded = cursor + "=" * (-len(cursor) % 4)
+		payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+		key = payload["k"]
+	except (ValueError, KeyError, TypeError):
+		raise HTTPException(status_code=400, detail="Invalid cursor")
+	if payload.get("o") != order_by or not isinstance(key, list) or len(key) != size:
+		raise HTTPException(status_code=400, detail="Cursor does not match order_by")
+	#Only scalars are compared against the sort columns
+	if not all(isinstance(value, (int, float, str)) for value in key):
+		raise HTTPException(status_code=400, detail="Invalid cursor")
+	return key
@@ -0,0 +1,62 @@
+#Count the SQL statements an engine runs, e.g. to catch N+1 queries in tests
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.default import CACHE_HIT, CACHE_MISS
+
+class QueryCounter:
+	"""Collects every statement executed on an engine while active"""
+
+	def __init__(self):
+		self.statements = []
+
+	@property
+	def count(self) -> int:
+		return len(self.statements)
+
+	def __call__(self, conn, cursor, statement, parameters, context, executemany):
+		self.statements.append(statement)
+
+@contextmanager
+def count_queries(engine: Engine):
+	counter = QueryCounter()
+	event.listen(engine, "before_cursor_execute", counter)
+	try:
+		yield counter
+	finally:
+		event.remove(engine, "before_cursor_execute", counter)
+
+@contextmanager
+def assert_max_queries(engine: Engine, expected: int):
+	with count_queries(engine) as counter:
+		yield counter
+	assert counter.count <= expected, (
+		f"expected at most {expected} queries, got {counter.count}:\n"
+		+ "\n".join(counter.statements)
+	)
+
+#Compiled statement cache hit rate
+class CompiledCacheStats:
+	"""Counts executions that reused a compiled statement from the engine's cache"""
+
+	def __init__(self, engine: Engine):
+		self.hits = self.misses = self.uncached = 0
+		event.listen(engine, "after_cursor_execute", self)
+
+	def __call__(self, conn, cursor, statement, parameters, context, executemany):
+		if context.cache_hit is CACHE_HIT:
+			self.hits += 1
+		elif context.cache_hit is CACHE_MISS:
+			self.misses += 1
+		else:
+			self.uncached += 1
+
+	def stats(self) -> dict:
+		cached = self.hits + self.misses
+		return {
+			"hits": self.hits,
+			"misses": self.misses,
+			"uncached": self.uncached,
+			"hit_rate": self.hits / cached if cached else 0.0,
+		}
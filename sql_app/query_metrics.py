@@ -0,0 +1,114 @@
+#Per-crud-function query latency, from engine events
+##Every statement is timed, one perf_counter call each, so every statement slower than the
+##threshold is counted and kept with its SQL. Only a sample_rate share, picked when the
+##statement starts, is recorded in the histograms, labelled with the crud function that ran it
+##and the route that called it. The start time lives on the statement's execution context, so
+##a statement that raises leaves nothing behind on the connection.
+import contextvars
+import logging
+import random
+import sys
+import time
+from collections import deque
+
+from fastapi import Request
+from sqlalchemy import event
+
+from metrics.prometheus import Counter, Histogram, Registry
+
+logger = logging.getLogger(__name__)
+
+#Route template of the request being handled, set by the track_route dependency
+current_route = contextvars.ContextVar("current_route", default="")
+
+async def track_route(request: Request):
+	#async so the value is set in the request's own context, which sync endpoints run in a copy of
+	route = request.scope.get("route")
+	current_route.set(getattr(route, "path", request.url.path))
+
+CALLER_MODULES = ("sql_app.crud", "sql_app.crud_async")
+
+def calling_function() -> str:
+	#Nearest crud function on the stack; only looked up for sampled and slow statements
+	frame = sys._getframe(1)
+	while frame is not None:
+		if frame.f_globals.get("__name__") in CALLER_MODULES:
+			return frame.f_code.co_name
+		frame = frame.f_back
+	return ""
+
+class QueryMetrics:
+	"""Statement latency, written rows, slow statements and connection hold time per engine"""
+
+	def __init__(
+		self, registry: Registry, sample_rate: float = 0.01, slow_seconds: float = 0.1, slow_log_size: int = 100
+	):
+		self.sample_rate = sample_rate
+		self.slow_seconds = slow_seconds
+		labels = ("function", "route")
+		self.duration = registry.register(Histogram(
+			"sql_app_query_duration_seconds", "Sampled SQL statement execution time", labels
+		))
+		self.rows = registry.register(Counter(
+			"sql_app_query_rows_total", "Sampled rows changed, as reported by the driver", labels
+		))
+		self.slow = registry.register(Counter(
+			"sql_app_slow_queries_total", "Statements slower than the slow query threshold", labels
+		))
+		self.held = registry.register(Histogram(
+			"sql_app_pool_connection_held_seconds", "Sampled time from pool checkout to checkin", ("route",)
+		))
+		self.slow_queries = deque(maxlen=slow_log_size)
+		self._listeners = (
+			("before_cursor_execute", self.before_cursor_execute),
+			("after_cursor_execute", self.after_cursor_execute),
+			("checkout", self.on_checkout),
+			("checkin", self.on_checkin),
+		)
+
+	def attach(self, engine):
+		for name, listener in self._listeners:
+			event.listen(engine, name, listener)
+
+	def detach(self, engine):
+		for name, listener in self._listeners:
+			event.remove(engine, name, listener)
+
+	def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+		#Statements run outside an execution context, e.g. by the dialect on connect, are skipped
+		if context is not None:
+			context.query_metrics_sampled = random.random() < self.sample_rate
+			context.query_metrics_start = time.perf_counter()
+
+	def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+		start = getattr(context, "query_metrics_start", None)
+		if start is None:
+			return
+		elapsed = time.perf_counter() - start
+		slow = elapsed >= self.slow_seconds
+		if not (slow or context.query_metrics_sampled):
+			return
+		labels = (calling_function(), current_route.get())
+		if context.query_metrics_sampled:
+			self.duration.observe(elapsed, *labels)
+			#sqlite3 knows the rowcount of UPDATE, DELETE and plain INSERT here; SELECT and
+			##RETURNING rows are only counted once fetched, after this event
+			if cursor.rowcount > 0:
+				self.rows.inc(*labels, amount=cursor.rowcount)
+		if slow:
+			self.slow.inc(*labels)
+			self.slow_queries.append({
+				"function": labels[0], "route": labels[1], "seconds": elapsed, "statement": statement,
+			})
+			logger.warning("Slow query in %s (%s) took %.3fs: %s", labels[0] or "?", labels[1] or "?", elapsed, statement)
+
+	def on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+		if random.random() < self.sample_rate:
+			connection_record.info["checked_out"] = (time.perf_counter(), current_route.get())
+
+	def on_checkin(self, dbapi_connection, connection_record):
+		#Checkin can run after the response in another context, so the route comes from checkout
+		checked_out = connection_record.info.pop("checked_out", None) if connection_record else None
+		if checked_out is not None:
+			started, route = checked_out
+			self.held.observe(time.perf_counter() - started, route)
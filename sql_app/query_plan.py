@@ -0,0 +1,199 @@
+#Query-plan inspector and index advisor for crud.py
+##Runs every crud read against a scratch database, EXPLAINs each statement and flags scans
+##Run with: python -m sql_app.query_plan [--apply]
+import re
+import sys
+from dataclasses import dataclass, field
+
+from sqlalchemy import create_engine, event, insert, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from . import crud, models
+from .database import Base, upgrade_schema
+
+#Every crud read, called the way the path operations call it
+WORKLOAD = {
+	"get_user": lambda db: crud.get_user(db, user_id=1),
+	"get_user[joined]": lambda db: crud.get_user(db, user_id=1, load="joined"),
+	"user_exists": lambda db: crud.user_exists(db, user_id=1),
+	"get_user_by_email": lambda db: crud.get_user_by_email(db, email="user1@example.com"),
+	"get_users": lambda db: crud.get_users(db, skip=10, limit=10),
+	"get_users[selectin]": lambda db: crud.get_users(db, limit=10, load="selectin"),
+	"get_users_after": lambda db: crud.get_users_after(db, after_id=10, limit=10),
+	"get_items": lambda db: crud.get_items(db, skip=10, limit=10),
+	"get_items_after": lambda db: crud.get_items_after(db, after=[10], limit=10),
+	"get_items_after[title]": lambda db: crud.get_items_after(db, after=["item 1", 1], limit=10, order_by="title"),
+	"search_items": lambda db: crud.search_items(db, q="item", after=[0.0, 1], limit=10),
+	"get_items_for_owners": lambda db: crud.get_items_for_owners(db, owner_ids=[1, 2, 3]),
+	"get_items_version": lambda db: crud.get_items_version([db]),
+	"get_user_stats": lambda db: crud.get_user_stats(db, user_id=1),
+	"get_users_stats": lambda db: crud.get_users_stats(db, skip=10, limit=10),
+	"get_users_stats[ids]": lambda db: crud.get_users_stats(db, user_ids=[1, 2, 3]),
+	"stream_items": lambda db: list(crud.stream_items(db)),
+	"stream_users": lambda db: list(crud.stream_users(db)),
+}
+
+#Full scans that are the point of the query: offset paging and whole-table exports
+EXPECTED_SCANS = {
+	"get_users": {"users"},
+	"get_users[selectin]": {"users"},
+	"get_items": {"items"},
+	"get_users_stats": {"user_stats"},
+	"stream_items": {"items"},
+	"stream_users": {"users"},
+}
+
+#SQLite plan details, e.g. "SCAN items", "SCAN items_1 LEFT-JOIN", "SCAN items USING INDEX ix_items_title"
+SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)(?: LEFT-JOIN)?$")
+INDEX_WALK = re.compile(r"^SCAN (?:TABLE )?(\w+) USING (?:COVERING )?INDEX \w+(?: LEFT-JOIN)?$")
+AUTOMATIC_INDEX = re.compile(r"^(?:SEARCH|SCAN) (?:TABLE )?(\w+) USING AUTOMATIC (?:COVERING )?INDEX")
+
+TABLE_ALIAS = re.compile(r"(?:FROM|JOIN) (\w+)(?: AS (\w+))?")
+FILTER_COLUMN = re.compile(r"(\w+)\.(\w+) (=|IN|>|<|>=|<=) ")
+JOIN_COLUMN = re.compile(r"= (\w+)\.(\w+)")
+ROW_VALUE = re.compile(r"\(((?:\w+\.\w+, )+\w+\.\w+)\) (?:>|<|>=|<=) ")
+
+@dataclass
+class Finding:
+	function: str
+	table: str
+	problem: str
+	statement: str
+	plan: list[str]
+	suggestion: str | None = None
+
+@dataclass
+class Report:
+	plans: dict = field(default_factory=dict)
+	findings: list[Finding] = field(default_factory=list)
+
+	def format(self) -> str:
+		lines = []
+		for function, statements in self.plans.items():
+			lines.append(function)
+			for statement, plan in statements:
+				lines.append("    " + " ".join(statement.split()))
+				lines.extend("      -> " + detail for detail in plan)
+		for finding in self.findings:
+			lines.append(f"FLAG {finding.function}: {finding.problem} on {finding.table}")
+			if finding.suggestion:
+				lines.append(f"     suggest: {finding.suggestion}")
+		return "\n".join(lines)
+
+def _aliases(statement: str) -> dict:
+	aliases = {}
+	for table, alias in TABLE_ALIAS.findall(statement):
+		aliases[alias or table] = table
+	return aliases
+
+def filter_columns(table: str, statement: str) -> tuple[list, list]:
+	#Equality columns first, then range columns, which is the order SQLite can use them in
+	aliases = _aliases(statement)
+	equality, ranges = [], []
+
+	def add(target, alias, column):
+		if aliases.get(alias, alias) == table and column not in equality + ranges:
+			target.append(column)
+
+	for alias, column, operator in FILTER_COLUMN.findall(statement):
+		add(equality if operator in ("=", "IN") else ranges, alias, column)
+	for alias, column in JOIN_COLUMN.findall(statement):
+		add(equality, alias, column)
+	for columns in ROW_VALUE.findall(statement):
+		for qualified in columns.split(", "):
+			add(ranges, *qualified.split("."))
+	return equality, ranges
+
+def suggest_index(table: str, statement: str) -> str | None:
+	equality, ranges = filter_columns(table, statement)
+	columns = equality + ranges
+	if not columns:
+		return None
+	return f"CREATE INDEX IF NOT EXISTS ix_{table}_{'_'.join(columns)} ON {table} ({', '.join(columns)})"
+
+def classify(detail: str, statement: str) -> tuple[str, str] | None:
+	#Returns (table, problem) for a plan line that reads more of a table than it needs
+	for pattern, problem in (
+		(AUTOMATIC_INDEX, "automatic index"),
+		(SCAN, "full table scan"),
+		(INDEX_WALK, "index walked without a seek"),
+	):
+		match = pattern.match(detail)
+		if match is None:
+			continue
+		table = _aliases(statement).get(match.group(1), match.group(1))
+		if table not in Base.metadata.tables:
+			return None
+		if pattern is INDEX_WALK and filter_columns(table, statement) == ([], []):
+			#An ordered walk with LIMIT and no filter, e.g. the first keyset page
+			return None
+		return table, problem
+	return None
+
+def _seed(engine):
+	Base.metadata.create_all(bind=engine)
+	with engine.begin() as conn:
+		conn.execute(insert(models.User), [
+			{"email": f"user{i}@example.com", "hashed_password": "x"} for i in range(1, 51)
+		])
+		conn.execute(insert(models.Item), [
+			{"title": f"item {i}", "owner_id": i % 50 + 1} for i in range(500)
+		])
+
+def inspect_queries(engine=None, workload: dict = WORKLOAD) -> Report:
+	if engine is None:
+		engine = create_engine("sqlite://", poolclass=StaticPool)
+		_seed(engine)
+	SessionLocal = sessionmaker(bind=engine)
+	report = Report()
+	for function, call in workload.items():
+		captured = []
+
+		def capture(conn, cursor, statement, parameters, context, executemany):
+			if statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+				captured.append((statement, parameters))
+
+		event.listen(engine, "before_cursor_execute", capture)
+		try:
+			with SessionLocal() as db:
+				call(db)
+		finally:
+			event.remove(engine, "before_cursor_execute", capture)
+
+		report.plans[function] = []
+		with engine.connect() as conn:
+			for statement, parameters in captured:
+				rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)
+				plan = [row[-1] for row in rows]
+				report.plans[function].append((statement, plan))
+				for detail in plan:
+					flagged = classify(detail, statement)
+					if flagged is None:
+						continue
+					table, problem = flagged
+					if problem == "full table scan" and table in EXPECTED_SCANS.get(function, ()):
+						continue
+					report.findings.append(Finding(
+						function, table, problem, statement, plan, suggest_index(table, statement)
+					))
+	return report
+
+def apply_suggestions(engine, report: Report) -> list[str]:
+	applied = []
+	upgrade_schema(engine)
+	with engine.begin() as conn:
+		for suggestion in dict.fromkeys(f.suggestion for f in report.findings if f.suggestion):
+			conn.execute(text(suggestion))
+			applied.append(suggestion)
+	return applied
+
+if __name__ == "__main__":
+	from .database import engine as app_engine
+
+	report = inspect_queries()
+	print(report.format())
+	if "--apply" in sys.argv:
+		for statement in apply_suggestions(app_engine, report):
+			print(f"applied: {statement}")
+	sys.exit(1 if report.findings else 0)
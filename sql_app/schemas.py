@@ -9,19 +9,23 @@ class ItemBase(BaseModel):
 
 class ItemCreate(ItemBase):
 	"""docstring for ItemCreate"""
+	pass
+
+class Item(ItemBase):
+	"""docstring for Item"""
 	id: int
 	owner_id: int
 
 	class Config:
 		"""docstring for Config"""
-		orm_mode = True
+		from_attributes = True
 
 class UserBase(BaseModel):
 	"""docstring for UserBase"""
 	email: str
 
-class userCreate(UserBase):
-	"""docstring for userCreate"""
+class UserCreate(UserBase):
+	"""docstring for UserCreate"""
 	password: str
 
 class User(UserBase):
@@ -30,6 +34,32 @@ class User(UserBase):
 	is_active: bool
 	items: list[Item] = []
 
-	class config:
-		"""docstring for config"""
-		orm_mode = True
+	class Config:
+		"""docstring for Config"""
+		from_attributes = True
+
+class BulkError(BaseModel):
+	"""docstring for BulkError"""
+	index: int
+	detail: str
+
+class BulkResult(BaseModel):
+	"""docstring for BulkResult"""
+	#ids[i] is the new id of row i, or None when errors has an entry for it
+	ids: list[int | None]
+	errors: list[BulkError] = []
+
+class UserStats(BaseModel):
+	"""docstring for UserStats"""
+	user_id: int
+	item_count: int
+
+	class Config:
+		"""docstring for Config"""
+		from_attributes = True
+
+class StatsDrift(BaseModel):
+	"""docstring for StatsDrift"""
+	user_id: int
+	stored: int
+	actual: int
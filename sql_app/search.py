@@ -0,0 +1,52 @@
+#Full-text search over items with SQLite FTS5
+##items_fts is an external-content index over items, kept in sync by triggers
+from sqlalchemy import DDL, event, inspect, text
+
+from . import models
+from .database import begin
+
+FTS_DDL = (
+	"CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5("
+	"title, description, content='items', content_rowid='id')",
+	"CREATE TRIGGER IF NOT EXISTS items_fts_insert AFTER INSERT ON items BEGIN "
+	"INSERT INTO items_fts(rowid, title, description) VALUES (new.id, new.title, new.description); "
+	"END",
+	"CREATE TRIGGER IF NOT EXISTS items_fts_delete AFTER DELETE ON items BEGIN "
+	"INSERT INTO items_fts(items_fts, rowid, title, description) "
+	"VALUES ('delete', old.id, old.title, old.description); "
+	"END",
+	"CREATE TRIGGER IF NOT EXISTS items_fts_update AFTER UPDATE OF title, description ON items BEGIN "
+	"INSERT INTO items_fts(items_fts, rowid, title, description) "
+	"VALUES ('delete', old.id, old.title, old.description); "
+	"INSERT INTO items_fts(rowid, title, description) VALUES (new.id, new.title, new.description); "
+	"END",
+)
+
+#Created together with the items table by Base.metadata.create_all
+for statement in FTS_DDL:
+	event.listen(models.Item.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+
+def create_search_index(bind):
+	#For databases whose items table predates the index: create it and backfill it
+	with begin(bind) as conn:
+		if conn.dialect.name != "sqlite" or inspect(conn).has_table("items_fts"):
+			return
+		for statement in FTS_DDL:
+			conn.execute(text(statement))
+		conn.execute(text("INSERT INTO items_fts(items_fts) VALUES ('rebuild')"))
+
+#Title matches count ten times as much as description matches
+BM25_WEIGHTS = "10.0, 1.0"
+
+def match_expression(q: str) -> str:
+	#Quote every word so user input is never parsed as FTS5 query syntax; words are ANDed
+	return " ".join('"' + word.replace('"', '""') + '"' for word in q.split())
+
+SEARCH_SQL = f"""
+SELECT id, title, description, owner_id, score FROM (
+	SELECT items.id, items.title, items.description, items.owner_id,
+		bm25(items_fts, {BM25_WEIGHTS}) AS score
+	FROM items_fts JOIN items ON items.id = items_fts.rowid
+	WHERE items_fts MATCH :match
+)
+"""
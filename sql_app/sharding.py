@@ -0,0 +1,192 @@
+#Owner-sharded item storage
+##Items and their per-owner counters live in N SQLite files, each with its own write lock.
+##A consistent hash ring places every owner on one shard, so adding a shard only moves
+##about 1/N of the owners. Users stay in the primary database.
+##Item ids are reserved in blocks from the primary, so they stay unique across shards
+##and an owner keeps its ids when it moves.
+##Move owners to the shard the ring places them on with:
+##python -m sql_app.sharding [--from-primary] [--dry-run]
+import bisect
+import hashlib
+import sys
+import threading
+
+from sqlalchemy import delete, func, inspect, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session, sessionmaker
+
+from . import models, search
+from .database import Base, upgrade_schema
+
+SHARD_TABLES = (models.Item.__table__, models.UserStats.__table__, models.TableVersion.__table__)
+
+def _hash(key: str) -> int:
+	return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+class HashRing:
+	"""Consistent hashing of owner ids onto shard names, vnodes points per shard"""
+
+	def __init__(self, names, vnodes: int = 64):
+		self.names = tuple(names)
+		points = sorted((_hash(f"{name}#{i}"), name) for name in self.names for i in range(vnodes))
+		self._keys = [key for key, _ in points]
+		self._names = [name for _, name in points]
+
+	def shard_for(self, owner_id: int) -> str:
+		index = bisect.bisect(self._keys, _hash(str(owner_id))) % len(self._keys)
+		return self._names[index]
+
+class ItemIdAllocator:
+	"""Hands out item ids from blocks reserved in the primary's id_sequences table (hi/lo)"""
+
+	def __init__(self, engine, block_size: int = 100):
+		self.engine = engine
+		self.block_size = block_size
+		self._lock = threading.Lock()
+		self._next = self._end = 0
+
+	def allocate(self, count: int) -> list[int]:
+		ids = []
+		with self._lock:
+			while len(ids) < count:
+				if self._next == self._end:
+					self._reserve(max(self.block_size, count - len(ids)))
+				take = min(count - len(ids), self._end - self._next)
+				ids.extend(range(self._next, self._next + take))
+				self._next += take
+		return ids
+
+	def _reserve(self, size: int):
+		sequence = models.IdSequence
+		with self.engine.begin() as conn:
+			end = conn.execute(
+				update(sequence).where(sequence.name == "items")
+				.values(next_id=sequence.next_id + size).returning(sequence.next_id)
+			).scalar_one()
+		self._next, self._end = end - size, end
+
+class ShardSet:
+	"""The item shards: engines, a session factory each, and the ring placing owners on them"""
+
+	def __init__(self, engines: dict, primary_engine, block_size: int = 100, vnodes: int = 64):
+		self.engines = engines
+		self.primary_engine = primary_engine
+		self.ring = HashRing(engines, vnodes)
+		self.item_ids = ItemIdAllocator(primary_engine, block_size)
+		#crud reads the allocator from session.info and gives every new item an id from it
+		self.sessionmakers = {
+			name: sessionmaker(autocommit=False, autoflush=False, bind=engine, info={"item_ids": self.item_ids})
+			for name, engine in engines.items()
+		}
+		Base.metadata.create_all(bind=primary_engine, tables=[models.IdSequence.__table__])
+		for engine in engines.values():
+			Base.metadata.create_all(bind=engine, tables=SHARD_TABLES)
+			upgrade_schema(engine)
+			search.create_search_index(engine)
+		self._start_sequence()
+
+	def _start_sequence(self):
+		#Start past every id already stored anywhere, e.g. items from before sharding
+		highest = 0
+		for engine in (self.primary_engine, *self.engines.values()):
+			with engine.connect() as conn:
+				if not inspect(conn).has_table("items"):
+					continue
+				highest = max(highest, conn.scalar(select(func.max(models.Item.id))) or 0)
+		statement = sqlite_insert(models.IdSequence).values(name="items", next_id=highest + 1)
+		statement = statement.on_conflict_do_update(
+			index_elements=[models.IdSequence.name],
+			set_={"next_id": func.max(models.IdSequence.next_id, statement.excluded.next_id)},
+		)
+		with self.primary_engine.begin() as conn:
+			conn.execute(statement)
+
+	def shard_for(self, owner_id: int) -> str:
+		return self.ring.shard_for(owner_id)
+
+	def dispose(self):
+		for engine in self.engines.values():
+			engine.dispose()
+
+class ShardSessions:
+	"""One request's shard sessions, each opened on first use"""
+
+	def __init__(self, shard_set: ShardSet):
+		self.shard_set = shard_set
+		self._sessions = {}
+
+	def _session(self, name: str) -> Session:
+		if name not in self._sessions:
+			self._sessions[name] = self.shard_set.sessionmakers[name]()
+		return self._sessions[name]
+
+	def for_owner(self, owner_id: int) -> Session:
+		return self._session(self.shard_set.shard_for(owner_id))
+
+	def by_owner(self, owner_ids) -> list[tuple[Session, list[int]]]:
+		groups = {}
+		for owner_id in owner_ids:
+			groups.setdefault(self.shard_set.shard_for(owner_id), []).append(owner_id)
+		return [(self._session(name), ids) for name, ids in groups.items()]
+
+	def all(self) -> list[Session]:
+		return [self._session(name) for name in self.shard_set.engines]
+
+	def close(self):
+		for session in self._sessions.values():
+			session.close()
+		self._sessions.clear()
+
+#Rebalancing
+##Copy first, delete second: a run that stops halfway leaves the owner's rows on both shards,
+##and running again skips the rows already copied and finishes the move
+def misplaced_owners(shard_set: ShardSet, from_primary: bool = False) -> list[tuple[int, str, str]]:
+	sources = dict(shard_set.engines)
+	if from_primary:
+		sources["primary"] = shard_set.primary_engine
+	moves = []
+	for name, engine in sources.items():
+		with engine.connect() as conn:
+			if not inspect(conn).has_table("items"):
+				continue
+			owners = conn.scalars(select(models.Item.owner_id).distinct().order_by(models.Item.owner_id))
+			for owner_id in owners:
+				target = shard_set.shard_for(owner_id) if owner_id is not None else name
+				if target != name:
+					moves.append((owner_id, name, target))
+	return moves
+
+def move_owner(source, target, owner_id: int, batch_size: int = 1000) -> int:
+	items = models.Item.__table__
+	moved = 0
+	with source.connect() as src, target.begin() as dst:
+		rows = src.execute(
+			select(items).where(items.c.owner_id == owner_id).execution_options(yield_per=batch_size)
+		).mappings()
+		for partition in rows.partitions():
+			#The insert triggers count the copied rows into the target's user_stats
+			dst.execute(sqlite_insert(items).on_conflict_do_nothing(), [dict(row) for row in partition])
+			moved += len(partition)
+	with source.begin() as conn:
+		conn.execute(delete(items).where(items.c.owner_id == owner_id))
+		conn.execute(delete(models.UserStats.__table__).where(models.UserStats.user_id == owner_id))
+	return moved
+
+def rebalance(shard_set: ShardSet, from_primary: bool = False, dry_run: bool = False) -> list[tuple[int, str, str, int]]:
+	engines = {**shard_set.engines, "primary": shard_set.primary_engine}
+	report = []
+	for owner_id, source, target in misplaced_owners(shard_set, from_primary):
+		moved = 0 if dry_run else move_owner(engines[source], engines[target], owner_id)
+		report.append((owner_id, source, target, moved))
+	return report
+
+if __name__ == "__main__":
+	from .database import engine, shard_engines
+
+	if not shard_engines:
+		sys.exit("SQL_APP_ITEM_SHARDS is not set")
+	shard_set = ShardSet(shard_engines, engine)
+	report = rebalance(shard_set, from_primary="--from-primary" in sys.argv, dry_run="--dry-run" in sys.argv)
+	for owner_id, source, target, moved in report:
+		print(f"owner {owner_id}: {source} -> {target} ({moved} items)")
+	print(f"{len(report)} owners misplaced")
@@ -0,0 +1,90 @@
+#Per-owner item counters
+##user_stats is kept up to date by triggers on items, so every write path counts, bulk inserts included
+##Reconcile with: python -m sql_app.stats [--dry-run]
+import sys
+
+from sqlalchemy import event, text
+
+from . import schemas
+from .database import Base
+
+TRIGGERS = (
+	"CREATE TRIGGER IF NOT EXISTS items_stats_insert AFTER INSERT ON items "
+	"WHEN new.owner_id IS NOT NULL BEGIN "
+	"INSERT INTO user_stats(user_id, item_count) VALUES (new.owner_id, 1) "
+	"ON CONFLICT(user_id) DO UPDATE SET item_count = item_count + 1; "
+	"END",
+	"CREATE TRIGGER IF NOT EXISTS items_stats_delete AFTER DELETE ON items "
+	"WHEN old.owner_id IS NOT NULL BEGIN "
+	"UPDATE user_stats SET item_count = item_count - 1 WHERE user_id = old.owner_id; "
+	"END",
+	"CREATE TRIGGER IF NOT EXISTS items_stats_update AFTER UPDATE OF owner_id ON items "
+	"WHEN old.owner_id IS NOT new.owner_id BEGIN "
+	"UPDATE user_stats SET item_count = item_count - 1 WHERE user_id = old.owner_id; "
+	"INSERT INTO user_stats(user_id, item_count) SELECT new.owner_id, 1 WHERE new.owner_id IS NOT NULL "
+	"ON CONFLICT(user_id) DO UPDATE SET item_count = item_count + 1; "
+	"END",
+)
+
+BACKFILL = (
+	"INSERT INTO user_stats(user_id, item_count) "
+	"SELECT owner_id, COUNT(*) FROM items WHERE owner_id IS NOT NULL GROUP BY owner_id "
+	"ON CONFLICT(user_id) DO UPDATE SET item_count = excluded.item_count"
+)
+
+#Runs after create_all, once both items and user_stats exist
+@event.listens_for(Base.metadata, "after_create")
+def create_counter_triggers(target, connection, tables=(), **kw):
+	if connection.dialect.name != "sqlite":
+		return
+	for statement in TRIGGERS:
+		connection.execute(text(statement))
+	#A user_stats table added to an existing database starts from the current items
+	if any(table.name == "user_stats" for table in tables):
+		connection.execute(text(BACKFILL))
+
+#Reconciliation
+##Recounts owners in id ranges of batch_size, so one pass never holds a long read over items
+def reconcile(db, batch_size: int = 1000, fix: bool = True) -> list[schemas.StatsDrift]:
+	bounds = db.execute(text(
+		"SELECT MIN(id), MAX(id) FROM ("
+		"SELECT MIN(owner_id) AS id FROM items UNION ALL SELECT MAX(owner_id) FROM items "
+		"UNION ALL SELECT MIN(user_id) FROM user_stats UNION ALL SELECT MAX(user_id) FROM user_stats)"
+	)).one()
+	drift = []
+	if bounds[0] is None:
+		return drift
+	for low in range(bounds[0], bounds[1] + 1, batch_size):
+		params = {"low": low, "high": low + batch_size - 1}
+		actual = dict(db.execute(text(
+			"SELECT owner_id, COUNT(*) FROM items "
+			"WHERE owner_id BETWEEN :low AND :high GROUP BY owner_id"
+		), params).all())
+		stored = dict(db.execute(text(
+			"SELECT user_id, item_count FROM user_stats WHERE user_id BETWEEN :low AND :high"
+		), params).all())
+		batch = [
+			schemas.StatsDrift(user_id=user_id, stored=stored.get(user_id, 0), actual=actual.get(user_id, 0))
+			for user_id in sorted(actual.keys() | stored.keys())
+			if stored.get(user_id, 0) != actual.get(user_id, 0)
+		]
+		if fix and batch:
+			db.execute(text(
+				"INSERT INTO user_stats(user_id, item_count) VALUES (:user_id, :actual) "
+				"ON CONFLICT(user_id) DO UPDATE SET item_count = excluded.item_count"
+			), [row.dict() for row in batch])
+			db.commit()
+		drift.extend(batch)
+	return drift
+
+if __name__ == "__main__":
+	from sqlalchemy.orm import Session
+
+	from .database import engine
+
+	#The primary, a lagging replica would report drift that is not there
+	with Session(engine) as db:
+		drift = reconcile(db, fix="--dry-run" not in sys.argv)
+	for row in drift:
+		print(f"user {row.user_id}: stored {row.stored}, actual {row.actual}")
+	print(f"{len(drift)} owners drifted")
@@ -0,0 +1,944 @@
+#Testing file
+import asyncio
+import csv
+import io
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi import BackgroundTasks, Request
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event, func, insert, select, update
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from metrics.prometheus import Registry
+
+from . import cache, conditional, crud, main, main_async, models, schemas, stats
+from .cache import MISSING, LRUCache
+from .config import load_engine_profile
+from .database import Base, LazySession, PoolMetrics, RoutingSession, pool_metrics
+from .group_commit import GroupCommitter
+from .main import app, get_db
+from .pagination import encode_cursor
+from .query_count import CompiledCacheStats, assert_max_queries
+from .query_metrics import QueryMetrics
+from .query_plan import inspect_queries
+from .sharding import ShardSet, rebalance
+
+#Use a separate in-memory database for the tests
+engine = create_engine(
+    "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+Base.metadata.create_all(bind=engine)
+
+def override_get_db():
+    db = TestingSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+app.dependency_overrides[get_db] = override_get_db
+
+client = TestClient(app)
+
+def create_user(email):
+    response = client.post("/users/", json={"email": email, "password": "secret"})
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_create_user():
+    data = create_user("deadpool@example.com")
+    assert data["email"] == "deadpool@example.com"
+    assert data["items"] == []
+
+    response = client.get(f"/users/{data['id']}")
+    assert response.status_code == 200
+    assert response.json()["email"] == "deadpool@example.com"
+
+
+def test_create_existing_user():
+    create_user("rick@example.com")
+    response = client.post("/users/", json={"email": "rick@example.com", "password": "x"})
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Email already registered"}
+
+
+def test_read_items_keyset_pagination():
+    user = create_user("paging@example.com")
+    for title in ["c", "a", "b", "a", "d"]:
+        client.post(f"/users/{user['id']}/items/", json={"title": title})
+
+    seen = []
+    response = client.get("/items/", params={"limit": 2, "order_by": "title"})
+    while True:
+        assert response.status_code == 200
+        seen += [(item["title"], item["id"]) for item in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+        response = client.get(
+            "/items/", params={"limit": 2, "order_by": "title", "cursor": cursor}
+        )
+    assert seen == sorted(seen)
+    assert len(seen) == len(set(seen)) >= 5
+
+
+def test_read_users_cursor_matches_offset():
+    for i in range(5):
+        create_user(f"cursor{i}@example.com")
+    first = client.get("/users/", params={"limit": 3})
+    cursor = first.headers["X-Next-Cursor"]
+    by_cursor = client.get("/users/", params={"limit": 3, "cursor": cursor})
+    by_offset = client.get("/users/", params={"limit": 3, "skip": 3})
+    assert by_cursor.json() == by_offset.json()
+
+
+def test_empty_pages_have_no_cursor():
+    create_user("emptypage@example.com")
+    for path, params in [
+        ("/users/", {"limit": 0}),
+        ("/items/", {"limit": 0}),
+        ("/items/", {"limit": 0, "order_by": "title"}),
+    ]:
+        response = client.get(path, params=params)
+        assert response.status_code == 200
+        assert response.json() == []
+        assert "X-Next-Cursor" not in response.headers
+
+
+def test_read_items_bad_cursor():
+    response = client.get("/items/", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+    response = client.get("/items/", params={"order_by": "description"})
+    assert response.status_code == 400
+    #Well-formed cursors whose key is not made of scalars
+    for path, cursor in [
+        ("/users/", encode_cursor("id", [{"a": 1}])),
+        ("/items/", encode_cursor("id", [[1]])),
+    ]:
+        response = client.get(path, params={"cursor": cursor})
+        assert response.status_code == 400
+        assert response.json() == {"detail": "Invalid cursor"}
+
+
+def test_read_users_query_count_is_constant():
+    for i in range(3):
+        user = create_user(f"nplusone{i}@example.com")
+        client.post(f"/users/{user['id']}/items/", json={"title": f"item {i}"})
+    for limit in (1, 10, 100):
+        #One query for the users page, one selectin query for all their items
+        with assert_max_queries(engine, 2):
+            response = client.get("/users/", params={"limit": limit})
+        assert response.status_code == 200
+
+
+def test_read_user_single_query():
+    user = create_user("joined@example.com")
+    client.post(f"/users/{user['id']}/items/", json={"title": "joined"})
+    with assert_max_queries(engine, 1):
+        response = client.get(f"/users/{user['id']}")
+    assert [item["title"] for item in response.json()["items"]] == ["joined"]
+
+
+#The async app gets its own in-memory aiosqlite database
+async_engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+TestingAsyncSessionLocal = async_sessionmaker(bind=async_engine, expire_on_commit=False)
+
+async def create_async_tables():
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+asyncio.run(create_async_tables())
+
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
+main_async.app.dependency_overrides[main_async.get_db] = override_get_async_db
+
+async_client = TestClient(main_async.app)
+
+
+def test_async_create_and_read_user():
+    response = async_client.post("/users/", json={"email": "async@example.com", "password": "x"})
+    assert response.status_code == 200
+    user = response.json()
+    assert user["is_active"] is True
+    assert user["items"] == []
+
+    response = async_client.post(f"/users/{user['id']}/items/", json={"title": "async item"})
+    assert response.status_code == 200
+    assert response.json()["owner_id"] == user["id"]
+
+    response = async_client.get(f"/users/{user['id']}")
+    assert [item["title"] for item in response.json()["items"]] == ["async item"]
+
+    response = async_client.post("/users/", json={"email": "async@example.com", "password": "x"})
+    assert response.status_code == 400
+
+
+def test_async_read_items_matches_sync_shape():
+    response = async_client.get("/items/", params={"limit": 1})
+    assert response.status_code == 200
+    assert set(response.json()[0]) == {"id", "title", "description", "owner_id"}
+
+
+def test_async_startup_upgrades_an_existing_database(tmp_path, monkeypatch):
+    #The tables as the first version of models.py created them
+    conn = sqlite3.connect(tmp_path / "old.db")
+    conn.executescript(
+        "CREATE TABLE users (id INTEGER PRIMARY KEY, email VARCHAR UNIQUE, hashed_password VARCHAR, is_active BOOLEAN);"
+        "CREATE TABLE items (id INTEGER PRIMARY KEY, title VARCHAR, description VARCHAR, owner_id INTEGER REFERENCES users(id));"
+        "INSERT INTO users VALUES (1, 'old@example.com', 'x', 1);"
+        "INSERT INTO items VALUES (1, 'legacy plumbus', NULL, 1);"
+    )
+    conn.close()
+    old_engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'old.db'}")
+    monkeypatch.setattr(main_async, "async_engine", old_engine)
+    asyncio.run(main_async.create_tables())
+    asyncio.run(old_engine.dispose())
+
+    conn = sqlite3.connect(tmp_path / "old.db")
+    assert "idempotency_key" in {row[1] for row in conn.execute("PRAGMA table_info(items)")}
+    #The search index was created and backfilled with the existing items
+    assert conn.execute("SELECT rowid FROM items_fts WHERE items_fts MATCH 'plumbus'").fetchall() == [(1,)]
+    conn.close()
+
+
+def test_create_users_bulk_reports_duplicates():
+    create_user("bulk-existing@example.com")
+    users = [
+        {"email": "bulk1@example.com", "password": "x"},
+        {"email": "bulk-existing@example.com", "password": "x"},
+        {"email": "bulk2@example.com", "password": "x"},
+        {"email": "bulk1@example.com", "password": "x"},
+    ]
+    response = client.post("/users/bulk", json=users)
+    assert response.status_code == 200
+    data = response.json()
+    assert [error["index"] for error in data["errors"]] == [1, 3]
+    assert data["ids"][1] is None and data["ids"][3] is None
+    for index in (0, 2):
+        user = client.get(f"/users/{data['ids'][index]}").json()
+        assert user["email"] == users[index]["email"]
+
+
+def test_create_users_bulk_reports_failing_rows():
+    #A failure other than a duplicate email, for one row of the chunk
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "CREATE TRIGGER test_reject_user BEFORE INSERT ON users "
+            "WHEN NEW.email = 'bulk-rejected@example.com' BEGIN SELECT RAISE(ABORT, 'rejected'); END"
+        )
+    users = [
+        {"email": "bulk-accepted0@example.com", "password": "x"},
+        {"email": "bulk-rejected@example.com", "password": "x"},
+        {"email": "bulk-accepted2@example.com", "password": "x"},
+    ]
+    try:
+        response = client.post("/users/bulk", json=users)
+    finally:
+        with engine.begin() as conn:
+            conn.exec_driver_sql("DROP TRIGGER test_reject_user")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["errors"] == [{"index": 1, "detail": "rejected"}]
+    assert data["ids"][1] is None
+    for index in (0, 2):
+        assert client.get(f"/users/{data['ids'][index]}").json()["email"] == users[index]["email"]
+
+
+def test_create_items_bulk():
+    user = create_user("bulk-items@example.com")
+    items = [{"title": f"bulk {i}"} for i in range(1200)]
+    response = client.post(f"/users/{user['id']}/items/bulk", json=items)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["errors"] == []
+    assert len(set(data["ids"])) == 1200
+    titles = [item["title"] for item in client.get(f"/users/{user['id']}").json()["items"]]
+    assert titles == [item["title"] for item in items]
+
+    response = client.post("/users/999999/items/bulk", json=items[:1])
+    assert response.status_code == 404
+
+
+def test_create_items_bulk_reports_failing_rows():
+    user = create_user("bulk-fallback@example.com")
+    #A constraint the schema does not have, so one row of the chunk can violate it
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE UNIQUE INDEX ix_test_unique_title ON items (title) WHERE title LIKE 'fallback %'")
+    try:
+        client.post(f"/users/{user['id']}/items/", json={"title": "fallback taken"})
+        items = [{"title": "fallback 0"}, {"title": "fallback taken"}, {"title": "fallback 2"}]
+        response = client.post(f"/users/{user['id']}/items/bulk", json=items)
+    finally:
+        with engine.begin() as conn:
+            conn.exec_driver_sql("DROP INDEX ix_test_unique_title")
+    assert response.status_code == 200
+    data = response.json()
+    #The chunk failed as a whole and was retried row by row
+    assert [error["index"] for error in data["errors"]] == [1]
+    assert "UNIQUE constraint failed" in data["errors"][0]["detail"]
+    assert data["ids"][1] is None and None not in (data["ids"][0], data["ids"][2])
+    titles = [item["title"] for item in client.get(f"/users/{user['id']}").json()["items"]]
+    assert titles == ["fallback taken", "fallback 0", "fallback 2"]
+
+
+def test_load_engine_profile():
+    name, profile = load_engine_profile({})
+    assert name == "wal" and profile.journal_mode == "WAL"
+
+    name, profile = load_engine_profile(
+        {"SQL_APP_DB_PROFILE": "default", "SQL_APP_DB_CACHE_SIZE": "-2000", "SQL_APP_DB_POOLCLASS": "null"}
+    )
+    assert profile.journal_mode is None
+    assert profile.cache_size == -2000
+    assert profile.poolclass == "null"
+
+    with pytest.raises(ValueError):
+        load_engine_profile({"SQL_APP_DB_PROFILE": "turbo"})
+    #Values end up in PRAGMA statements, only known ones are accepted
+    assert load_engine_profile({"SQL_APP_DB_JOURNAL_MODE": "wal"})[1].journal_mode == "WAL"
+    for variable, value in [
+        ("SQL_APP_DB_JOURNAL_MODE", "WAL; DROP TABLE users"),
+        ("SQL_APP_DB_SYNCHRONOUS", "NORMALL"),
+        ("SQL_APP_DB_CACHE_SIZE", "64MB"),
+        ("SQL_APP_DB_POOLCLASS", "threadlocal"),
+    ]:
+        with pytest.raises(ValueError, match=variable):
+            load_engine_profile({variable: value})
+
+
+def test_lru_cache_eviction_and_ttl():
+    lru = LRUCache(maxsize=2, ttl=60)
+    lru.set("a", 1)
+    lru.set("b", 2)
+    assert lru.get("a") == 1
+    lru.set("c", 3)
+    assert lru.get("b") is MISSING
+    assert lru.stats()["evictions"] == 1
+
+    lru.ttl = -1
+    lru.set("d", 4)
+    assert lru.get("d") is MISSING
+    assert lru.stats()["expirations"] == 1
+
+
+def test_read_user_is_cached_and_invalidated():
+    user = create_user("cached@example.com")
+    client.get(f"/users/{user['id']}")
+    with assert_max_queries(engine, 0):
+        assert client.get(f"/users/{user['id']}").json()["items"] == []
+
+    client.post(f"/users/{user['id']}/items/", json={"title": "fresh"})
+    response = client.get(f"/users/{user['id']}")
+    assert [item["title"] for item in response.json()["items"]] == ["fresh"]
+
+    #A cached "no such user" is dropped once the user exists
+    next_id = user["id"] + 1
+    assert client.get(f"/users/{next_id}").status_code == 404
+    assert create_user("late@example.com")["id"] == next_id
+    assert client.get(f"/users/{next_id}").status_code == 200
+
+
+def test_lazy_session_checks_out_only_when_used():
+    metrics = PoolMetrics(engine)
+    lazy = LazySession(TestingSessionLocal)
+    lazy.close()
+    assert not lazy.opened and metrics.checkouts == 0
+
+    assert lazy.session is lazy.session
+    assert metrics.checkouts == 0
+    crud.get_users(lazy.session, limit=1)
+    lazy.close()
+    assert metrics.stats()["checkouts"] == 1
+    assert metrics.stats()["checked_out"] == 0
+
+
+def test_requests_without_db_take_no_connection():
+    #The real get_db and engine, the override hands out a session up front
+    override = app.dependency_overrides.pop(get_db)
+    try:
+        before = pool_metrics.checkouts
+        client.get("/openapi.json")
+        #get_db runs, but the request is turned away before any query
+        assert client.get("/items/search", params={"q": " "}).status_code == 400
+        assert pool_metrics.checkouts == before
+        client.get("/items/", params={"limit": 1})
+        assert pool_metrics.checkouts > before
+    finally:
+        app.dependency_overrides[get_db] = override
+
+
+def test_handler_background_tasks_run_before_sessions_close(monkeypatch):
+    ran = []
+    close_sessions = main.close_sessions
+    monkeypatch.setattr(main, "close_sessions", lambda state: ran.append("close") or close_sessions(state))
+
+    @app.get("/test-background")
+    def background_route(background_tasks: BackgroundTasks):
+        background_tasks.add_task(ran.append, "task")
+        return {}
+
+    try:
+        assert client.get("/test-background").status_code == 200
+    finally:
+        app.router.routes.pop()
+    #The handler's own task is kept, and runs while the sessions are still open
+    assert ran == ["task", "close"]
+
+
+def test_export_items_ndjson_and_csv():
+    user = create_user("export@example.com")
+    client.post(f"/users/{user['id']}/items/bulk", json=[{"title": f"export, {i}"} for i in range(3)])
+
+    response = client.get("/items/export")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert rows == client.get("/items/", params={"limit": len(rows) + 1}).json()
+
+    response = client.get("/items/export", params={"format": "csv"})
+    lines = list(csv.reader(io.StringIO(response.text)))
+    assert lines[0] == ["id", "title", "description", "owner_id"]
+    assert len(lines) == len(rows) + 1
+    assert ["export, 0", ""] == lines[-3][1:3]
+
+    response = client.get("/users/export", params={"format": "csv"})
+    assert response.text.splitlines()[0] == "id,email,is_active"
+    assert client.get("/users/export", params={"format": "xml"}).status_code == 400
+
+
+#Export one million rows in a child process and compare its peak RSS with a small export
+EXPORT_RSS_SCRIPT = """
+import itertools, resource, sys
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sql_app import crud, export
+db = sessionmaker(bind=create_engine("sqlite:///" + sys.argv[1]))()
+rows = itertools.islice(crud.stream_items(db), int(sys.argv[2]))
+for chunk in export.chunked(export.ndjson_lines(rows, crud.ITEM_EXPORT_COLUMNS)):
+    pass
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+@pytest.mark.skipif(not os.environ.get("SQL_APP_SLOW_TESTS"), reason="set SQL_APP_SLOW_TESTS=1")
+def test_export_peak_rss_is_flat(tmp_path):
+    rows = 1_000_000
+    path = str(tmp_path / "export.db")
+    export_engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=export_engine)
+    with export_engine.begin() as conn:
+        for start in range(0, rows, 50_000):
+            conn.execute(insert(models.Item), [
+                {"title": f"item {i}", "description": "x" * 40, "owner_id": 1}
+                for i in range(start, start + 50_000)
+            ])
+
+    def peak_rss_kb(limit):
+        result = subprocess.run(
+            [sys.executable, "-c", EXPORT_RSS_SCRIPT, path, str(limit)],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        )
+        return int(result.stdout.split()[-1])
+
+    small, full = peak_rss_kb(10_000), peak_rss_kb(rows)
+    assert full - small < 20 * 1024, f"peak RSS grew from {small} KB to {full} KB"
+
+
+def test_crud_queries_do_not_scan():
+    report = inspect_queries()
+    assert report.findings == [], report.format()
+    assert "USING INDEX ix_items_owner_id_id" in report.format()
+
+
+def test_search_items_ranked_and_paged():
+    user = create_user("search@example.com")
+    client.post(f"/users/{user['id']}/items/bulk", json=[
+        {"title": "portal gun", "description": "a gun that makes portals"},
+        {"title": "plumbus", "description": "everyone has a plumbus, even near the portal"},
+        {"title": "meeseeks box", "description": "summons a meeseeks"},
+        {"title": "Portal fluid", "description": None},
+    ])
+    response = client.get("/items/search", params={"q": "portal"})
+    assert response.status_code == 200
+    titles = [item["title"] for item in response.json()]
+    #Title hits outrank a description-only hit
+    assert set(titles[:2]) == {"portal gun", "Portal fluid"} and titles[2] == "plumbus"
+
+    paged = []
+    response = client.get("/items/search", params={"q": "portal", "limit": 1})
+    while "X-Next-Cursor" in response.headers:
+        paged += response.json()
+        response = client.get(
+            "/items/search",
+            params={"q": "portal", "limit": 1, "cursor": response.headers["X-Next-Cursor"]},
+        )
+    paged += response.json()
+    assert [item["title"] for item in paged] == titles
+
+    response = client.get("/items/search", params={"q": "portal", "limit": 0})
+    assert response.status_code == 200
+    assert response.json() == [] and "X-Next-Cursor" not in response.headers
+    cursor = encode_cursor("score", [{"a": 1}, 1])
+    response = client.get("/items/search", params={"q": "portal", "cursor": cursor})
+    assert response.status_code == 400
+
+    #Quotes and operators in the query are matched as plain words
+    assert client.get("/items/search", params={"q": 'gun" OR -x'}).status_code == 200
+    assert client.get("/items/search", params={"q": " "}).status_code == 400
+
+
+def test_search_index_follows_updates():
+    user = create_user("search-update@example.com")
+    item = client.post(f"/users/{user['id']}/items/", json={"title": "squanchy"}).json()
+    db = TestingSessionLocal()
+    db.get(models.Item, item["id"]).title = "birdperson"
+    db.commit()
+    db.close()
+    assert client.get("/items/search", params={"q": "squanchy"}).json() == []
+    assert [i["id"] for i in client.get("/items/search", params={"q": "birdperson"}).json()] == [item["id"]]
+
+
+def test_user_stats_counters_and_reconcile():
+    user = create_user("stats@example.com")
+    other = create_user("stats-other@example.com")
+    assert client.get(f"/users/{user['id']}/stats").json() == {"user_id": user["id"], "item_count": 0}
+
+    client.post(f"/users/{user['id']}/items/", json={"title": "one"})
+    client.post(f"/users/{user['id']}/items/bulk", json=[{"title": "two"}, {"title": "three"}])
+    assert client.get(f"/users/{user['id']}/stats").json()["item_count"] == 3
+    response = client.get("/users/stats", params={"user_id": [user["id"], other["id"]]})
+    assert [row["item_count"] for row in response.json()] == [3, 0]
+    assert client.get("/users/999999/stats").status_code == 404
+
+    db = TestingSessionLocal()
+    item = db.scalars(select(models.Item).where(models.Item.owner_id == user["id"])).first()
+    item.owner_id = other["id"]
+    db.commit()
+    db.delete(db.get(models.Item, item.id))
+    db.commit()
+    assert crud.get_user_stats(db, user["id"]).item_count == 2
+    assert crud.get_user_stats(db, other["id"]).item_count == 0
+
+    #Drift introduced behind the triggers' back is found and repaired
+    db.execute(update(models.UserStats).where(models.UserStats.user_id == user["id"]).values(item_count=7))
+    db.commit()
+    drift = stats.reconcile(db, batch_size=3)
+    assert [(row.user_id, row.stored, row.actual) for row in drift] == [(user["id"], 7, 2)]
+    assert stats.reconcile(db) == []
+    db.close()
+
+
+def test_routing_session_reads_replica_until_it_writes(tmp_path):
+    primary = create_engine(f"sqlite:///{tmp_path / 'primary.db'}")
+    replica = create_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+    Base.metadata.create_all(bind=primary)
+
+    def replicate():
+        source = sqlite3.connect(tmp_path / "primary.db")
+        target = sqlite3.connect(tmp_path / "replica.db")
+        source.backup(target)
+        source.close()
+        target.close()
+
+    replicate()
+    RoutingSessionLocal = sessionmaker(
+        class_=RoutingSession, autoflush=False, bind=primary, replicas=[replica]
+    )
+
+    db = RoutingSessionLocal()
+    user = crud.create_user(db, schemas.UserCreate(email="primary@example.com", password="x"))
+    #Read-your-writes: this session wrote, so it keeps reading the primary
+    assert crud.get_user(db, user.id) is not None
+    db.close()
+
+    db = RoutingSessionLocal()
+    #A fresh session reads the replica, which has not caught up yet
+    assert crud.get_user_by_email(db, "primary@example.com") is None
+    #and a miss the replica answered is not cached
+    cache.invalidate_user(user.id, "primary@example.com")
+    assert cache.get_user(db, user.id) is None
+    assert cache.get_user_by_email(db, "primary@example.com") is None
+    db.close()
+
+    replicate()
+    db = RoutingSessionLocal()
+    assert crud.get_user_by_email(db, "primary@example.com").id == user.id
+    assert cache.get_user_by_email(db, "primary@example.com").id == user.id
+    cache.invalidate_user(user.id, "primary@example.com")
+    crud.create_users_bulk(db, [schemas.UserCreate(email="bulk-primary@example.com", password="x")])
+    assert crud.get_user_by_email(db, "bulk-primary@example.com") is not None
+    db.close()
+    primary.dispose()
+    replica.dispose()
+
+
+def test_hot_lookups_hit_the_compiled_cache():
+    user = create_user("compiled@example.com")
+    db = TestingSessionLocal()
+
+    def lookups(skip):
+        crud.get_user(db, user["id"])
+        crud.get_user_by_email(db, "compiled@example.com")
+        crud.get_items(db, skip=skip, limit=5)
+
+    #The first call compiles, later calls with other values reuse it
+    lookups(0)
+    cache_stats = CompiledCacheStats(engine)
+    for skip in range(1, 4):
+        lookups(skip)
+    db.close()
+    assert cache_stats.stats()["misses"] == 0
+    assert cache_stats.stats()["hit_rate"] == 1.0
+
+
+def test_concurrent_duplicate_signups(tmp_path):
+    signup_engine = create_engine(
+        f"sqlite:///{tmp_path / 'signup.db'}",
+        connect_args={"check_same_thread": False},
+        pool_size=20,
+    )
+    Base.metadata.create_all(bind=signup_engine)
+    SignupSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=signup_engine)
+
+    def get_signup_db():
+        db = SignupSessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = get_signup_db
+    try:
+        barrier = threading.Barrier(20)
+
+        def signup(_):
+            barrier.wait()
+            return client.post("/users/", json={"email": "race@example.com", "password": "x"})
+
+        with ThreadPoolExecutor(max_workers=20) as pool:
+            responses = list(pool.map(signup, range(20)))
+    finally:
+        app.dependency_overrides[get_db] = override_get_db
+    statuses = sorted(response.status_code for response in responses)
+    assert statuses == [200] + [400] * 19
+    assert all(r.json() == {"detail": "Email already registered"} for r in responses if r.status_code == 400)
+    with SignupSessionLocal() as db:
+        assert db.scalar(select(func.count()).select_from(models.User)) == 1
+    signup_engine.dispose()
+
+
+def test_create_item_idempotency_key():
+    user = create_user("idempotent@example.com")
+    headers = {"Idempotency-Key": "order-42"}
+    first = client.post(f"/users/{user['id']}/items/", json={"title": "once"}, headers=headers)
+    etag = client.get("/items/", params={"limit": 1}).headers["ETag"]
+    again = client.post(f"/users/{user['id']}/items/", json={"title": "twice"}, headers=headers)
+    #A replay is not a write, the list keeps its ETag
+    assert client.get("/items/", params={"limit": 1}).headers["ETag"] == etag
+    assert first.status_code == again.status_code == 200
+    assert again.json() == first.json() == {
+        "id": first.json()["id"], "title": "once", "description": None, "owner_id": user["id"],
+    }
+    assert client.get(f"/users/{user['id']}/stats").json()["item_count"] == 1
+    #Without a key every post creates a new item
+    client.post(f"/users/{user['id']}/items/", json={"title": "once"})
+    client.post(f"/users/{user['id']}/items/", json={"title": "once"})
+    assert client.get(f"/users/{user['id']}/stats").json()["item_count"] == 3
+
+
+def test_fast_json_matches_response_model():
+    user = create_user("fastjson@example.com")
+    client.post(f"/users/{user['id']}/items/", json={"title": "fast", "description": "json"})
+    for path, params in [("/users/", {"limit": 2}), ("/items/", {"limit": 2, "order_by": "title"})]:
+        slow = client.get(path, params=params)
+        fast = client.get(path, params={**params, "fast": True})
+        assert fast.status_code == 200
+        assert fast.headers["content-type"] == "application/json"
+        assert fast.json() == slow.json()
+        assert fast.headers["X-Next-Cursor"] == slow.headers["X-Next-Cursor"]
+    #Columns outside the schema, such as hashed_password and idempotency_key, are never sent
+    assert "hashed_password" not in client.get("/users/", params={"fast": True}).text
+    assert "idempotency_key" not in client.get("/items/", params={"fast": True}).text
+
+
+def test_sparse_fieldsets_narrow_query_and_response():
+    user = create_user("sparse@example.com")
+    client.post(f"/users/{user['id']}/items/", json={"title": "sparse", "description": "long text"})
+    #The items version lookup for the ETag, then the narrowed query
+    with assert_max_queries(engine, 2) as counter:
+        response = client.get("/items/", params={"fields": "title,id", "limit": 1})
+    assert response.status_code == 200
+    #Fields come back in schema order
+    assert list(response.json()[0]) == ["title", "id"]
+    assert "description" not in counter.statements[-1]
+    #The sort key is loaded for the cursor even when it is not sent
+    response = client.get("/items/", params={"fields": "id", "order_by": "title", "limit": 1})
+    assert list(response.json()[0]) == ["id"]
+    cursor = response.headers["X-Next-Cursor"]
+    assert client.get("/items/", params={"fields": "id", "order_by": "title", "cursor": cursor}).status_code == 200
+    #Users without items skip the relationship query
+    with assert_max_queries(engine, 1):
+        response = client.get("/users/", params={"fields": "email"})
+    assert {"email": "sparse@example.com"} in response.json()
+    users = client.get("/users/", params={"fields": "id,items"}).json()
+    (row,) = [row for row in users if row["id"] == user["id"]]
+    assert list(row) == ["id", "items"]
+    assert row["items"][0]["title"] == "sparse"
+    for path, fields in [("/items/", "title,hashed_password"), ("/users/", "hashed_password"), ("/items/", ",")]:
+        assert client.get(path, params={"fields": fields}).status_code == 400
+
+
+def test_group_commit_coalesces_concurrent_creates():
+    owners = [create_user(f"group{i}@example.com")["id"] for i in range(2)]
+    committer = GroupCommitter(TestingSessionLocal, window=0.2, max_batch=8)
+    barrier = threading.Barrier(20)
+
+    def submit(i):
+        barrier.wait()
+        return committer.submit(schemas.ItemCreate(title=f"grouped {i}"), owners[i % 2])
+
+    with ThreadPoolExecutor(max_workers=20) as pool:
+        items = list(pool.map(submit, range(20)))
+    committer.close()
+    assert [item.title for item in items] == [f"grouped {i}" for i in range(20)]
+    assert [item.owner_id for item in items] == [owners[i % 2] for i in range(20)]
+    assert len({item.id for item in items}) == 20
+    assert committer.rows == 20 and committer.batches <= 5
+    #Committed rows are visible and counted like any other insert
+    for owner in owners:
+        assert client.get(f"/users/{owner}/stats").json()["item_count"] == 10
+        assert len(client.get(f"/users/{owner}").json()["items"]) == 10
+
+
+def test_group_commit_isolates_a_failing_row(tmp_path):
+    #Foreign keys are enforced here, so a missing owner fails its row's INSERT
+    fk_engine = create_engine(f"sqlite:///{tmp_path}/group.db", connect_args={"check_same_thread": False})
+    event.listen(fk_engine, "connect", lambda conn, _: conn.execute("PRAGMA foreign_keys=ON"))
+    Base.metadata.create_all(bind=fk_engine)
+    FKSessionLocal = sessionmaker(autoflush=False, bind=fk_engine)
+    with FKSessionLocal() as db:
+        owner = crud.create_user(db, schemas.UserCreate(email="group-fk@example.com", password="x")).id
+    committer = GroupCommitter(FKSessionLocal, window=0.2, max_batch=16)
+    barrier = threading.Barrier(8)
+
+    def submit(i):
+        barrier.wait()
+        try:
+            return committer.submit(schemas.ItemCreate(title=f"grouped {i}"), 999999 if i == 3 else owner)
+        except IntegrityError as exc:
+            return exc
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(submit, range(8)))
+    committer.close()
+    #The rows shared a batch, whose INSERT failed and was retried row by row
+    assert committer.batches < 8
+    assert isinstance(results[3], IntegrityError)
+    committed = [result for i, result in enumerate(results) if i != 3]
+    assert [item.title for item in committed] == [f"grouped {i}" for i in range(8) if i != 3]
+    with FKSessionLocal() as db:
+        titles = db.scalars(select(models.Item.title).order_by(models.Item.id)).all()
+    assert sorted(titles) == sorted(item.title for item in committed)
+    fk_engine.dispose()
+
+
+def test_query_metrics_by_crud_function_and_route():
+    metrics = QueryMetrics(Registry(), sample_rate=1.0, slow_seconds=0.0)
+    metrics.attach(engine)
+    try:
+        user = create_user("metered@example.com")
+        client.get("/users/", params={"limit": 5})
+        client.post(f"/users/{user['id']}/items/", json={"title": "metered"})
+        with TestingSessionLocal() as db:
+            db.execute(update(models.Item).where(models.Item.owner_id == user["id"]).values(description="x"))
+            db.commit()
+    finally:
+        metrics.detach(engine)
+    assert metrics.duration.count("get_users", "/users/") == 2
+    assert metrics.duration.count("create_user", "/users/") == 1
+    assert metrics.rows.value("", "") == 1
+    assert metrics.held.count("/users/{user_id}/items/") >= 1
+    #A zero threshold makes every statement slow
+    (slow,) = [query for query in metrics.slow_queries if query["statement"].startswith("INSERT INTO items")]
+    assert slow["route"] == "/users/{user_id}/items/" and slow["function"] == "create_user_item"
+    text = "\n".join(metrics.duration.render())
+    assert 'sql_app_query_duration_seconds_count{function="get_users",route="/users/"} 2' in text
+    assert 'le="+Inf"' in text
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "# TYPE sql_app_query_duration_seconds histogram" in response.text
+
+
+def test_query_metrics_unsampled_and_failed_statements():
+    unsampled = QueryMetrics(Registry(), sample_rate=0.0, slow_seconds=0.0)
+    unsampled.attach(engine)
+    try:
+        client.get("/users/", params={"limit": 5})
+    finally:
+        unsampled.detach(engine)
+    assert unsampled.duration.count("get_users", "/users/") == 0
+    #Slow statements are caught whether or not they were sampled
+    slow = [query for query in unsampled.slow_queries if query["function"] == "get_users"]
+    assert slow and slow[0]["route"] == "/users/" and slow[0]["statement"].startswith("SELECT")
+    assert unsampled.slow.value("get_users", "/users/") == len(slow)
+
+    metrics = QueryMetrics(Registry(), sample_rate=1.0)
+    metrics.attach(engine)
+    try:
+        with engine.connect() as conn:
+            with pytest.raises(OperationalError):
+                conn.exec_driver_sql("SELECT * FROM no_such_table")
+            conn.rollback()
+            #The failed statement left no start time behind to be taken by the next one
+            assert not any(key.startswith("query") for key in conn.info)
+            conn.exec_driver_sql("SELECT 1")
+    finally:
+        metrics.detach(engine)
+    assert metrics.duration.count("", "") == 1
+
+
+def test_items_sharded_by_owner(tmp_path, monkeypatch):
+    def shard_engines(count):
+        return {
+            f"sqlite:///{tmp_path}/items{i}.db": create_engine(f"sqlite:///{tmp_path}/items{i}.db")
+            for i in range(count)
+        }
+
+    shard_set = ShardSet(shard_engines(3), engine, block_size=4)
+    monkeypatch.setattr(main, "shard_set", shard_set)
+    owners = [create_user(f"sharded{i}@example.com")["id"] for i in range(8)]
+    ids = []
+    for i, owner in enumerate(owners):
+        for n in range(i % 3 + 1):
+            response = client.post(f"/users/{owner}/items/", json={"title": f"shard {owner}-{n}"})
+            ids.append(response.json()["id"])
+    assert len(set(ids)) == len(ids)
+    #Every owner's items sit in the one shard the ring places it on
+    for url, shard_engine in shard_set.engines.items():
+        with shard_engine.connect() as conn:
+            stored = conn.scalars(select(models.Item.owner_id).distinct()).all()
+        assert all(shard_set.shard_for(owner) == url for owner in stored)
+
+    #Global listing fans out and merges, paging included
+    seen = []
+    response = client.get("/items/", params={"limit": 5})
+    while True:
+        seen += [item["id"] for item in response.json()]
+        if "X-Next-Cursor" not in response.headers:
+            break
+        response = client.get("/items/", params={"limit": 5, "cursor": response.headers["X-Next-Cursor"]})
+    assert seen == sorted(ids)
+    assert [item["id"] for item in client.get("/items/", params={"skip": 3, "limit": 4}).json()] == seen[3:7]
+    titles = [item["title"] for item in client.get("/items/", params={"order_by": "title"}).json()]
+    assert titles == sorted(titles)
+    assert len(client.get("/items/search", params={"q": "shard"}).json()) == len(ids)
+
+    user = client.get(f"/users/{owners[2]}").json()
+    assert [item["title"] for item in user["items"]] == [f"shard {owners[2]}-{n}" for n in range(3)]
+    assert client.get(f"/users/{owners[2]}/stats").json()["item_count"] == 3
+    listed = {row["id"]: row for row in client.get("/users/", params={"limit": 1000}).json()}
+    assert len(listed[owners[1]]["items"]) == 2
+    stats = client.get("/users/stats", params={"user_id": owners[:3]}).json()
+    assert [row["item_count"] for row in stats] == [1, 2, 3]
+
+    #A fourth shard takes over part of the ring, rebalancing moves those owners' rows
+    grown = ShardSet({**shard_set.engines, **dict(list(shard_engines(4).items())[3:])}, engine, block_size=4)
+    #Which owners the new shard takes depends on the hash of its URL, which holds tmp_path
+    expected = {owner for owner in owners if grown.shard_for(owner) != shard_set.shard_for(owner)}
+    moves = rebalance(grown)
+    assert {owner for owner, _, _, _ in moves} == expected
+    assert all(target == f"sqlite:///{tmp_path}/items3.db" for _, _, target, _ in moves)
+    assert rebalance(grown) == []
+    monkeypatch.setattr(main, "shard_set", grown)
+    assert [item["id"] for item in client.get("/items/", params={"limit": 1000}).json()] == sorted(ids)
+    for i, owner in enumerate(owners):
+        assert client.get(f"/users/{owner}/stats").json()["item_count"] == i % 3 + 1
+    grown.dispose()
+
+
+def test_sharded_item_queries_are_metered(tmp_path, monkeypatch):
+    urls = [f"sqlite:///{tmp_path}/metered{i}.db" for i in range(2)]
+    shard_set = ShardSet({url: create_engine(url) for url in urls}, engine)
+    monkeypatch.setattr(main, "shard_set", shard_set)
+    monkeypatch.setattr(main.query_metrics, "sample_rate", 1.0)
+    #What main does at import for the SQL_APP_ITEM_SHARDS engines
+    main.meter_engines(shard_set.engines.values())
+    try:
+        before = main.query_metrics.duration.count("get_items", "/items/")
+        client.get("/items/", params={"limit": 5})
+        #The listing fans out, one get_items per shard
+        assert main.query_metrics.duration.count("get_items", "/items/") == before + 2
+    finally:
+        for shard_engine in shard_set.engines.values():
+            main.query_metrics.detach(shard_engine)
+        shard_set.dispose()
+    response = client.get("/metrics")
+    assert 'sql_app_query_duration_seconds_count{function="get_items",route="/items/"}' in response.text
+
+
+def test_item_lists_answer_conditional_gets():
+    user = create_user("etag@example.com")
+    response = client.get("/items/", params={"limit": 5})
+    etag = response.headers["ETag"]
+    #Only the version lookup runs for an unchanged list
+    with assert_max_queries(engine, 1):
+        cached = client.get("/items/", params={"limit": 5}, headers={"If-None-Match": f'W/{etag}, "other"'})
+    assert cached.status_code == 304 and cached.content == b""
+    assert cached.headers["ETag"] == etag
+    assert client.get("/items/search", params={"q": "anything"}).headers["ETag"] == etag
+    #Every write path bumps the version, the bulk insert included
+    client.post(f"/users/{user['id']}/items/bulk", json=[{"title": "etag"}])
+    response = client.get("/items/", params={"limit": 5}, headers={"If-None-Match": etag})
+    assert response.status_code == 200 and response.headers["ETag"] != etag
+    #Last-Modified is only sent once the last write is in an earlier second
+    with TestingSessionLocal() as db:
+        version, modified_at = crud.get_items_version([db])
+    assert "Last-Modified" not in conditional.validators(version, modified_at, now=modified_at)
+    headers = conditional.validators(version, modified_at, now=modified_at + 1)
+
+    def request(headers):
+        return Request({"type": "http", "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()]})
+
+    assert conditional.is_not_modified(request({"If-Modified-Since": headers["Last-Modified"]}), headers)
+    assert not conditional.is_not_modified(request({"If-Modified-Since": "Thu, 01 Jan 1970 00:00:00 GMT"}), headers)
+    #If-None-Match wins over If-Modified-Since
+    assert not conditional.is_not_modified(
+        request({"If-None-Match": '"other"', "If-Modified-Since": headers["Last-Modified"]}), headers
+    )
+
+
+def test_request_metrics_by_route_template(monkeypatch):
+    metrics = main.request_metrics
+    user = create_user("timed@example.com")
+    before = metrics.responses.value("GET", "/users/{user_id}", "200")
+    client.get(f"/users/{user['id']}")
+    client.get(f"/users/{user['id'] + 1000}")
+    client.get("/no/such/route")
+    assert metrics.responses.value("GET", "/users/{user_id}", "200") == before + 1
+    assert metrics.responses.value("GET", "/users/{user_id}", "404") >= 1
+    assert metrics.responses.value("GET", "unmatched", "404") >= 1
+    assert metrics.duration.count("GET", "/users/{user_id}") >= 2
+    #Raised by the dependency, lowered once the response is done
+    assert metrics.in_flight.value("GET", "/users/{user_id}") == 0
+    assert "server-timing" not in client.get("/items/").headers
+    monkeypatch.setattr(metrics, "server_timing", True)
+    assert client.get("/items/").headers["server-timing"].startswith("app;dur=")
+    assert 'http_responses_total{method="GET",route="/users/{user_id}",status="200"}' in client.get("/metrics").text
@@ -0,0 +1,31 @@
+#Change tracking for conditional GETs
+##Triggers bump the items row of table_versions on every insert, update and delete, so a
+##list endpoint can tell whether anything changed with one primary key lookup instead of
+##running its query. Every write path counts, bulk inserts and other processes included.
+from sqlalchemy import event, inspect, text
+
+from .database import Base
+
+#Unix time with millisecond resolution, the same value time.time() would give
+NOW = "((julianday('now') - 2440587.5) * 86400.0)"
+
+TRIGGERS = tuple(
+	f"CREATE TRIGGER IF NOT EXISTS items_version_{operation.lower()} AFTER {operation} ON items BEGIN "
+	f"UPDATE table_versions SET version = version + 1, modified_at = {NOW} WHERE name = 'items'; "
+	"END"
+	for operation in ("INSERT", "UPDATE", "DELETE")
+)
+
+SEED = f"INSERT OR IGNORE INTO table_versions(name, version, modified_at) VALUES ('items', 0, {NOW})"
+
+#Runs after create_all; the primary of a sharded setup can be created without items
+@event.listens_for(Base.metadata, "after_create")
+def create_version_triggers(target, connection, tables=(), **kw):
+	if connection.dialect.name != "sqlite":
+		return
+	inspector = inspect(connection)
+	if not (inspector.has_table("items") and inspector.has_table("table_versions")):
+		return
+	connection.execute(text(SEED))
+	for statement in TRIGGERS:
+		connection.execute(text(statement))